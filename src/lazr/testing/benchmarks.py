@@ -0,0 +1,376 @@
+"""Benchmarks for the hot paths of the JavaScript test layers.
+
+Run them with::
+
+  make benchmark BENCHMARK_OPTIONS="--save benchmarks.json"
+
+and compare a later run with the saved results::
+
+  make benchmark BENCHMARK_OPTIONS="--compare benchmarks.json"
+
+Every measure is the best of several repeats, and lower is better, so
+that runs on the same machine can be compared. A measure more than
+C{--tolerance} worse than the saved one is reported as a regression,
+and makes the run exit with a non-zero status, as does importing the
+layer modules taking longer than C{--import-budget}. Run the module
+with C{--help} for the options shaping the synthetic output.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import socket
+import resource
+import tempfile
+import unittest
+import subprocess
+import multiprocessing
+
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+def makeJsTestDriverReports(directory, tests=1000, cases=10, browsers=1,
+                            failure_rate=0.1, error_rate=0.05,
+                            output_size=0, seed=0):
+    """Write synthetic I{JsTestDriver} XML reports to C{directory}.
+
+    The C{tests} are spread across C{cases} test cases, each written to
+    its own report for each of the C{browsers}, as I{JsTestDriver} does.
+    Tests fail or error at the given rates, and each test writes
+    C{output_size} bytes to C{system-out}. The same arguments always
+    produce the same reports.
+
+    Returns the paths of the reports.
+    """
+    rng = random.Random(seed)
+    output = "x" * output_size
+    paths = []
+    for browser_index in range(browsers):
+        browser = "Browser%d_1_0_Linux" % browser_index
+        for case_index in range(cases):
+            case = "Case%dTestCase" % case_index
+            path = os.path.join(directory, "TEST-%s.%s.xml" % (browser, case))
+            report = open(path, "w")
+            try:
+                report.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                             '<testsuite>')
+                for test_index in range(case_index, tests, cases):
+                    report.write(
+                        '<testcase classname="%s.%s" name="test%d"'
+                        ' time="%.3f">' %
+                        (browser, case, test_index, rng.random()))
+                    draw = rng.random()
+                    if draw < failure_rate:
+                        report.write(
+                            '<failure type="failed" message="expected 1 but'
+                            ' was 2">at test%d (case.js:1)\n  at run'
+                            ' (jstestdriver.js:2)</failure>' % test_index)
+                    elif draw < failure_rate + error_rate:
+                        report.write(
+                            '<error type="error">ReferenceError: y is not'
+                            ' defined\n  at test%d (case.js:3)</error>' %
+                            test_index)
+                    if output:
+                        report.write("<system-out>%s</system-out>" % output)
+                    report.write("</testcase>")
+                report.write("</testsuite>")
+            finally:
+                report.close()
+            paths.append(path)
+    return paths
+
+
+def makeSubunitStream(tests=1000, failure_rate=0.1, seed=0):
+    """Return a synthetic subunit stream, as written by a I{Yeti} client.
+    """
+    rng = random.Random(seed)
+    lines = []
+    for index in range(tests):
+        name = "Browser.test_%d.html.test%d" % (index % 20, index)
+        lines.append("time: 2010-09-06 12:00:%02d.000000Z\n" % (index % 60))
+        lines.append("test: %s\n" % name)
+        if rng.random() < failure_rate:
+            lines.append("failure: %s [\nexpected 1 but was 2\n]\n" % name)
+        else:
+            lines.append("success: %s\n" % name)
+    return "".join(lines)
+
+
+def best(function, repeat):
+    """Return the shortest time C{function()} took in C{repeat} calls."""
+    timings = []
+    for index in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def inChild(function, *args):
+    """Call C{function(*args)} in a child process and return its result.
+
+    The child starts from a copy of the current process, so the peak
+    memory it reports only grows with what the call allocates.
+    """
+    queue = multiprocessing.Queue()
+
+    def run():
+        queue.put(function(*args))
+    child = multiprocessing.Process(target=run)
+    child.start()
+    value = queue.get()
+    child.join()
+    return value
+
+
+def benchParse(options):
+    """Time L{JsTestDriverResultParser} on synthetic reports."""
+    from lazr.testing.jstestdriver import parseResultFile
+    directory = tempfile.mkdtemp(prefix="lazr-benchmark-")
+    try:
+        paths = makeJsTestDriverReports(
+            directory, options.tests, options.cases, options.browsers,
+            options.failure_rate, options.error_rate, options.output_size)
+        size = sum(os.path.getsize(path) for path in paths)
+
+        def parse():
+            for path in paths:
+                parseResultFile(path)
+        seconds = best(parse, options.repeat)
+    finally:
+        shutil.rmtree(directory)
+    count = options.tests * options.browsers
+    return {"seconds": seconds,
+            "tests_per_second": count / seconds,
+            "mb_per_second": size / seconds / 1024 / 1024}
+
+
+def _reportPeak(options):
+    from lazr.testing.jstestdriver import JsTestDriverTestCase
+
+    class BenchmarkTest(JsTestDriverTestCase):
+        config_filename = None
+
+    test = BenchmarkTest("runTest")
+    test.setUp()
+    try:
+        makeJsTestDriverReports(
+            test.output_dir, options.tests, options.cases, options.browsers,
+            options.failure_rate, options.error_rate, options.output_size)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        test._reportResults(unittest.TestResult())
+        seconds = time.time() - start
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        test.tearDown()
+    return seconds, after - before
+
+
+def benchReport(options):
+    """Measure the time and peak memory of reporting synthetic reports.
+    """
+    runs = [inChild(_reportPeak, options) for index in range(options.repeat)]
+    return {"seconds": min(seconds for seconds, peak in runs),
+            "peak_kb": min(peak for seconds, peak in runs)}
+
+
+def benchSubunit(options):
+    """Time reporting synthetic Yeti subunit streams to a result."""
+    from cStringIO import StringIO
+    from lazr.testing.yeti import multiplexStreams
+    stream = makeSubunitStream(options.tests, options.failure_rate)
+
+    def report():
+        streams = [StringIO(stream) for index in range(options.browsers)]
+        multiplexStreams(streams, unittest.TestResult())
+    seconds = best(report, options.repeat)
+    return {"seconds": seconds,
+            "tests_per_second": options.tests * options.browsers / seconds}
+
+
+def freePort():
+    """Return a TCP port nothing is listening on, for now."""
+    listener = socket.socket()
+    try:
+        listener.bind(("localhost", 0))
+        return listener.getsockname()[1]
+    finally:
+        listener.close()
+
+
+def benchLayers(options):
+    """Time the setUp and tearDown of the layers, with stand-in servers.
+
+    The servers of L{lazr.testing.standins} take C{--server-delay}
+    seconds to start.
+    """
+    from lazr.testing.jstestdriver import JsTestDriverLayer
+    from lazr.testing.standins import jsTestDriverCommand, yetiCommand
+    from lazr.testing.yeti import YetiLayer
+    saved = dict(os.environ)
+    try:
+        for key in ["JSTESTDRIVER_SERVER", "JSTESTDRIVER_SERVERS",
+                    "JSTESTDRIVER_DAEMON", "JSTESTDRIVER_BROWSER_COUNT",
+                    "YETI_SERVER", "LAZR_TESTING_TIMINGS"]:
+            os.environ.pop(key, None)
+        os.environ.update({
+            "JSTESTDRIVER": jsTestDriverCommand(),
+            "JSTESTDRIVER_BROWSER": "standin",
+            "YETI": yetiCommand(),
+            "LAZR_TESTING_STANDIN_START_DELAY": str(options.server_delay)})
+        results = {}
+        for name, layer, port_key in [
+            ("jstestdriver", JsTestDriverLayer, "JSTESTDRIVER_PORT"),
+            ("yeti", YetiLayer, "YETI_PORT")]:
+            set_ups = []
+            tear_downs = []
+            for index in range(options.repeat):
+                os.environ[port_key] = str(freePort())
+                start = time.time()
+                layer.setUp()
+                set_ups.append(time.time() - start)
+                start = time.time()
+                layer.tearDown()
+                tear_downs.append(time.time() - start)
+            results["%s_setup_seconds" % name] = min(set_ups)
+            results["%s_teardown_seconds" % name] = min(tear_downs)
+        return results
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+# The modules only imported once the layers or test cases need them.
+LAZY_MODULES = ("mocker", "multiprocessing", "subunit", "testtools",
+                "zope.testrunner")
+
+IMPORT_SCRIPT = """\
+import sys, time
+start = time.time()
+import lazr.testing.jstestdriver, lazr.testing.yeti
+print time.time() - start
+print " ".join(sorted(sys.modules))
+"""
+
+
+def importModules():
+    """Import the layer modules in a fresh interpreter.
+
+    Returns how long the import took, in seconds, and the names of all
+    the modules loaded then.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    proc = subprocess.Popen([sys.executable, "-c", IMPORT_SCRIPT],
+                            stdout=subprocess.PIPE, env=env)
+    stdout = proc.communicate()[0]
+    if proc.returncode != 0:
+        raise RuntimeError("Failed to import the layer modules")
+    seconds, modules = stdout.splitlines()
+    return float(seconds), modules.split()
+
+
+def benchImport(options):
+    """Time importing the layer modules, which must stay cheap."""
+    seconds = min(importModules()[0] for index in range(options.repeat))
+    return {"seconds": seconds}
+
+
+BENCHMARKS = [("import", benchImport),
+              ("parse", benchParse),
+              ("report", benchReport),
+              ("subunit", benchSubunit),
+              ("layers", benchLayers)]
+
+# The measures for which higher is better, left out of comparisons.
+RATES = ("tests_per_second", "mb_per_second")
+
+
+def compare(results, saved, tolerance):
+    """Return the measures of C{results} worse than in C{saved}.
+
+    Returns a list of C{(benchmark, measure, saved, current)} for the
+    measures more than C{tolerance} (a fraction) worse than saved.
+    """
+    regressions = []
+    for benchmark, measures in sorted(results.items()):
+        for measure, value in sorted(measures.items()):
+            if measure in RATES:
+                continue
+            previous = saved.get(benchmark, {}).get(measure)
+            if previous is None:
+                continue
+            if value > previous * (1 + tolerance):
+                regressions.append((benchmark, measure, previous, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog [options] [benchmark...]")
+    parser.add_option("--tests", type="int", default=10000,
+                      help="number of tests per browser")
+    parser.add_option("--cases", type="int", default=100,
+                      help="number of test cases")
+    parser.add_option("--browsers", type="int", default=1,
+                      help="number of browsers")
+    parser.add_option("--failure-rate", type="float", default=0.1)
+    parser.add_option("--error-rate", type="float", default=0.05)
+    parser.add_option("--output-size", type="int", default=0,
+                      help="bytes of system-out per test")
+    parser.add_option("--server-delay", type="float", default=0.0,
+                      help="seconds the stand-in servers take to start")
+    parser.add_option("--repeat", type="int", default=3)
+    parser.add_option("--save", metavar="FILE",
+                      help="save the results as JSON to FILE")
+    parser.add_option("--compare", metavar="FILE",
+                      help="compare the results with the ones in FILE")
+    parser.add_option("--tolerance", type="float", default=0.1,
+                      help="fraction a measure can get worse by")
+    parser.add_option("--import-budget", type="float", default=0.25,
+                      help="seconds importing the layer modules can take")
+    options, names = parser.parse_args(argv)
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        results[name] = benchmark(options)
+        for measure, value in sorted(results[name].items()):
+            print "%-10s %-30s %12.4f" % (name, measure, value)
+    status = 0
+    if "import" in results:
+        seconds = results["import"]["seconds"]
+        if seconds > options.import_budget:
+            print "OVER BUDGET import seconds: %.4f > %.4f" % (
+                seconds, options.import_budget)
+            status = 1
+    if options.save:
+        saved_file = open(options.save, "w")
+        try:
+            json.dump(results, saved_file, indent=2, sort_keys=True)
+        finally:
+            saved_file.close()
+    if options.compare:
+        saved_file = open(options.compare)
+        try:
+            saved = json.load(saved_file)
+        finally:
+            saved_file.close()
+        regressions = compare(results, saved, options.tolerance)
+        for benchmark, measure, previous, value in regressions:
+            print "REGRESSION %s %s: %.4f -> %.4f" % (
+                benchmark, measure, previous, value)
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
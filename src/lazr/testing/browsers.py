@@ -0,0 +1,322 @@
+"""Start headless browsers, each with its own throwaway profile.
+
+With C{JSTESTDRIVER_BROWSER} or C{YETI_BROWSER} set to C{headless}, the
+layers capture headless browsers started here, instead of opening
+tabs in the default desktop browser through L{browser_wrapper}:
+
+  - C{LAZR_TESTING_HEADLESS_BROWSER} is the browser command, by
+    default the first of Chromium, Google Chrome or Firefox found in
+    the C{PATH}.
+  - C{LAZR_TESTING_PROFILE_DIR} is where the profiles are created, by
+    default C{/dev/shm} when it's there, so that they're kept in
+    memory.
+
+Every browser started is recorded in the daemon state directory, so
+that the browsers left behind by a run that was killed are stopped by
+the next one.
+"""
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import shutil
+import signal
+import tempfile
+import subprocess
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lazr.testing.daemon import defaultStateDir, isAlive, makeStateDir
+from lazr.testing.tempdirs import volatileDir
+
+
+# The browsers looked for in the PATH, in order of preference.
+BROWSERS = ("chromium", "chromium-browser", "google-chrome", "firefox")
+
+# The prefix of the names of the profile directories of the browsers.
+PROFILE_PREFIX = "lazr-browser-"
+
+
+def findExecutable(name):
+    """Return the path of the executable C{name} in the C{PATH}, if any."""
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def browserCommand():
+    """Return the command starting the headless browser, as a list."""
+    command = os.environ.get("LAZR_TESTING_HEADLESS_BROWSER")
+    if command:
+        return command.split()
+    for name in BROWSERS:
+        path = findExecutable(name)
+        if path is not None:
+            return [path]
+    raise ValueError(
+        "No headless browser found, set LAZR_TESTING_HEADLESS_BROWSER")
+
+
+def headlessCommand(command, profile, url):
+    """Return C{command} opening C{url} headless, using C{profile}.
+
+    Firefox is told apart by the name of its executable, anything else
+    is given the options of Chromium.
+    """
+    if "firefox" in os.path.basename(command[0]):
+        return command + ["-headless", "-no-remote", "-profile", profile,
+                          url]
+    return command + ["--headless",
+                      "--disable-gpu",
+                      "--no-first-run",
+                      "--no-default-browser-check",
+                      "--user-data-dir=%s" % profile,
+                      url]
+
+
+def profileRoot():
+    """Return the directory where the browser profiles are created."""
+    root = os.environ.get("LAZR_TESTING_PROFILE_DIR")
+    if root:
+        return root
+    return volatileDir()
+
+
+def isProfile(path):
+    """Return whether C{path} may be a profile made by a L{Browser}."""
+    path = os.path.normpath(os.path.abspath(path))
+    root = os.path.normpath(os.path.abspath(profileRoot()))
+    return (os.path.dirname(path) == root and
+            os.path.basename(path).startswith(PROFILE_PREFIX))
+
+
+def runsWith(pid, argument):
+    """Return whether process C{pid} was started with C{argument}.
+
+    Tells whether a recorded process id still belongs to the browser,
+    on systems with a C{/proc}. Elsewhere, it's assumed not to.
+    """
+    try:
+        cmdline = open("/proc/%d/cmdline" % pid).read()
+    except IOError:
+        return False
+    return argument in cmdline
+
+
+class BrowserRegistry(object):
+    """Record the browsers started, and by which process.
+
+    The records are kept in a JSON file under C{state_dir}, protected
+    by a lock file, and shared by all the test runs of the user.
+    """
+
+    def __init__(self, state_dir=None):
+        if state_dir is None:
+            state_dir = defaultStateDir()
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, "browsers.json")
+        self.lock_path = os.path.join(state_dir, "browsers.lock")
+
+    def _lock(self):
+        """Take the lock on the records. Closing the result frees it."""
+        makeStateDir(self.state_dir)
+        lock = open(self.lock_path, "a")
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        return lock
+
+    def read(self):
+        """Return the records, as a list of dicts."""
+        try:
+            records_file = open(self.path)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+        try:
+            try:
+                records = json.load(records_file)
+            except ValueError:
+                return []
+        finally:
+            records_file.close()
+        if not isinstance(records, list):
+            return []
+        return records
+
+    def _write(self, records):
+        temp_path = "%s.%d" % (self.path, os.getpid())
+        records_file = open(temp_path, "w")
+        try:
+            json.dump(records, records_file)
+        finally:
+            records_file.close()
+        os.rename(temp_path, self.path)
+
+    def add(self, pid, profile):
+        """Record browser C{pid}, using C{profile}, as ours."""
+        lock = self._lock()
+        try:
+            records = self.read()
+            records.append(
+                {"pid": pid, "profile": profile, "owner": os.getpid()})
+            self._write(records)
+        finally:
+            lock.close()
+
+    def remove(self, pid):
+        lock = self._lock()
+        try:
+            self._write([record for record in self.read()
+                         if record["pid"] != pid])
+        finally:
+            lock.close()
+
+    def cleanStale(self):
+        """Stop the browsers whose owner died, and remove their profiles.
+
+        Returns the records of the browsers cleaned up.
+        """
+        lock = self._lock()
+        try:
+            records = self.read()
+            stale = [record for record in records
+                     if not isAlive(record["owner"])]
+            for record in stale:
+                # Only what looks like our own browsers is cleaned up,
+                # whatever the records say.
+                if not isProfile(record["profile"]):
+                    continue
+                if runsWith(record["pid"], record["profile"]):
+                    try:
+                        os.kill(record["pid"], signal.SIGKILL)
+                    except OSError, e:
+                        if e.errno != errno.ESRCH:
+                            raise
+                shutil.rmtree(record["profile"], ignore_errors=True)
+            if stale:
+                self._write([record for record in records
+                             if record not in stale])
+        finally:
+            lock.close()
+        return stale
+
+
+class Browser(object):
+    """A headless browser opening C{url}, with a fresh profile."""
+
+    # Seconds to wait for the browser to exit before killing it.
+    kill_delay = 5
+
+    def __init__(self, url, command=None, registry=None):
+        if command is None:
+            command = browserCommand()
+        self.url = url
+        self.registry = registry
+        self.profile = tempfile.mkdtemp(prefix=PROFILE_PREFIX,
+                                        dir=profileRoot())
+        devnull = open(os.devnull, "r+")
+        try:
+            self.proc = subprocess.Popen(
+                headlessCommand(command, self.profile, url),
+                stdin=devnull, stdout=devnull, stderr=devnull,
+                close_fds=True)
+        except:
+            shutil.rmtree(self.profile, ignore_errors=True)
+            raise
+        finally:
+            devnull.close()
+        self.pid = self.proc.pid
+        if registry is not None:
+            registry.add(self.pid, self.profile)
+
+    def isRunning(self):
+        return self.proc.poll() is None
+
+    def stop(self):
+        """Stop the browser, and remove its profile."""
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            deadline = time.time() + self.kill_delay
+            while self.proc.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if self.proc.poll() is None:
+                self.proc.kill()
+                self.proc.wait()
+        shutil.rmtree(self.profile, ignore_errors=True)
+        if self.registry is not None:
+            self.registry.remove(self.pid)
+
+
+class BrowserPool(object):
+    """Keep C{count} headless browsers opening C{url}.
+
+    The browsers left behind by dead test runs are cleaned up when the
+    pool starts.
+    """
+
+    def __init__(self, url, count=1, command=None, registry=None):
+        if command is None:
+            command = browserCommand()
+        if registry is None:
+            registry = BrowserRegistry()
+        self.url = url
+        self.count = count
+        self.command = command
+        self.registry = registry
+        self.browsers = []
+
+    def start(self):
+        self.registry.cleanStale()
+        try:
+            while len(self.browsers) < self.count:
+                self.browsers.append(
+                    Browser(self.url, self.command, self.registry))
+        except:
+            self.stop()
+            raise
+
+    def restart(self):
+        """Start new browsers in place of the ones that exited.
+
+        Returns the number of browsers restarted.
+        """
+        restarted = 0
+        for index, browser in enumerate(self.browsers):
+            if not browser.isRunning():
+                browser.stop()
+                self.browsers[index] = Browser(self.url, self.command,
+                                               self.registry)
+                restarted += 1
+        return restarted
+
+    def stop(self):
+        for browser in self.browsers:
+            browser.stop()
+        self.browsers = []
+
+
+def main(args=None):
+    """Run a headless browser opening the URL in C{args}, until killed.
+
+    This is what I{JsTestDriver} runs as its browser, through
+    L{headless_wrapper}.
+    """
+    if args is None:
+        args = sys.argv[1:]
+    browser = Browser(args[0], registry=BrowserRegistry())
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        browser.proc.wait()
+    finally:
+        browser.stop()
+    return 0
@@ -0,0 +1,119 @@
+import os
+import errno
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from lazr.testing.jsconfig import JsTestDriverConfig
+
+
+def configDigest(config_filename, extra=()):
+    """Return a digest of a configuration and of every file it uses.
+
+    The digest covers the configuration file itself, the files it
+    loads, tests and serves (after expanding patterns, so adding a file
+    matching a pattern changes it too), and the C{extra} strings.
+    """
+    config = JsTestDriverConfig(config_filename)
+    paths = [config.filename] + config.sourceFiles()
+    for path in config.files("serve"):
+        if path not in paths:
+            paths.append(path)
+    digest = sha1()
+    for value in extra:
+        digest.update("%s\0" % value)
+    for path in paths:
+        digest.update("%s\0" % path)
+        source = open(path, "rb")
+        try:
+            while True:
+                chunk = source.read(65536)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        finally:
+            source.close()
+        digest.update("\0")
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """Remember the results of running I{JsTestDriver} configurations.
+
+    There's one entry per configuration file, holding the digest of the
+    configuration and its files when the results were recorded, so an
+    entry is only used while nothing changed, and is replaced as soon
+    as something did.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, config_filename):
+        name = sha1(os.path.abspath(config_filename)).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def _load(self, config_filename, digest):
+        try:
+            entry_file = open(self._path(config_filename))
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            try:
+                entry = json.load(entry_file)
+            except ValueError:
+                return None
+        finally:
+            entry_file.close()
+        if entry.get("digest") != digest:
+            return None
+        return entry
+
+    def get(self, config_filename, digest):
+        """Return the results recorded for C{digest}, or C{None}."""
+        entry = self._load(config_filename, digest)
+        if entry is None:
+            return None
+        return entry["results"]
+
+    def getCoverage(self, config_filename, digest):
+        """Return the coverage recorded for C{digest}, or C{None}."""
+        entry = self._load(config_filename, digest)
+        if entry is None:
+            return None
+        return entry.get("coverage")
+
+    def put(self, config_filename, digest, results, coverage=None):
+        """Record C{results}, a list of mappings, for C{digest}.
+
+        If given, C{coverage} is recorded along with them, as returned
+        by L{CoverageData.toRecords}.
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        path = self._path(config_filename)
+        temp_path = "%s.%d" % (path, os.getpid())
+        entry_file = open(temp_path, "w")
+        try:
+            entry = {"config": os.path.abspath(config_filename),
+                     "digest": digest,
+                     "results": results}
+            if coverage is not None:
+                entry["coverage"] = coverage
+            json.dump(entry, entry_file)
+        finally:
+            entry_file.close()
+        os.rename(temp_path, path)
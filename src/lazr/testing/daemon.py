@@ -0,0 +1,266 @@
+import os
+import sys
+import time
+import errno
+import fcntl
+import signal
+import stat
+import tempfile
+import subprocess
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lazr.testing.watcher import probePort
+
+
+def defaultStateDir():
+    """Return the directory where daemon state is kept for this user."""
+    return os.path.join(tempfile.gettempdir(),
+                        "lazr.testing-%d" % os.getuid())
+
+
+def makeStateDir(path):
+    """Create the state directory C{path}, or check that it's ours.
+
+    The default one has a predictable name, in a directory shared by
+    all the users, so it's only trusted if it's a directory owned by
+    the current user, that nobody else can access. Otherwise, anybody
+    could record processes to kill, or files to remove, in it. A
+    C{ValueError} is raised if it's not.
+    """
+    try:
+        os.makedirs(path, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    info = os.lstat(path)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+        stat.S_IMODE(info.st_mode) & 077):
+        raise ValueError(
+            "State directory %s must be a directory owned by user %d, and"
+            " only accessible by them" % (path, os.getuid()))
+
+
+def isAlive(pid):
+    """Check whether a process with the given C{pid} exists."""
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class ServerDaemon(object):
+    """Share a long-running I{JsTestDriver} server between test runs.
+
+    The first run starts the server under a detached supervisor process
+    and leaves it running. Every process using the server is recorded
+    as a holder in a state file protected by a lock file, so later runs
+    and layer setUps attach to the warm server instead of starting a
+    new one. The supervisor stops the server once it had no holders
+    for C{idle_timeout} seconds, or as soon as the server dies.
+    """
+
+    def __init__(self, port, idle_timeout, config=None, state_dir=None):
+        if state_dir is None:
+            state_dir = defaultStateDir()
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.config = config
+        self.state_dir = state_dir
+        base = os.path.join(state_dir, "jstestdriver-%s" % port)
+        self.state_path = base + ".json"
+        self.lock_path = base + ".lock"
+        self.log_path = base + ".log"
+
+    def _lock(self):
+        """Take the lock on the state file. Closing the result frees it."""
+        makeStateDir(self.state_dir)
+        lock = open(self.lock_path, "a")
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        return lock
+
+    def readState(self):
+        """Return the recorded state, or C{None} if there is none."""
+        try:
+            state_file = open(self.state_path)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            try:
+                return json.load(state_file)
+            except ValueError:
+                return None
+        finally:
+            state_file.close()
+
+    def writeState(self, state):
+        temp_path = self.state_path + ".tmp"
+        state_file = open(temp_path, "w")
+        try:
+            json.dump(state, state_file)
+        finally:
+            state_file.close()
+        os.rename(temp_path, self.state_path)
+
+    def _pruneHolders(self, state):
+        """Forget about holders that died without releasing the server."""
+        holders = [pid for pid in state["holders"] if isAlive(pid)]
+        if holders != state["holders"]:
+            state["holders"] = holders
+            state["last_used"] = time.time()
+
+    def acquire(self):
+        """Attach to the running server, starting it if needed.
+
+        Returns the URL of the server.
+        """
+        lock = self._lock()
+        try:
+            state = self.readState()
+            if state is not None:
+                self._pruneHolders(state)
+                if not isAlive(state["pid"]) or not probePort(self.port, 1):
+                    state = None
+                elif state["config"] != self.config:
+                    if state["holders"]:
+                        raise ValueError(
+                            "JsTestDriver server on port %s is in use with"
+                            " a different configuration" % self.port)
+                    os.kill(state["pid"], signal.SIGTERM)
+                    self._waitForShutdown()
+                    state = None
+            if state is None:
+                state = self._start()
+            state["holders"].append(os.getpid())
+            self.writeState(state)
+            return state["url"]
+        finally:
+            lock.close()
+
+    def release(self):
+        """Detach from the server, leaving it running for later runs."""
+        lock = self._lock()
+        try:
+            state = self.readState()
+            if state is None:
+                return
+            pid = os.getpid()
+            if pid in state["holders"]:
+                state["holders"].remove(pid)
+            state["last_used"] = time.time()
+            self.writeState(state)
+        finally:
+            lock.close()
+
+    def _waitForShutdown(self, timeout=10):
+        """Wait for a stopped server to free its port."""
+        deadline = time.time() + timeout
+        while probePort(self.port, 0) and time.time() < deadline:
+            time.sleep(0.05)
+
+    def _start(self):
+        """Start the supervisor, and wait until it reports back."""
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        log = open(self.log_path, "a")
+        try:
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "lazr.testing.daemon",
+                 str(self.port), str(self.idle_timeout), self.state_dir],
+                stdin=open(os.devnull),
+                stdout=subprocess.PIPE,
+                stderr=log,
+                env=env,
+                close_fds=True,
+                # Don't get the supervisor killed along with this run
+                # on a SIGINT.
+                preexec_fn=os.setsid)
+        finally:
+            log.close()
+        # The supervisor closes its output once the server is ready, or
+        # after it gave up on starting it.
+        output = proc.stdout.read()
+        proc.stdout.close()
+        if not output.startswith("READY "):
+            proc.wait()
+            raise ValueError(
+                output or "Failed to start JsTestDriver daemon, see %s" %
+                self.log_path)
+        return {"pid": proc.pid,
+                "url": output.split()[1],
+                "config": self.config,
+                "holders": [],
+                "last_used": time.time()}
+
+    def _keepRunning(self, proc):
+        if proc.poll() is not None:
+            return False
+        lock = self._lock()
+        try:
+            state = self.readState()
+            if state is None or state["pid"] != os.getpid():
+                return False
+            self._pruneHolders(state)
+            self.writeState(state)
+            return (state["holders"] or
+                    time.time() - state["last_used"] < self.idle_timeout)
+        finally:
+            lock.close()
+
+    def supervise(self):
+        """Run the server until it has been idle for too long."""
+        from lazr.testing.jstestdriver import (
+            startJsTestDriver, terminateProcess)
+
+        os.environ["JSTESTDRIVER_PORT"] = str(self.port)
+        os.environ.pop("JSTESTDRIVER_SERVER", None)
+        try:
+            proc = startJsTestDriver()
+        except ValueError, e:
+            sys.stdout.write(str(e))
+            return 1
+
+        def stop(signum, frame):
+            raise SystemExit(0)
+        signal.signal(signal.SIGTERM, stop)
+
+        sys.stdout.write("READY %s\n" % os.environ["JSTESTDRIVER_SERVER"])
+        sys.stdout.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        os.close(devnull)
+
+        # The run that started us holds the lock until it recorded
+        # itself as a holder, so the first check can't miss it.
+        interval = min(max(self.idle_timeout / 2.0, 1), 10)
+        try:
+            while self._keepRunning(proc):
+                time.sleep(interval)
+        finally:
+            terminateProcess(proc)
+            lock = self._lock()
+            try:
+                state = self.readState()
+                if state is not None and state["pid"] == os.getpid():
+                    os.remove(self.state_path)
+            finally:
+                lock.close()
+        return 0
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    port, idle_timeout, state_dir = args
+    daemon = ServerDaemon(port, float(idle_timeout), state_dir=state_dir)
+    return daemon.supervise()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
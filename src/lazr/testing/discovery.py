@@ -0,0 +1,163 @@
+import os
+import stat
+import time
+import errno
+import fnmatch
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+
+# Directories modified less than this many seconds before they were
+# scanned may still change within the same mtime, so they are not
+# trusted on the next run.
+RACY_MTIME = 2
+
+
+class DiscoveryIndex(object):
+    """Find test files under a directory, remembering what was found.
+
+    Files whose name matches one of the C{include} patterns are found,
+    unless their path relative to the top directory, or their name,
+    matches one of the C{exclude} patterns. Matching directories are
+    skipped altogether.
+
+    The index keeps, for each directory, its modification time, the
+    test files and the subdirectories it holds. A directory whose
+    modification time didn't change since it was indexed isn't listed
+    again, so finding the test files of an unchanged tree only costs a
+    C{stat()} per directory. The index is kept in C{index_path}, if
+    given.
+    """
+
+    def __init__(self, directory, include=("test_*.html",), exclude=(),
+                 index_path=None):
+        self.directory = os.path.abspath(directory)
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.index_path = index_path
+        self.entries = {}
+        self.changed = False
+        if index_path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            index_file = open(self.index_path)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        try:
+            try:
+                index = json.load(index_file)
+            except ValueError:
+                return
+        finally:
+            index_file.close()
+        if (index.get("include") == self.include and
+            index.get("exclude") == self.exclude):
+            self.entries = index["entries"]
+
+    def save(self):
+        """Write the index back, if anything changed."""
+        if self.index_path is None or not self.changed:
+            return
+        directory = os.path.dirname(self.index_path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        temp_path = "%s.%d" % (self.index_path, os.getpid())
+        index_file = open(temp_path, "w")
+        try:
+            json.dump({"include": self.include,
+                       "exclude": self.exclude,
+                       "entries": self.entries}, index_file)
+        finally:
+            index_file.close()
+        os.rename(temp_path, self.index_path)
+        self.changed = False
+
+    def _excluded(self, relpath):
+        name = os.path.basename(relpath)
+        for pattern in self.exclude:
+            if (fnmatch.fnmatch(relpath, pattern) or
+                fnmatch.fnmatch(name, pattern)):
+                return True
+        return False
+
+    def _scan(self, relpath, path):
+        """List the test files and subdirectories of C{path}."""
+        files = []
+        dirs = []
+        for name in sorted(os.listdir(path)):
+            child = os.path.join(relpath, name)
+            if self._excluded(child):
+                continue
+            child_path = os.path.join(path, name)
+            if stat.S_ISDIR(os.lstat(child_path).st_mode):
+                dirs.append(name)
+            elif os.path.isdir(child_path):
+                # Symbolic links to directories aren't followed, as by
+                # os.walk(), so that links to a parent don't loop.
+                continue
+            else:
+                for pattern in self.include:
+                    if fnmatch.fnmatch(name, pattern):
+                        files.append(name)
+                        break
+        return files, dirs
+
+    def find(self):
+        """Return the paths of the test files, in a stable order."""
+        found = []
+        seen = set()
+        pending = [""]
+        while pending:
+            relpath = pending.pop()
+            path = os.path.join(self.directory, relpath)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError, e:
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+                continue
+            seen.add(relpath)
+            entry = self.entries.get(relpath)
+            if entry is None or entry["mtime"] != mtime:
+                scanned_at = time.time()
+                files, dirs = self._scan(relpath, path)
+                if scanned_at - mtime < RACY_MTIME:
+                    # Changes made within the same mtime would be
+                    # missed, so scan it again next time.
+                    mtime = None
+                entry = self.entries[relpath] = {
+                    "mtime": mtime, "files": files, "dirs": dirs}
+                self.changed = True
+            found.extend(os.path.join(path, name)
+                         for name in entry["files"])
+            pending.extend(os.path.join(relpath, name)
+                           for name in reversed(entry["dirs"]))
+        # Forget about directories that went away.
+        for relpath in list(self.entries):
+            if relpath not in seen:
+                del self.entries[relpath]
+                self.changed = True
+        return sorted(found)
+
+
+def indexPath(state_dir, directory, include, exclude):
+    """Return where the index of C{directory} is kept in C{state_dir}."""
+    key = sha1(json.dumps([os.path.abspath(directory),
+                           list(include), list(exclude)]))
+    return os.path.join(state_dir, "discovery-%s.json" % key.hexdigest())
@@ -0,0 +1,127 @@
+import os
+import errno
+import heapq
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+class DurationStore(object):
+    """Remember how long each test took to run, per browser.
+
+    The durations are kept in a JSON file mapping browser names to
+    mappings of test ids to seconds. Only the latest duration of a
+    test is kept. Durations recorded by other runs in the meantime are
+    merged when saving, so several test runs can share the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.durations = self._load()
+        self.recorded = {}
+
+    def _load(self):
+        try:
+            durations_file = open(self.path)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return {}
+        try:
+            try:
+                durations = json.load(durations_file)
+            except ValueError:
+                return {}
+        finally:
+            durations_file.close()
+        if not isinstance(durations, dict):
+            return {}
+        return durations
+
+    def record(self, browser, durations):
+        """Record the C{durations} of tests run on C{browser}.
+
+        C{durations} maps test ids to seconds. They are written to the
+        file by L{save}.
+        """
+        for store in [self.durations, self.recorded]:
+            store.setdefault(browser, {}).update(durations)
+
+    def save(self):
+        if not self.recorded:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        durations = self._load()
+        for browser, recorded in self.recorded.items():
+            durations.setdefault(browser, {}).update(recorded)
+        temp_path = "%s.%d" % (self.path, os.getpid())
+        durations_file = open(temp_path, "w")
+        try:
+            json.dump(durations, durations_file)
+        finally:
+            durations_file.close()
+        os.rename(temp_path, self.path)
+        self.durations = durations
+        self.recorded = {}
+
+    def estimates(self):
+        """Return the expected duration of each test and test case.
+
+        Test ids are taken to be C{TestCase.testName}, so the result
+        maps both the test ids and the test case names to seconds. As
+        every browser runs every test, the slowest browser is used.
+        """
+        estimates = {}
+        for browser, durations in self.durations.items():
+            totals = {}
+            for test_id, seconds in durations.items():
+                estimates[test_id] = max(estimates.get(test_id, 0), seconds)
+                name = test_id.rsplit(".", 1)[0]
+                if name != test_id:
+                    totals[name] = totals.get(name, 0) + seconds
+            for name, seconds in totals.items():
+                estimates[name] = max(estimates.get(name, 0), seconds)
+        return estimates
+
+
+def durationStore():
+    """Return the L{DurationStore} in C{LAZR_TESTING_DURATIONS}, if set."""
+    path = os.environ.get("LAZR_TESTING_DURATIONS")
+    if not path:
+        return None
+    return DurationStore(path)
+
+
+def balance(names, count, estimates):
+    """Split C{names} into at most C{count} shards taking as long.
+
+    The names are taken longest first, according to the C{estimates}
+    mapping, and each is added to the shard expected to finish first.
+    Names without an estimate are expected to take the average time.
+    The names of each shard are kept in their original order.
+    """
+    known = [estimates[name] for name in names if name in estimates]
+    if known:
+        default = float(sum(known)) / len(known)
+    else:
+        default = 0
+    order = dict((name, index) for index, name in enumerate(names))
+    # Between shards expected to take as long, the smallest one wins,
+    # so names are dealt in turn when nothing is known.
+    heap = [(0, 0, index, []) for index in range(min(count, len(names)))]
+    for name in sorted(names, key=lambda name: (
+            -estimates.get(name, default), order[name])):
+        load, size, index, shard = heapq.heappop(heap)
+        shard.append(name)
+        heapq.heappush(heap, (load + estimates.get(name, default),
+                              size + 1, index, shard))
+    heap.sort(key=lambda item: item[2])
+    return [sorted(shard, key=order.get) for load, size, index, shard in heap]
@@ -0,0 +1,675 @@
+"""Drive the servers and clients from a single thread.
+
+The layers and test cases block a thread on every server they wait for
+and every client they run. An L{EventLoop} drives any number of them
+from one thread instead, so that a single process can run the suites
+of many projects at once. Tasks are generators yielding the L{Future}s
+they wait for, much like C{asyncio} coroutines::
+
+  def run(loop):
+      server = yield startJsTestDriverServer(loop, "4224")
+      results = runJsTestDriverClients(
+          loop, config_filename, ["http://localhost:4224"])
+      while True:
+          item = yield results.get()
+          if item is None:
+              break
+          test, outcome, details = item
+      yield server.terminate()
+
+  loop = EventLoop()
+  loop.run(loop.spawn(run(loop)))
+
+A task returns a value by raising L{Return}.
+"""
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import heapq
+import select
+import socket
+import subprocess
+import xml.parsers.expat
+
+from collections import deque
+
+from lazr.testing import jstestdriver, yeti
+from lazr.testing.durations import balance
+from lazr.testing.jsconfig import JsTestDriverConfig
+from lazr.testing.tempdirs import outputDirs
+from lazr.testing.watcher import OutputTail
+
+
+class Return(Exception):
+    """Raised by a task to return C{value}."""
+
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+
+class Future(object):
+    """The outcome of an operation that completes later.
+
+    Callbacks added with L{add_done_callback} are called with the
+    future once it's done.
+    """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        """Return the result of the operation, or raise its error."""
+        if not self._done:
+            raise RuntimeError("The operation didn't complete yet")
+        if self._exc_info is not None:
+            exc_type, exc_value, exc_tb = self._exc_info
+            raise exc_type, exc_value, exc_tb
+        return self._result
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def add_done_callback(self, callback):
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def remove_done_callback(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def _finish(self):
+        if self._done:
+            raise RuntimeError("The operation already completed")
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class Task(Future):
+    """Run a generator, resuming it whenever the future it yielded is done.
+
+    The generator gets the result of the future back from C{yield}, or
+    its error raised there. The task is done once the generator is.
+    """
+
+    def __init__(self, loop, generator):
+        super(Task, self).__init__()
+        self.loop = loop
+        self._generator = generator
+        loop.callSoon(self._step, None, None)
+
+    def _step(self, value, exc_info):
+        try:
+            if exc_info is not None:
+                future = self._generator.throw(*exc_info)
+            else:
+                future = self._generator.send(value)
+        except StopIteration:
+            self.set_result(None)
+        except Return, e:
+            self.set_result(e.value)
+        except:
+            self.set_exc_info(sys.exc_info())
+        else:
+            if not isinstance(future, Future):
+                error = TypeError("Tasks must yield futures, not %r" % future)
+                self.loop.callSoon(self._step, None,
+                                   (TypeError, error, None))
+            else:
+                future.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        # Resumed from the loop, so that long chains of tasks don't
+        # pile up on the stack.
+        self.loop.callSoon(self._step, future._result, future._exc_info)
+
+
+class Timer(object):
+    """A call scheduled by L{EventLoop.callLater}."""
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+    """Call back when file descriptors are ready, or timers expire.
+
+    Nothing happens outside of L{run}, which runs the loop until a
+    given future is done.
+    """
+
+    def __init__(self):
+        self._ready = deque()
+        self._timers = []
+        self._sequence = 0
+        self._readers = {}
+        self._writers = {}
+
+    def callSoon(self, callback, *args):
+        """Call C{callback(*args)} on the next iteration of the loop."""
+        self._ready.append((callback, args))
+
+    def callLater(self, delay, callback, *args):
+        """Call C{callback(*args)} in C{delay} seconds.
+
+        Returns a L{Timer}, that can be cancelled.
+        """
+        timer = Timer(callback, args)
+        self._sequence += 1
+        heapq.heappush(self._timers,
+                       (time.time() + delay, self._sequence, timer))
+        return timer
+
+    def addReader(self, fd, callback, *args):
+        """Call C{callback(*args)} whenever C{fd} can be read."""
+        self._readers[fd] = (callback, args)
+
+    def removeReader(self, fd):
+        self._readers.pop(fd, None)
+
+    def addWriter(self, fd, callback, *args):
+        """Call C{callback(*args)} whenever C{fd} can be written."""
+        self._writers[fd] = (callback, args)
+
+    def removeWriter(self, fd):
+        self._writers.pop(fd, None)
+
+    def sleep(self, seconds):
+        """Return a L{Future} done in C{seconds}."""
+        future = Future()
+        self.callLater(seconds, future.set_result, None)
+        return future
+
+    def spawn(self, generator):
+        """Run C{generator} as a L{Task}, and return the task."""
+        return Task(self, generator)
+
+    def run(self, future):
+        """Run the loop until C{future} is done, and return its result."""
+        while not future.done():
+            self._runOnce()
+        return future.result()
+
+    def _runOnce(self):
+        timeout = None
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = max(self._timers[0][0] - time.time(), 0)
+        elif not self._readers and not self._writers:
+            raise RuntimeError("Nothing left to wait for")
+        try:
+            readable, writable, _ = select.select(
+                self._readers.keys(), self._writers.keys(), [], timeout)
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = writable = []
+        for fd, handlers in ([(fd, self._readers) for fd in readable] +
+                             [(fd, self._writers) for fd in writable]):
+            # An earlier callback may have removed it.
+            handler = handlers.get(fd)
+            if handler is not None:
+                callback, args = handler
+                callback(*args)
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            when, sequence, timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                self._ready.append((timer.callback, timer.args))
+        # Calls scheduled by these calls wait for the next iteration.
+        for index in range(len(self._ready)):
+            callback, args = self._ready.popleft()
+            callback(*args)
+
+
+def firstOf(loop, futures, timeout=None):
+    """Return a L{Future} of the first of C{futures} to be done.
+
+    If none is done after C{timeout} seconds, the result is C{None}.
+    """
+    first = Future()
+    timers = []
+
+    def done(future):
+        if not first.done():
+            first.set_result(future)
+
+    def forget(first):
+        # The futures may be waited for again, and again.
+        for future in futures:
+            future.remove_done_callback(done)
+        for timer in timers:
+            timer.cancel()
+    first.add_done_callback(forget)
+    for future in futures:
+        future.add_done_callback(done)
+    if timeout is not None and not first.done():
+        timers.append(loop.callLater(timeout, done, None))
+    return first
+
+
+class Process(object):
+    """A child process whose output is read by an L{EventLoop}.
+
+    Each line of output is passed to C{on_line(name, line)}, where
+    C{name} is C{"stdout"} or C{"stderr"}, and nothing is kept. With
+    C{merge_stderr}, the standard error goes to the standard output.
+    """
+
+    def __init__(self, loop, cmd, on_line, merge_stderr=False):
+        self.loop = loop
+        self.on_line = on_line
+        stderr = subprocess.PIPE
+        if merge_stderr:
+            stderr = subprocess.STDOUT
+        self.proc = subprocess.Popen(cmd,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=stderr,
+                                     close_fds=True)
+        self.pid = self.proc.pid
+        self.returncode = None
+        self._exited = Future()
+        self._partial = {}
+        for name in ["stdout", "stderr"]:
+            stream = getattr(self.proc, name)
+            if stream is None:
+                continue
+            fd = stream.fileno()
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self._partial[name] = ""
+            loop.addReader(fd, self._read, name, stream)
+
+    def _read(self, name, stream):
+        try:
+            data = os.read(stream.fileno(), 65536)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+        if data:
+            lines = (self._partial[name] + data).split("\n")
+            self._partial[name] = lines.pop()
+            for line in lines:
+                self.on_line(name, line + "\n")
+            return
+        partial = self._partial.pop(name)
+        if partial:
+            self.on_line(name, partial)
+        self.loop.removeReader(stream.fileno())
+        stream.close()
+        if not self._partial:
+            self._reap(0.005)
+
+    def _reap(self, delay):
+        # The output is closed, so the process is exiting, if it didn't
+        # already; it's polled with a quickly growing delay.
+        returncode = self.proc.poll()
+        if returncode is None:
+            self.loop.callLater(delay, self._reap, min(delay * 2, 0.1))
+            return
+        self.proc.stdin.close()
+        self.returncode = returncode
+        self._exited.set_result(returncode)
+
+    def wait(self):
+        """Return a L{Future} of the exit code of the process."""
+        return self._exited
+
+    def terminate(self):
+        """Terminate the process, and return L{wait}."""
+        if self.returncode is None and self.proc.poll() is None:
+            self.proc.terminate()
+        return self._exited
+
+
+def probe(loop, port, timeout, host="localhost"):
+    """Return a task telling whether C{port} accepts connections in time.
+
+    As L{lazr.testing.watcher.probePort}, but connecting without
+    blocking.
+    """
+
+    def task():
+        deadline = time.time() + timeout
+        delay = 0.005
+        while True:
+            s = socket.socket()
+            s.setblocking(0)
+            try:
+                error = s.connect_ex((host, int(port)))
+                if error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    connected = Future()
+                    loop.addWriter(
+                        s.fileno(),
+                        lambda: connected.done() or connected.set_result(None))
+                    try:
+                        yield firstOf(loop, [connected],
+                                      max(deadline - time.time(), 0))
+                    finally:
+                        loop.removeWriter(s.fileno())
+                    if connected.done():
+                        error = s.getsockopt(socket.SOL_SOCKET,
+                                             socket.SO_ERROR)
+            finally:
+                s.close()
+            if error == 0:
+                raise Return(True)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise Return(False)
+            yield loop.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.1)
+    return loop.spawn(task())
+
+
+def startServer(loop, name, cmd, port, markers, timeout, waiting_for):
+    """Return a task starting a server, and returning its L{Process}.
+
+    The server is ready once it logged a line starting with one of the
+    C{markers}, and accepts connections on C{port}. If it exits, or
+    isn't ready in C{timeout} seconds, a C{ValueError} is raised, as
+    by the layers. C{waiting_for} says what took too long.
+
+    The last lines of output are kept in the C{output} attribute of the
+    process.
+    """
+    output = deque(maxlen=1000)
+    started = Future()
+
+    def on_line(stream, line):
+        output.append(line.rstrip("\n"))
+        if not started.done() and line.startswith(tuple(markers)):
+            started.set_result(True)
+
+    def task():
+        deadline = time.time() + timeout
+        process = Process(loop, cmd, on_line, merge_stderr=True)
+        process.output = output
+        first = yield firstOf(loop, [started, process.wait()], timeout)
+        if first is started:
+            accepting = yield probe(loop, port,
+                                    max(deadline - time.time(), 0))
+            if not accepting:
+                first = None
+        if process.returncode is not None:
+            raise ValueError(
+                "Failed to execute %s server on port %s:\nError: (%s) %s" %
+                (name, port, process.returncode, "\n".join(output)))
+        if first is None:
+            yield process.terminate()
+            raise ValueError(
+                "Failed to %s in %d seconds on port %s:\nError: %s" %
+                (waiting_for, timeout, port, "\n".join(output)))
+        raise Return(process)
+    return loop.spawn(task())
+
+
+def startJsTestDriverServer(loop, port, capture_timeout=None):
+    """Return a task starting a I{JsTestDriver} server on C{port}.
+
+    The server is configured as by the layer, and the task returns its
+    L{Process} once it captured its browser, if it has one.
+    """
+    if capture_timeout is None:
+        capture_timeout = int(os.environ.get(
+            "JSTESTDRIVER_CAPTURE_TIMEOUT", "30"))
+    cmd, browser = jstestdriver.serverCommand(port)
+    if browser:
+        markers = [jstestdriver.CAPTURED]
+        waiting_for = "capture a browser"
+    else:
+        markers = [jstestdriver.STARTED]
+        waiting_for = "start the JsTestDriver server"
+    return startServer(loop, "JsTestDriver", cmd, port, markers,
+                       capture_timeout, waiting_for)
+
+
+def startYetiServer(loop, port, capture_timeout=None):
+    """Return a task starting a I{Yeti} server on C{port}.
+
+    The server is configured as by the layer, and the task returns its
+    L{Process} once it started.
+    """
+    if capture_timeout is None:
+        capture_timeout = int(os.environ.get("YETI_CAPTURE_TIMEOUT", "30"))
+    return startServer(loop, "Yeti", yeti.serverCommand(port), port,
+                       yeti.STARTED, capture_timeout,
+                       "start the Yeti server")
+
+
+class ResultStream(object):
+    """The results of test runs, as they come.
+
+    The results are C{(test, outcome, details)}, where C{outcome} is
+    C{"success"}, C{"failure"}, C{"error"} or C{"skip"}, and C{details}
+    the text of the failure, if any.
+    """
+
+    def __init__(self):
+        self._results = deque()
+        self._waiters = deque()
+        self._finished = False
+        self._exc_info = None
+
+    def put(self, test, outcome, details=None):
+        if self._waiters:
+            self._waiters.popleft().set_result((test, outcome, details))
+        else:
+            self._results.append((test, outcome, details))
+
+    def finish(self, exc_info=None):
+        """End the stream, with the error that ended the run, if any."""
+        self._finished = True
+        self._exc_info = exc_info
+        while self._waiters:
+            self._end(self._waiters.popleft())
+
+    def get(self):
+        """Return a L{Future} of the next result.
+
+        Once all the results were returned, the future returns C{None},
+        or raises the error that ended the run.
+        """
+        future = Future()
+        if self._results:
+            future.set_result(self._results.popleft())
+        elif self._finished:
+            self._end(future)
+        else:
+            self._waiters.append(future)
+        return future
+
+    def _end(self, future):
+        if self._exc_info is not None:
+            future.set_exc_info(self._exc_info)
+        else:
+            future.set_result(None)
+
+
+def _details(test_result, outcome):
+    """Return the text of the failure of a I{JsTestDriver} test."""
+    if outcome == "success":
+        return None
+    message = test_result.message
+    if message is None:
+        message = test_result.content
+    else:
+        message = [message]
+    if outcome == "error":
+        return str(jstestdriver.JsTestDriverError(message))
+    return str(jstestdriver.JsTestDriverFailure(message))
+
+
+def runJsTestDriverClients(loop, config_filename, servers, tests=None,
+                           interval=0.25):
+    """Run the tests of C{config_filename}, one client per server.
+
+    The test cases are split across the C{servers} as by the test
+    cases, unless C{tests}, a value for C{--tests}, is given, which are
+    all run on the first server. The reports are checked for every
+    C{interval} seconds, and their results are streamed as soon as
+    they're complete.
+
+    Returns a L{ResultStream} of C{JsTestDriverResult}s. The stream
+    ends with a C{ValueError} if a client failed to run the tests.
+    """
+    if tests is not None:
+        shards = [(servers[0], tests)]
+    else:
+        names = []
+        if len(servers) > 1:
+            names = JsTestDriverConfig(config_filename).testCaseNames()
+        shards = jstestdriver.shardTests(names, servers)
+    stream = ResultStream()
+    scratch_dirs = outputDirs()
+    output_dir = scratch_dirs.acquire()
+    reported = set()
+
+    def collect():
+        for path in jstestdriver.outputFiles(output_dir):
+            if path in reported:
+                continue
+            try:
+                test_results = jstestdriver.parseResultFile(path)
+            except xml.parsers.expat.ExpatError:
+                # Still being written.
+                continue
+            reported.add(path)
+            for test_result, outcome in sorted(
+                    test_results, key=lambda item: item[0].id()):
+                stream.put(test_result, outcome,
+                           _details(test_result, outcome))
+
+    def client(index, server, tests):
+        shard_dir = os.path.join(output_dir, "shard-%d" % index)
+        os.mkdir(shard_dir)
+        output = {"stdout": OutputTail(jstestdriver.CLIENT_MARKERS),
+                  "stderr": OutputTail(jstestdriver.CLIENT_MARKERS)}
+        process = Process(
+            loop,
+            jstestdriver.clientCommand(config_filename, shard_dir, server,
+                                       tests),
+            lambda name, line: output[name].feed(line))
+        returncode = yield process.wait()
+        # As checked by the test cases.
+        if returncode != 0 and not "Tests failed." in output["stdout"]:
+            raise ValueError(
+                "Failed to execute JsTestDriver tests for:\n"
+                "%s (%s)\nError: %s" %
+                (config_filename, server, output["stderr"]))
+
+    def task():
+        try:
+            clients = [loop.spawn(client(index, server, tests))
+                       for index, (server, tests) in enumerate(shards)]
+            running = clients
+            while running:
+                yield firstOf(loop, running, interval)
+                collect()
+                running = [client_task for client_task in clients
+                           if not client_task.done()]
+            for client_task in clients:
+                client_task.result()
+        except:
+            stream.finish(sys.exc_info())
+        else:
+            stream.finish()
+        finally:
+            scratch_dirs.release(output_dir)
+    loop.spawn(task())
+    return stream
+
+
+class _SubunitCollector(object):
+    """Put the results of a subunit stream into a L{ResultStream}."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def startTest(self, test):
+        pass
+
+    def stopTest(self, test):
+        pass
+
+    def addSuccess(self, test):
+        self.stream.put(test, "success")
+
+    def addFailure(self, test, err):
+        self.stream.put(test, "failure", str(err[1]))
+
+    def addError(self, test, err):
+        self.stream.put(test, "error", str(err[1]))
+
+    def addSkip(self, test, reason):
+        self.stream.put(test, "skip", reason)
+
+
+class _Discard(object):
+    """Drop the lines of a stream that aren't subunit."""
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def runYetiClients(loop, paths, port, count=1):
+    """Run the test files at C{paths} on the Yeti server on C{port}.
+
+    The files are dealt to C{count} clients. Returns a L{ResultStream}
+    of the results of their subunit streams, as they're read.
+    """
+    from subunit import TestProtocolServer
+    from testtools import ExtendedToOriginalDecorator
+    stream = ResultStream()
+    collector = ExtendedToOriginalDecorator(_SubunitCollector(stream))
+    cmd = yeti.clientCommand(port)
+
+    def client(paths):
+        protocol = TestProtocolServer(collector, _Discard())
+        process = Process(loop, cmd + paths,
+                          lambda name, line: protocol.lineReceived(line),
+                          merge_stderr=True)
+        yield process.wait()
+        protocol.lostConnection()
+
+    def task():
+        try:
+            clients = [loop.spawn(client(shard))
+                       for shard in balance(paths, count, {}) or [[]]]
+            for client_task in clients:
+                yield client_task
+        except:
+            stream.finish(sys.exc_info())
+        else:
+            stream.finish()
+    loop.spawn(task())
+    return stream
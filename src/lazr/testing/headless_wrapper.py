@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+if __name__ == "__main__":
+    # Run by JsTestDriver, which only knows about this file.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+    from lazr.testing.browsers import main
+    if len(sys.argv) == 2:
+        sys.exit(main(sys.argv[1:]))
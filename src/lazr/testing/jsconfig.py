@@ -0,0 +1,209 @@
+import os
+import re
+import glob
+
+
+TESTCASE_PATTERN = re.compile(
+    r"""\b(?:Conditional)?(?:Async)?TestCase\(\s*["']([^"']+)["']""")
+
+# The variable a test case is assigned to, right before the call.
+ASSIGNMENT_PATTERN = re.compile(r"""([\w$]+)\s*=\s*$""")
+
+# A test function added to the prototype of a test case.
+PROTOTYPE_PATTERN = re.compile(
+    r"""\b([\w$]+)\.prototype\.(test[\w$]*)\s*=""")
+
+# The object literal passed to the test case, defining it inline.
+INLINE_PATTERN = re.compile(r"""\s*,[^){]*\{""")
+
+# A test function defined in an object literal.
+FUNCTION_PATTERN = re.compile(r"""\b(test[\w$]*)\s*:\s*function\b""")
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+        value = value[1:-1]
+    return value
+
+
+class JsTestDriverConfig(object):
+    """A I{JsTestDriver} configuration file.
+
+    Only the subset of YAML used by I{JsTestDriver} configuration files
+    is understood: top-level scalars (C{server}, C{basepath}), lists of
+    paths (C{load}, C{test}, C{exclude}, C{serve}) and lists of
+    mappings (C{plugin}).
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.sections = {}
+        config = open(self.filename)
+        try:
+            self._parse(config)
+        finally:
+            config.close()
+        self.basepath = os.path.join(os.path.dirname(self.filename),
+                                     self.sections.get("basepath", ""))
+
+    def _parse(self, lines):
+        section = None
+        for line in lines:
+            line = line.rstrip()
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            if not line[0].isspace():
+                key, value = line.split(":", 1)
+                section = key.strip()
+                value = _unquote(value)
+                self.sections[section] = value or []
+            elif stripped.startswith("-"):
+                item = stripped[1:].strip()
+                if ":" in item and section == "plugin":
+                    key, value = item.split(":", 1)
+                    item = {key.strip(): _unquote(value)}
+                else:
+                    item = _unquote(item)
+                self.sections[section].append(item)
+            elif ":" in stripped:
+                # Continuation of a mapping in a list.
+                key, value = stripped.split(":", 1)
+                self.sections[section][-1][key.strip()] = _unquote(value)
+
+    def _expand(self, section):
+        paths = []
+        for pattern in self.sections.get(section, []):
+            matches = sorted(glob.glob(os.path.join(self.basepath, pattern)))
+            for path in matches:
+                path = os.path.normpath(path)
+                if path not in paths:
+                    paths.append(path)
+        return paths
+
+    @property
+    def plugins(self):
+        return list(self.sections.get("plugin", []))
+
+    def files(self, section):
+        """Return the files listed in C{section}, minus the excluded ones.
+
+        Glob patterns are expanded, relative to the C{basepath}.
+        """
+        excluded = set(self._expand("exclude"))
+        return [path for path in self._expand(section)
+                if path not in excluded]
+
+    def sourceFiles(self):
+        """Return the files loaded in the browser, in order."""
+        paths = self.files("load")
+        for path in self.files("test"):
+            if path not in paths:
+                paths.append(path)
+        return paths
+
+    def testCaseNames(self):
+        """Return the sorted names of the test cases defined by the sources.
+
+        Test cases are found by looking for C{TestCase("Name"...)} calls,
+        so test cases with computed names are missed.
+        """
+        return sorted(self.loadedTestCaseNames())
+
+    def loadedTestCaseNames(self):
+        """Return the names of the test cases in the order they're loaded.
+
+        That's the order in which a client runs them.
+        """
+        names = []
+        for path in self.sourceFiles():
+            source = open(path)
+            try:
+                for name in TESTCASE_PATTERN.findall(source.read()):
+                    if name not in names:
+                        names.append(name)
+            finally:
+                source.close()
+        return names
+
+    def testNames(self):
+        """Return the names of the test functions of each test case.
+
+        The result maps the name of each test case to the sorted names
+        of its test functions, found either in the object literal
+        passed to C{TestCase("Name", {...})}, or assigned to the
+        prototype of the variable the test case was assigned to. Test
+        functions defined any other way are missed.
+        """
+        tests = {}
+        variables = {}
+        functions = []
+        for path in self.sourceFiles():
+            source_file = open(path)
+            try:
+                source = source_file.read()
+            finally:
+                source_file.close()
+            matches = list(TESTCASE_PATTERN.finditer(source))
+            for index, match in enumerate(matches):
+                name = match.group(1)
+                tests.setdefault(name, set())
+                assignment = ASSIGNMENT_PATTERN.search(
+                    source, max(match.start() - 100, 0), match.start())
+                if assignment is not None:
+                    variables[assignment.group(1)] = name
+                end = len(source)
+                if index + 1 < len(matches):
+                    end = matches[index + 1].start()
+                if INLINE_PATTERN.match(source, match.end(), end):
+                    tests[name].update(FUNCTION_PATTERN.findall(
+                        source, match.end(), end))
+            functions.extend(PROTOTYPE_PATTERN.findall(source))
+        for variable, function in functions:
+            if variable in variables:
+                tests[variables[variable]].add(function)
+        return dict((name, sorted(names)) for name, names in tests.items())
+
+
+def mergeConfigs(configs, filename, plugins=()):
+    """Write a configuration running all the C{configs} at once to C{filename}.
+
+    The files loaded by each configuration are loaded in turn, files
+    shared by several configurations only once, and all the served
+    files and plugins are kept, as well as the extra C{plugins}. Paths
+    are written relative to the directory of C{filename}.
+    """
+    basepath = os.path.dirname(os.path.abspath(filename))
+    load = []
+    serve = []
+    plugins = list(plugins)
+    for config in configs:
+        for path in config.sourceFiles():
+            if path not in load:
+                load.append(path)
+        for path in config.files("serve"):
+            if path not in serve:
+                serve.append(path)
+        for plugin in config.plugins:
+            if plugin not in plugins:
+                plugins.append(plugin)
+    lines = []
+    for section, paths in [("load", load), ("serve", serve)]:
+        if paths:
+            lines.append("%s:" % section)
+            lines.extend("  - \"%s\"" % os.path.relpath(path, basepath)
+                         for path in paths)
+    if plugins:
+        lines.append("plugin:")
+        for plugin in plugins:
+            prefix = "  - "
+            for key, value in sorted(plugin.items()):
+                lines.append("%s%s: \"%s\"" % (prefix, key, value))
+                prefix = "    "
+    merged = open(filename, "w")
+    try:
+        merged.write("\n".join(lines) + "\n")
+    finally:
+        merged.close()
+    return JsTestDriverConfig(filename)
@@ -0,0 +1,254 @@
+"""Collect the code coverage of the JavaScript run by the tests.
+
+Set C{JSTESTDRIVER_COVERAGE} to the jar of the I{JsTestDriver}
+coverage plugin to have the sources instrumented by the server, and
+the line coverage of every run written by the clients next to their
+reports, in LCOV format. The coverage of every shard of every test
+case is merged as it's read, and written out when the layer is torn
+down, under C{JSTESTDRIVER_COVERAGE_DIR} (C{jscoverage} by default),
+as C{lcov.info} and as C{cobertura.xml}.
+
+With C{JSTESTDRIVER_CACHE} set, the coverage of a configuration is
+cached along with its results, so that the configurations that didn't
+change are neither instrumented nor run again.
+"""
+
+import os
+import threading
+import time
+
+from xml.sax.saxutils import escape, quoteattr
+
+# The Guice module of the JsTestDriver coverage plugin.
+COVERAGE_MODULE = "com.google.jstestdriver.coverage.CoverageModule"
+
+# The suffix of the files the plugin writes the coverage to.
+COVERAGE_SUFFIX = "-coverage.dat"
+
+
+def coverageJar():
+    """Return the path of the coverage plugin, if coverage is wanted."""
+    return os.environ.get("JSTESTDRIVER_COVERAGE") or None
+
+
+def coveragePlugin(jar):
+    """Return the configuration of the coverage plugin in C{jar}."""
+    return {"name": "coverage", "jar": os.path.abspath(jar),
+            "module": COVERAGE_MODULE}
+
+
+def coverageFiles(output_dir):
+    """Return the paths of the coverage files in C{output_dir}, in order."""
+    paths = []
+    for base, dirs, files in os.walk(output_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.endswith(COVERAGE_SUFFIX):
+                paths.append(os.path.join(base, fname))
+    return paths
+
+
+def readCoverage(output_dir, basepath):
+    """Return the L{CoverageData} of the files in C{output_dir}.
+
+    Relative source paths are taken as relative to C{basepath}, the
+    directory of the configuration that was run.
+    """
+    data = CoverageData()
+    for path in coverageFiles(output_dir):
+        coverage_file = open(path)
+        try:
+            data.readLcov(coverage_file, basepath)
+        finally:
+            coverage_file.close()
+    return data
+
+
+def _rate(covered, valid):
+    if not valid:
+        return "1"
+    return "%.4f" % (float(covered) / valid)
+
+
+class CoverageData(object):
+    """The number of times each line of each source file was run.
+
+    Data is merged in as it's read, a line at a time, so that only the
+    hit counts are ever held in memory, however many runs are merged.
+    """
+
+    def __init__(self):
+        self.files = {}
+
+    def __nonzero__(self):
+        return bool(self.files)
+
+    def clear(self):
+        self.files = {}
+
+    def add(self, path, line, hits):
+        lines = self.files.setdefault(path, {})
+        lines[line] = lines.get(line, 0) + hits
+
+    def readLcov(self, stream, basepath=None):
+        """Merge the LCOV data read from C{stream}.
+
+        Relative source paths are taken as relative to C{basepath}.
+        """
+        path = None
+        for line in stream:
+            line = line.strip()
+            if line.startswith("SF:"):
+                path = line[3:]
+                if basepath is not None:
+                    path = os.path.join(basepath, path)
+                path = os.path.normpath(path)
+                self.files.setdefault(path, {})
+            elif line.startswith("DA:") and path is not None:
+                fields = line[3:].split(",")
+                try:
+                    self.add(path, int(fields[0]), int(fields[1]))
+                except (IndexError, ValueError):
+                    continue
+            elif line == "end_of_record":
+                path = None
+
+    def update(self, other):
+        """Merge the data of the L{CoverageData} C{other}."""
+        for path, lines in other.files.items():
+            for line, hits in lines.items():
+                self.add(path, line, hits)
+
+    def toRecords(self):
+        """Return the data as a mapping, that can be saved as JSON."""
+        return dict((path, sorted(lines.items()))
+                    for path, lines in self.files.items())
+
+    @classmethod
+    def fromRecords(cls, records):
+        """Return the data saved by L{toRecords}."""
+        data = cls()
+        for path, lines in records.items():
+            data.files[path] = dict((line, hits) for line, hits in lines)
+        return data
+
+    def writeLcov(self, stream):
+        for path in sorted(self.files):
+            lines = self.files[path]
+            stream.write("SF:%s\n" % path)
+            for line in sorted(lines):
+                stream.write("DA:%d,%d\n" % (line, lines[line]))
+            stream.write("LH:%d\n" % len([hits for hits in lines.values()
+                                           if hits]))
+            stream.write("LF:%d\n" % len(lines))
+            stream.write("end_of_record\n")
+
+    def writeCobertura(self, stream, source=None):
+        """Write the data as a Cobertura report.
+
+        File names are relative to the C{source} directory, the current
+        directory by default, when they're in it. Each directory is a
+        package, and each file a class.
+        """
+        if source is None:
+            source = os.getcwd()
+        packages = {}
+        for path in self.files:
+            name = path
+            if path.startswith(source + os.sep):
+                name = path[len(source) + 1:]
+            packages.setdefault(os.path.dirname(name), []).append(
+                (name, path))
+        valid = sum(len(lines) for lines in self.files.values())
+        covered = sum(len([hits for hits in lines.values() if hits])
+                      for lines in self.files.values())
+        stream.write('<?xml version="1.0" ?>\n')
+        stream.write(
+            '<coverage line-rate="%s" branch-rate="0" lines-covered="%d"'
+            ' lines-valid="%d" branches-covered="0" branches-valid="0"'
+            ' complexity="0" version="lazr.testing" timestamp="%d">\n' %
+            (_rate(covered, valid), covered, valid, time.time() * 1000))
+        stream.write("  <sources>\n    <source>%s</source>\n  </sources>\n"
+                     % escape(source))
+        stream.write("  <packages>\n")
+        for package in sorted(packages):
+            files = sorted(packages[package])
+            package_lines = [self.files[path] for name, path in files]
+            stream.write(
+                '    <package name=%s line-rate="%s" branch-rate="0"'
+                ' complexity="0">\n      <classes>\n' %
+                (quoteattr(package.strip(os.sep).replace(os.sep, ".")),
+                 _rate(sum(len([hits for hits in lines.values() if hits])
+                           for lines in package_lines),
+                       sum(len(lines) for lines in package_lines))))
+            for name, path in files:
+                lines = self.files[path]
+                stream.write(
+                    '        <class name=%s filename=%s line-rate="%s"'
+                    ' branch-rate="0" complexity="0">\n'
+                    '          <methods/>\n          <lines>\n' %
+                    (quoteattr(os.path.basename(name)), quoteattr(name),
+                     _rate(len([hits for hits in lines.values() if hits]),
+                           len(lines))))
+                for line in sorted(lines):
+                    stream.write(
+                        '            <line number="%d" hits="%d"/>\n' %
+                        (line, lines[line]))
+                stream.write("          </lines>\n        </class>\n")
+            stream.write("      </classes>\n    </package>\n")
+        stream.write("  </packages>\n</coverage>\n")
+
+
+_collected = CoverageData()
+_collected_lock = threading.Lock()
+
+
+def collectedCoverage():
+    """Return the L{CoverageData} of all the tests run so far.
+
+    It's only changed through L{collectCoverage} and L{clearCoverage},
+    since the test cases of a batch merge their coverage from several
+    threads.
+    """
+    return _collected
+
+
+def collectCoverage(data):
+    """Merge the L{CoverageData} C{data} into the L{collectedCoverage}."""
+    with _collected_lock:
+        _collected.update(data)
+
+
+def clearCoverage():
+    """Forget the coverage of the tests run so far."""
+    with _collected_lock:
+        _collected.clear()
+
+
+def writeCoverage(directory=None):
+    """Write the coverage of all the tests run so far, if any.
+
+    Returns the paths of the LCOV and Cobertura files written, or
+    C{None} if there was no coverage to write.
+    """
+    with _collected_lock:
+        if not _collected:
+            return None
+        if directory is None:
+            directory = os.environ.get("JSTESTDRIVER_COVERAGE_DIR",
+                                       "jscoverage")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        paths = []
+        for name, write in [("lcov.info", _collected.writeLcov),
+                            ("cobertura.xml", _collected.writeCobertura)]:
+            path = os.path.join(directory, name)
+            temp_path = "%s.%d" % (path, os.getpid())
+            report = open(temp_path, "w")
+            try:
+                write(report)
+            finally:
+                report.close()
+            os.rename(temp_path, path)
+            paths.append(path)
+        return paths
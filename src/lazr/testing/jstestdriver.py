@@ -1,16 +1,38 @@
 import os
+import re
 import sys
 import time
+import Queue
+import shutil
 import signal
 import tempfile
+import threading
 import subprocess
 import xml.parsers.expat
 
-from mocker import MockerTestCase
+from unittest import TestCase
 
-# New version of zope testing code has been restructured !
-#from zope.testing.testrunner.runner import TestResult as ZopeTestResult
-from zope.testrunner.runner import TestResult as ZopeTestResult
+from lazr.testing.cache import ResultCache, configDigest
+from lazr.testing.daemon import ServerDaemon
+from lazr.testing.durations import balance, durationStore
+from lazr.testing.jsconfig import JsTestDriverConfig, mergeConfigs
+from lazr.testing.jscoverage import (
+    CoverageData, collectCoverage, coverageJar, coveragePlugin,
+    readCoverage, writeCoverage)
+from lazr.testing.tempdirs import outputDirs
+from lazr.testing.timing import PhaseTimer, showSetUpTimings
+from lazr.testing.watcher import (
+    LogWatcher, OutputTail, Watchdog, makeWatchdog, probePort)
+
+
+def isZopeTestResult(result):
+    """Return whether C{result} is a zope.testrunner C{TestResult}.
+
+    The runner isn't imported here, as it's slow to import and can only
+    have created C{result} if it was imported already.
+    """
+    runner = sys.modules.get("zope.testrunner.runner")
+    return runner is not None and isinstance(result, runner.TestResult)
 
 
 class JsTestDriverError(Exception):
@@ -27,7 +49,21 @@ class JsTestDriverFailure(Exception):
         super(JsTestDriverFailure, self).__init__(message)
 
 
+class JsTestDriverTimeout(Exception):
+    """A client was killed for taking too long."""
+
+
 class JsTestDriverResult(object):
+    """The result of a single I{JsTestDriver} test, on a single browser.
+
+    There can be one per test and browser in a single report, so they
+    are kept small: the attributes are slotted, and C{content}, the
+    lines of text of the failure, is only a list for failed tests.
+    C{retried} is whether the test only passed when run again.
+    """
+
+    __slots__ = ("classname", "name", "browser", "duration", "message",
+                 "content", "failure_type", "retried")
 
     failureException = JsTestDriverFailure
 
@@ -37,7 +73,16 @@ class JsTestDriverResult(object):
         self.browser = browser
         self.duration = duration
         self.message = None
-        self.content = []
+        self.content = ()
+        self.failure_type = None
+        self.retried = False
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
 
     def countTestCases(self):
         return 1
@@ -49,7 +94,10 @@ class JsTestDriverResult(object):
         return "%s.%s.%s" % (self.browser, self.classname, self.name)
 
     def __str__(self):
-        return "%s:%s (%s)" % (self.name, self.browser, self.classname)
+        description = "%s:%s (%s)" % (self.name, self.browser, self.classname)
+        if self.retried:
+            description += " [passed on retry]"
+        return description
 
     def __repr__(self):
         return "<%s testMethod=%s, browser=%s>" % (self.classname,
@@ -77,6 +125,14 @@ class GlobalJsTestDriverResult(object):
         return self.name
 
 
+# Size of the chunks in which XML output is read and parsed.
+PARSE_BUFFER_SIZE = 65536
+
+# Below this total size of XML output, parsing it in several processes
+# costs more than it saves.
+PARALLEL_PARSE_SIZE = 4 * 1024 * 1024
+
+
 class JsTestDriverResultParser(object):
     """Parse the XML output from I{JsTestDriver} and report to a L{TestResult}.
 
@@ -89,10 +145,32 @@ class JsTestDriverResultParser(object):
     """
 
     def __init__(self, expat, result):
-        self.expat = expat
         self.result = result
         self.test_result = None
         self.test_results = {}
+        self.in_failure = False
+        self.in_output = False
+        # The text of the failure and output of the current test.
+        self.content = None
+        # The browser and class names repeat for every test, so a
+        # single copy of each is kept.
+        self.names = {}
+        self.expat = None
+        if expat is not None:
+            self.attach(expat)
+
+    def attach(self, expat):
+        """Parse the output fed to C{expat}.
+
+        A single parser can be attached to the expat parsers of several
+        output files in turn, so that their results are reported
+        together.
+        """
+        self.expat = expat
+        self.test_result = None
+        self.in_failure = False
+        self.in_output = False
+        self.content = None
 
         # attach expat parser methods
         for name, value in type(self).__dict__.items():
@@ -103,38 +181,53 @@ class JsTestDriverResultParser(object):
             except AttributeError:
                 pass
 
+    def parse(self, output):
+        """Parse the XML read from the C{output} file.
+
+        The file is read and parsed in chunks, so it's never held in
+        memory as a whole.
+        """
+        expat = xml.parsers.expat.ParserCreate()
+        expat.buffer_text = True
+        expat.buffer_size = PARSE_BUFFER_SIZE
+        self.attach(expat)
+        expat.ParseFile(output)
+
     def _add_success(self, test_result):
-        if isinstance(self.result, ZopeTestResult):
+        if isZopeTestResult(self.result):
             self.result.options.output.test_success(
                 test_result, float(test_result.duration))
         else:
             self.result.addSuccess(test_result)
 
-    def _add_failure(self, test_result):
+    def _exc_info(self, exc_type, test_result):
+        """Return the C{exc_info} reporting the failure of C{test_result}.
+
+        There's no Python traceback to speak of, so the exception isn't
+        raised just to get one.
+        """
         message = test_result.message
         if message is None:
             message = test_result.content
         else:
             message = [message]
-        try:
-            raise JsTestDriverFailure(message)
-        except:
-            self.result.addFailure(test_result, sys.exc_info())
+        return (exc_type, exc_type(message), None)
+
+    def _add_failure(self, test_result):
+        self.result.addFailure(
+            test_result, self._exc_info(JsTestDriverFailure, test_result))
 
     def _add_error(self, test_result):
-        message = test_result.message
-        if message is None:
-            message = test_result.content
-        else:
-            message = [message]
-        try:
-            raise JsTestDriverError(message)
-        except:
-            self.result.addError(test_result, sys.exc_info())
+        self.result.addError(
+            test_result, self._exc_info(JsTestDriverError, test_result))
 
     def add_results(self):
         for test_result, outcome in sorted(
                 self.test_results.items(), key=lambda x: x[0].id()):
+            # Stop reporting if asked to, for instance by
+            # zope.testrunner on the first failure with -x.
+            if self.result.shouldStop:
+                break
             self.result.startTest(test_result)
             if outcome == "success":
                 self._add_success(test_result)
@@ -151,17 +244,21 @@ class JsTestDriverResultParser(object):
             pass
         elif tag == "testcase":
             browser, classname = attributes["classname"].split(".", 1)
+            browser = self.names.setdefault(browser, browser)
+            classname = self.names.setdefault(classname, classname)
             name = attributes["name"]
             duration = attributes["time"]
             self.test_result = JsTestDriverResult(classname, name,
                                                   browser, duration)
+            self.content = []
         elif tag in ("error", "failure"):
+            self.in_failure = True
             self.test_result.failure_type = attributes["type"]
             message = attributes.get("message", None)
             if message is not None:
                 self.test_result.message = message
         elif tag == "system-out":
-             pass
+            self.in_output = True
         else:
             raise ValueError("Unexpected tag: %s" % tag)
 
@@ -171,26 +268,77 @@ class JsTestDriverResultParser(object):
         elif tag == "testcase":
             if self.test_result not in self.test_results:
                 self.test_results[self.test_result] = "success"
+            else:
+                self.test_result.content = self.content
+            self.content = None
         elif tag == "error":
+            self.in_failure = False
             self.test_results[self.test_result] = "error"
         elif tag == "failure":
+            self.in_failure = False
             self.test_results[self.test_result] = "failure"
         elif tag == "system-out":
-             pass
+            self.in_output = False
         else:
             raise ValueError("Unexpected tag: %s" % tag)
 
     def CharacterDataHandler(self, data):
-        if self.test_result is not None:
-            self.test_result.content.append(data)
+        # The text is only reported for the tests that didn't pass, so
+        # it's dropped for the others once they end, as their output
+        # can be huge.
+        if self.content is not None and (self.in_failure or self.in_output):
+            self.content.extend(data.splitlines())
 
 
-def startJsTestDriver():
-    jstestdriver = os.environ["JSTESTDRIVER"]
-    port = os.environ.get("JSTESTDRIVER_PORT", "4224")
+def parseResultFile(path):
+    """Return the C{(test_result, outcome)} pairs reported in C{path}."""
+    parser = JsTestDriverResultParser(None, None)
+    output = open(path, "rb")
+    try:
+        parser.parse(output)
+    finally:
+        output.close()
+    return parser.test_results.items()
 
-    capture_timeout = int(os.environ.get(
-        "JSTESTDRIVER_CAPTURE_TIMEOUT", "30"))
+
+def parseResultFiles(paths):
+    """Parse the result files at C{paths}.
+
+    Yields the C{(test_result, outcome)} pairs of each file, in order.
+    When there's a lot of output, the files are parsed concurrently in
+    C{JSTESTDRIVER_PARSE_WORKERS} processes, defaulting to one per CPU
+    core.
+    """
+    import multiprocessing
+    workers = int(os.environ.get("JSTESTDRIVER_PARSE_WORKERS",
+                                 multiprocessing.cpu_count()))
+    workers = min(workers, len(paths))
+    if (workers > 1 and
+        sum(os.path.getsize(path) for path in paths) >= PARALLEL_PARSE_SIZE):
+        pool = multiprocessing.Pool(workers)
+        try:
+            for test_results in pool.imap(parseResultFile, paths):
+                yield test_results
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for path in paths:
+            yield parseResultFile(path)
+
+
+# Lines logged by the server with --runnerMode=INFO.
+CAPTURED = "INFO: Browser Captured:"
+STARTED = "INFO: Finished action run."
+DISCONNECTED = "INFO: Browser Disconnected:"
+
+
+def serverCommand(port):
+    """Return the command starting a I{JsTestDriver} server on C{port}.
+
+    Returns the command and the browser the server captures, if any.
+    """
+    jstestdriver = os.environ["JSTESTDRIVER"]
 
     # With JsTestDriver 1.2.2 no messages are printed unless
     # --runnerMode=INFO.
@@ -202,56 +350,76 @@ def startJsTestDriver():
     browser = os.environ.get("JSTESTDRIVER_BROWSER", "default")
     if browser == "default":
         browser = os.path.join(os.path.dirname(__file__), "browser_wrapper.py")
+    elif browser == "headless":
+        # A headless browser with a throwaway profile, see
+        # lazr.testing.browsers.
+        browser = os.path.join(os.path.dirname(__file__),
+                               "headless_wrapper.py")
 
-    wait_for_browser = False
     if browser:
-        wait_for_browser = True
         cmd.extend(["--browser", browser])
+    return cmd, browser
 
-    # Redirect stderr through a temporary file, so that it doesn't
-    # block and we don't get an IOError on readline(), apparently
-    # caused by an unhandled SIGINT (Google for it. :)
-    fd, name = tempfile.mkstemp()
-    stderr = open(name)
-    captured = False
-    server_started = False
-    rc = None
 
-    try:
-        proc = subprocess.Popen(cmd,
-                                shell=False,
-                                stdin=subprocess.PIPE,
-                                stdout=subprocess.PIPE,
-                                stderr=fd,
-                                close_fds=True)
-
-        # Give the server process a few seconds to start, and
-        # capture the browser if needed.
-        output = []
-        start = time.time()
-        while time.time() - start < capture_timeout:
-            rc = proc.poll()
-            if rc is not None:
-                break
-            line = stderr.readline()
-            if not line:
-                # time.sleep(0.1)
-                continue
-            output.append(line)
-            # A browser was captured, no reason to wait any longer.
-            if line.startswith("INFO: Browser Captured:"):
-                captured = True
-                break
-            if line.startswith("INFO: Finished action run."):
-                server_started = True
-                if not wait_for_browser:
-                    break
-    finally:
-        stderr.close()
+def spawnJsTestDriver(port):
+    """Start a I{JsTestDriver} server on C{port}, without waiting for it.
+
+    The server output is followed from a background thread, which wakes
+    up L{waitForJsTestDriver} as soon as the server reports it started
+    or captured the browser. The thread keeps draining the output
+    afterwards, so the server never blocks writing to it.
+    """
+    cmd, browser = serverCommand(port)
+    timer = PhaseTimer(server="jstestdriver", port=port)
+    proc = subprocess.Popen(cmd,
+                            shell=False,
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            close_fds=True)
+    proc.watcher = LogWatcher(proc.stdout, [CAPTURED, STARTED, DISCONNECTED])
+    timer.mark("spawn")
+    proc.timer = timer
+    proc.port = port
+    proc.wait_for_browser = bool(browser)
+    return proc
 
-    if rc is None:
-        rc = proc.poll()
+
+def waitForJsTestDriver(proc, capture_timeout):
+    """Wait for a server started by L{spawnJsTestDriver} to be ready.
+
+    A C{ValueError} is raised if the server didn't start, or didn't
+    capture its browser in C{capture_timeout} seconds.
+    """
+    port = proc.port
+    wait_for_browser = proc.wait_for_browser
+
+    def ready():
+        if wait_for_browser:
+            # A browser was captured, no reason to wait any longer.
+            return proc.watcher.count(CAPTURED) > 0
+        return proc.watcher.count(STARTED) > 0
+
+    start = time.time()
+    proc.watcher.wait(ready, capture_timeout)
+    proc.timer.mark(wait_for_browser and "capture" or "start")
+    captured = proc.watcher.count(CAPTURED) > 0
+    server_started = proc.watcher.count(STARTED) > 0
+    # Once the server says it started, make sure it is actually
+    # accepting connections before handing it out to the clients.
+    if server_started or captured:
+        remaining = capture_timeout - (time.time() - start)
+        if not probePort(port, max(remaining, 0)):
+            captured = server_started = False
+        proc.timer.mark("probe")
+    output = proc.watcher.lines()
+
+    rc = proc.poll()
+    if rc is None and proc.watcher.closed:
+        # The output was closed, so the server is on its way out.
+        rc = proc.wait()
     if rc is not None:
+        proc.watcher.close()
         raise ValueError(
             "Failed to execute JsTestDriver server on port %s:"
             "\nError: (%s) %s" %
@@ -272,41 +440,765 @@ def startJsTestDriver():
             "Failed to capture a browser in %d seconds:"
             "\nError: %s" %
             (capture_timeout, "\n".join(output)))
-    else:
-        os.environ["JSTESTDRIVER_SERVER"] = (
-            "http://localhost:%s" % port)
+
+
+def browserLost(proc):
+    """Return whether the server C{proc} lost a browser it captured.
+
+    A server that exited lost its browsers too.
+    """
+    if proc.poll() is not None:
+        return True
+    return proc.wait_for_browser and proc.watcher.count(DISCONNECTED) > 0
+
+
+def startJsTestDriver():
+    port = os.environ.get("JSTESTDRIVER_PORT", "4224")
+    capture_timeout = int(os.environ.get(
+        "JSTESTDRIVER_CAPTURE_TIMEOUT", "30"))
+
+    proc = spawnJsTestDriver(port)
+    waitForJsTestDriver(proc, capture_timeout)
+    os.environ["JSTESTDRIVER_SERVER"] = (
+        "http://localhost:%s" % port)
     return proc
 
 
+def startJsTestDriverPool(count):
+    """Start C{count} servers, each capturing its own browser.
+
+    I{JsTestDriver} runs every test on every browser captured by a
+    server, so tests can only be split across browsers captured by
+    different servers. The servers use consecutive ports, starting at
+    C{JSTESTDRIVER_PORT}, and are started concurrently.
+    """
+    port = int(os.environ.get("JSTESTDRIVER_PORT", "4224"))
+    capture_timeout = int(os.environ.get(
+        "JSTESTDRIVER_CAPTURE_TIMEOUT", "30"))
+
+    procs = []
+    try:
+        for index in range(count):
+            procs.append(spawnJsTestDriver(str(port + index)))
+        for proc in procs:
+            waitForJsTestDriver(proc, capture_timeout)
+    except:
+        for proc in procs:
+            if proc.poll() is None:
+                terminateProcess(proc)
+        raise
+    return procs
+
+
+def browserCount():
+    """Return how many browsers should be captured.
+
+    C{JSTESTDRIVER_BROWSER_COUNT} is either a number, or C{auto} to
+    capture one browser per CPU core.
+    """
+    count = os.environ.get("JSTESTDRIVER_BROWSER_COUNT", "1")
+    if count == "auto":
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    return max(int(count), 1)
+
+
+def splitTests(names, count, estimates=None):
+    """Split test case C{names} into at most C{count} shards.
+
+    If C{estimates} of their durations are given, the shards are
+    balanced with L{balance}, otherwise the names are dealt in turn.
+    """
+    if estimates:
+        return balance(names, count, estimates)
+    shards = [names[index::count] for index in range(count)]
+    return [shard for shard in shards if shard]
+
+
+def durationEstimates():
+    """Return the estimates of the L{DurationStore}, if there's one."""
+    store = durationStore()
+    if store is None:
+        return None
+    return store.estimates()
+
+
+def shardTests(names, servers, selected=False):
+    """Split test case C{names} across C{servers}.
+
+    If C{selected} is true, C{names} are the only tests to run, rather
+    than all the test cases of the configuration. The shards are
+    balanced according to the recorded durations of the tests.
+
+    Returns a list of C{(server, tests)} pairs, where C{tests} is the
+    value for the C{--tests} option.
+    """
+    if len(servers) > 1 and len(names) > 1:
+        return [(server, ",".join(shard))
+                for server, shard
+                in zip(servers, splitTests(names, len(servers),
+                                           durationEstimates()))]
+    if selected:
+        if not names:
+            return []
+        return [(servers[0], ",".join(names))]
+    return [(servers[0], "all")]
+
+
+def clientCommand(config_filename, output_dir, server, tests="all"):
+    """Return the command running the C{tests} of C{config_filename}.
+
+    The client runs them on C{server}, writing its reports to
+    C{output_dir}.
+    """
+    return os.environ["JSTESTDRIVER"].split() + ["--config",
+                                                 config_filename,
+                                                 "--testOutput",
+                                                 output_dir,
+                                                 "--server",
+                                                 server,
+                                                 "--tests",
+                                                 tests]
+
+
+def runClients(config_filename, output_dir, shards, watch=None,
+               watchdog=None, lost=None):
+    """Run a client for each shard of C{config_filename}, concurrently.
+
+    C{watch} is passed on to L{communicateAll}. If given, C{watchdog}
+    watches each client, known by the index of its shard, and counts
+    each new report as progress. C{lost(server)}, if given, tells the
+    watchdog whether the browser of C{server} is gone.
+
+    Returns a list of C{(server, returncode, stdout, stderr)}.
+    """
+    servers = []
+    procs = []
+    for index, (server, tests) in enumerate(shards):
+        shard_dir = output_dir
+        if len(shards) > 1:
+            # Each shard gets its own output directory, so that reports
+            # from different browsers don't overwrite each other.
+            shard_dir = os.path.join(output_dir, "shard-%d" % index)
+            os.mkdir(shard_dir)
+        cmd = clientCommand(config_filename, shard_dir, server, tests)
+        servers.append(server)
+        # The output is read a line at a time, which needs buffering.
+        procs.append(subprocess.Popen(cmd,
+                                      bufsize=-1,
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE))
+        if watchdog is not None:
+            server_lost = None
+            if lost is not None:
+                server_lost = lambda server=server: lost(server)
+            watchdog.watch(index, procs[-1],
+                           lambda shard_dir=shard_dir: os.listdir(shard_dir),
+                           server_lost)
+    try:
+        outputs = communicateAll(procs, watch)
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+    return [(server, proc.returncode, stdout, stderr)
+            for server, proc, (stdout, stderr)
+            in zip(servers, procs, outputs)]
+
+
+def outputFiles(output_dir):
+    """Return the paths of the XML reports in C{output_dir}, in order."""
+    paths = []
+    for base, dirs, files in os.walk(output_dir):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.endswith(".xml"):
+                paths.append(os.path.join(base, fname))
+    return paths
+
+
+# Lines the clients print, as looked for by JsTestDriverTestCase.
+CLIENT_MARKERS = ("Tests failed.", "Finished action run.")
+
+
+def readOutput(proc):
+    """Read the output of the client C{proc} as it comes, until it exits.
+
+    Returns an L{OutputTail} for its standard output and one for its
+    standard error, so that the memory used stays the same however
+    much the client prints. The output of C{proc} should be buffered.
+    """
+    stdout = OutputTail(CLIENT_MARKERS)
+    stderr = OutputTail(CLIENT_MARKERS)
+    thread = threading.Thread(target=stdout.consume, args=(proc.stdout,))
+    thread.start()
+    stderr.consume(proc.stderr)
+    thread.join()
+    proc.wait()
+    return stdout, stderr
+
+
+def communicateAll(procs, watch=None, interval=0.25):
+    """Read the output of all C{procs} concurrently, until they exit.
+
+    While waiting, C{watch()} is called every C{interval} seconds, if
+    given. If it returns C{False}, the processes are terminated.
+
+    Returns the C{(stdout, stderr)} pairs of L{readOutput}, in order.
+    """
+    if len(procs) == 1 and watch is None:
+        return [readOutput(procs[0])]
+    outputs = [None] * len(procs)
+
+    def communicate(index):
+        outputs[index] = readOutput(procs[index])
+    threads = [threading.Thread(target=communicate, args=(index,))
+               for index in range(len(procs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        while thread.isAlive():
+            thread.join(interval)
+            if watch is not None and thread.isAlive() and not watch():
+                for proc in procs:
+                    if proc.poll() is None:
+                        proc.terminate()
+                watch = None
+    return outputs
+
+
+class LiveReporter(object):
+    """Report results while the clients of a test case are still running.
+
+    Each result file is reported as soon as it's complete, that is, as
+    soon as it parses, so the test runner can show progress and stop on
+    the first failure.
+    """
+
+    def __init__(self, test, result):
+        self.test = test
+        self.result = result
+
+    def __call__(self):
+        """Report newly completed files.
+
+        Returns C{False} if the test run should stop.
+        """
+        for path in self.test._outputFiles():
+            if path in self.test.reported_files:
+                continue
+            try:
+                test_results = parseResultFile(path)
+            except xml.parsers.expat.ExpatError:
+                # Still being written.
+                continue
+            self.test.reported_files.add(path)
+            self.test.reported_results.extend(test_results)
+            parser = JsTestDriverResultParser(None, self.result)
+            parser.test_results.update(test_results)
+            parser.add_results()
+        return not self.result.shouldStop
+
+
+def makeDaemon(port):
+    """Return the L{ServerDaemon} managing the server on C{port}.
+
+    C{JSTESTDRIVER_DAEMON} is the number of seconds the server is kept
+    running once no test run uses it anymore.
+    """
+    idle_timeout = float(os.environ["JSTESTDRIVER_DAEMON"])
+    # A server started for another jar or browser is not reused.
+    config = [os.environ["JSTESTDRIVER"],
+              os.environ.get("JSTESTDRIVER_BROWSER", "default")]
+    return ServerDaemon(port, idle_timeout, config,
+                        os.environ.get("JSTESTDRIVER_DAEMON_DIR"))
+
+
 def terminateProcess(proc):
     try:
         proc.terminate()
     except AttributeError:
         os.kill(proc.pid, signal.SIGTERM)
     proc.wait()
+    watcher = getattr(proc, "watcher", None)
+    if watcher is not None:
+        watcher.close()
 
 
 class JsTestDriverLayer(object):
     """Manages startup/shutdown of a I{JsTestDriver} server.
     """
 
+    executor = None
+    batch = None
+
     @classmethod
     def setUp(cls):
-        cls.proc = None
+        cls.procs = []
+        cls.daemons = []
+        cls.executor = None
+        cls.batch = None
         if os.environ.get("JSTESTDRIVER_SERVER") is None:
-            cls.proc = startJsTestDriver()
+            count = browserCount()
+            port = int(os.environ.get("JSTESTDRIVER_PORT", "4224"))
+            timers = []
+            if os.environ.get("JSTESTDRIVER_DAEMON"):
+                urls = []
+                try:
+                    for index in range(count):
+                        timer = PhaseTimer(server="jstestdriver",
+                                           port=str(port + index))
+                        daemon = makeDaemon(str(port + index))
+                        urls.append(daemon.acquire())
+                        cls.daemons.append(daemon)
+                        timer.mark("acquire")
+                        timers.append(timer)
+                except:
+                    for daemon in cls.daemons:
+                        daemon.release()
+                    cls.daemons = []
+                    raise
+            else:
+                cls.procs = startJsTestDriverPool(count)
+                urls = ["http://localhost:%s" % proc.port
+                        for proc in cls.procs]
+                timers = [proc.timer for proc in cls.procs]
+            os.environ["JSTESTDRIVER_SERVER"] = urls[0]
+            os.environ["JSTESTDRIVER_SERVERS"] = ",".join(urls)
+            showSetUpTimings(timers)
 
     @classmethod
     def tearDown(cls):
-        if cls.proc is not None:
-            # If the process was created by us, then that means the
-            # environment variable has been set by ourselves too, so
-            # we must unset it.
+        if cls.executor is not None:
+            cls.executor.shutdown()
+            cls.executor = None
+        cls.batch = None
+        if cls.procs or cls.daemons:
+            # If the servers were set up by us, then that means the
+            # environment variables have been set by ourselves too, so
+            # we must unset them.
             del os.environ["JSTESTDRIVER_SERVER"]
-            terminateProcess(cls.proc)
+            del os.environ["JSTESTDRIVER_SERVERS"]
+        for daemon in cls.daemons:
+            # The server is left running for the next runs.
+            daemon.release()
+        for proc in cls.procs:
+            terminateProcess(proc)
+        writeCoverage()
+        # The test cases of the layer won't be run anymore.
+        _instances[:] = [test for test in _instances if test.layer is not cls]
+
+    @classmethod
+    def _serverProc(cls, server):
+        for proc in getattr(cls, "procs", ()):
+            if server == "http://localhost:%s" % proc.port:
+                return proc
+        return None
+
+    @classmethod
+    def lostBrowser(cls, server):
+        """Return whether the server at C{server} lost its browser.
+
+        Only the servers started by the layer are watched, through the
+        lines they log and their process.
+        """
+        proc = cls._serverProc(server)
+        return proc is not None and browserLost(proc)
+
+    @classmethod
+    def recapture(cls, server):
+        """Restart the server at C{server}, capturing a new browser.
+
+        The server is started again on the same port, so its URL
+        doesn't change. Returns whether it was restarted, which it
+        can't be unless it was started by the layer.
+        """
+        proc = cls._serverProc(server)
+        if proc is None:
+            return False
+        capture_timeout = int(os.environ.get(
+            "JSTESTDRIVER_CAPTURE_TIMEOUT", "30"))
+        cls.procs.remove(proc)
+        if proc.poll() is None:
+            terminateProcess(proc)
+        else:
+            proc.watcher.close()
+        new_proc = spawnJsTestDriver(proc.port)
+        waitForJsTestDriver(new_proc, capture_timeout)
+        cls.procs.append(new_proc)
+        return True
+
+
+def serverURLs():
+    """Return the URLs of the servers tests can be run on."""
+    server = os.environ["JSTESTDRIVER_SERVER"]
+    return os.environ.get("JSTESTDRIVER_SERVERS", server).split(",")
+
+
+def matchesPatterns(patterns, name):
+    """Match C{name} against zope.testrunner selection C{patterns}.
+
+    A name is selected if it matches any of the patterns, but none of
+    the patterns starting with a C{!}. Older test runners compile the
+    patterns to functions, the negated ones included, which are applied
+    as they do: any of them returning true selects the name.
+    """
+    if not patterns:
+        return True
+    selected = None
+    for pattern in patterns:
+        if callable(pattern):
+            if pattern(name):
+                return True
+            selected = False
+            continue
+        if not hasattr(pattern, "search"):
+            if pattern.startswith("!"):
+                if re.search(pattern[1:], name):
+                    return False
+                continue
+            pattern = re.compile(pattern)
+        if selected is None:
+            selected = False
+        if pattern.search(name):
+            selected = True
+    return selected is not False
+
+
+def testPatterns(result):
+    """Return the zope.testrunner test selection patterns for C{result}."""
+    options = getattr(result, "options", None)
+    return getattr(options, "test", None)
+
+
+def selectTests(tests, patterns):
+    """Translate zope.testrunner selection C{patterns} for C{--tests}.
+
+    C{tests} maps the names of the test cases of a configuration to the
+    names of their test functions, and each test function is matched as
+    C{TestCase.testName}. A test case whose test functions are all
+    selected is run as a whole, the others one test function at a time.
 
+    The patterns usually select the L{JsTestDriverTestCase} itself
+    rather than anything inside it, so if none of them matches a test
+    function, only those starting with a C{!} are applied. That can't
+    be done with the patterns compiled to functions by older test
+    runners, in which case everything is selected.
+
+    Returns the sorted names to pass to C{--tests}, or C{None} if
+    everything is selected.
+    """
+    if not patterns:
+        return None
+    negative = [pattern for pattern in patterns
+                if isinstance(pattern, basestring) and pattern.startswith("!")]
+
+    def select(patterns):
+        selected = []
+        for name, functions in sorted(tests.items()):
+            names = ["%s.%s" % (name, function) for function in functions]
+            chosen = [test for test in names or [name]
+                      if matchesPatterns(patterns, test)]
+            if len(chosen) == len(names or [name]):
+                selected.append(name)
+            else:
+                selected.extend(chosen)
+        return selected
+
+    selected = select(patterns)
+    if not selected:
+        if [pattern for pattern in patterns if callable(pattern)]:
+            # The negated patterns can't be told apart.
+            return None
+        if len(negative) < len(patterns):
+            selected = select(negative)
+    if selected == sorted(tests):
+        return None
+    return selected
+
+
+# Every JsTestDriverTestCase created, that is, every test collected by
+# the test runner, until its layer is torn down. They're referenced by
+# the test runner until then anyway.
+_instances = []
+
+
+def selectedTests(layer, options):
+    """Return the test cases of C{layer} the test runner is going to run.
+
+    Test cases whose results are cached, or that are run in a
+    L{JsTestDriverBatch}, are left out.
+    """
+    batch = getattr(layer, "batch", None)
+    tests = []
+    for test in _instances:
+        if (test.layer is layer and
+            matchesPatterns(getattr(options, "module", None),
+                            test.__class__.__module__) and
+            matchesPatterns(getattr(options, "test", None), str(test)) and
+            (batch is None or not batch.includes(test)) and
+            # Cached results are replayed without a client.
+            test._cacheLookup()[1] is None):
+            tests.append(test)
+    return tests
+
+
+class JsTestDriverBatch(object):
+    """Run the configurations of several L{JsTestDriverTestCase}s at once.
+
+    Each client run pays for starting a JVM and connecting to the
+    server. When C{JSTESTDRIVER_BATCH} is set, the first test case run
+    in a layer gathers all the other test cases selected for the layer,
+    merges their configurations into one, and runs it with a single
+    client per server. The results are routed back to the test case
+    whose configuration defines their I{JsTestDriver} test case, and
+    each test case reports them when the test runner gets to it.
+
+    Configurations sharing test case names with another one, or whose
+    test cases can't be found, can't be told apart in the merged
+    output, so they are run on their own.
+    """
+
+    def __init__(self, tests, names, patterns=None):
+        self.tests = tests
+        self.patterns = patterns
+        self.test_ids = set(id(test) for test in tests)
+        self.owners = {}
+        for test in tests:
+            for name in names[id(test)]:
+                self.owners[name] = test
+        self.results = None
+        self.runs = None
+        self.exc_info = None
+
+    @classmethod
+    def forTest(cls, test, result):
+        """Return the batch running C{test}, if there's one.
+
+        The batch for the layer of C{test} is created on the first
+        call, if the tests run under zope.testrunner.
+        """
+        layer = test.layer
+        batch = getattr(layer, "batch", None)
+        if batch is None:
+            options = getattr(result, "options", None)
+            if options is None or not os.environ.get("JSTESTDRIVER_BATCH"):
+                return None
+            candidates = selectedTests(layer, options)
+            names = {}
+            counts = {}
+            for other in candidates:
+                config = JsTestDriverConfig(other.config_filename)
+                names[id(other)] = config.testCaseNames()
+                for name in names[id(other)]:
+                    counts[name] = counts.get(name, 0) + 1
+            tests = [other for other in candidates
+                     if names[id(other)] and
+                     max(counts[name] for name in names[id(other)]) == 1]
+            if len(tests) < 2:
+                # Remember there's nothing to batch in this layer.
+                tests = []
+            batch = layer.batch = cls(tests, names, testPatterns(result))
+        if not batch.includes(test):
+            return None
+        return batch
+
+    def includes(self, test):
+        return id(test) in self.test_ids
+
+    def _run(self):
+        scratch_dirs = outputDirs()
+        batch_dir = scratch_dirs.acquire()
+        try:
+            config_filename = os.path.join(batch_dir, "batch.conf")
+            plugins = []
+            jar = coverageJar()
+            if jar is not None:
+                plugins.append(coveragePlugin(jar))
+            mergeConfigs([JsTestDriverConfig(test.config_filename)
+                          for test in self.tests], config_filename, plugins)
+            output_dir = os.path.join(batch_dir, "output")
+            os.mkdir(output_dir)
+            timer = PhaseTimer(tests=[test.id() for test in self.tests])
+            names = []
+            selected = False
+            for test in self.tests:
+                selection = test._selection(self.patterns)
+                if selection is None:
+                    names.extend(name for name, owner in self.owners.items()
+                                 if owner is test)
+                else:
+                    names.extend(selection)
+                    selected = True
+            shards = shardTests(sorted(names), serverURLs(), selected)
+            self.runs = runClients(config_filename, output_dir, shards)
+            timer.mark("run")
+            self.results = dict((id(test), []) for test in self.tests)
+            for test_results in parseResultFiles(outputFiles(output_dir)):
+                for test_result, outcome in test_results:
+                    owner = self.owners.get(test_result.classname,
+                                            self.tests[0])
+                    self.results[id(owner)].append((test_result, outcome))
+            timer.mark("parse")
+            if jar is not None:
+                # The coverage can't be told apart by test case, it's
+                # only collected for the whole run.
+                collectCoverage(readCoverage(output_dir, batch_dir))
+        finally:
+            scratch_dirs.release(batch_dir)
+
+    def wait(self, test):
+        """Return the client runs of the batch and the results of C{test}.
+
+        The batch is run on the first call. If that failed, the error
+        is raised for every test case of the batch.
+        """
+        if self.runs is None and self.exc_info is None:
+            try:
+                self._run()
+            except:
+                self.exc_info = sys.exc_info()
+        self.test_ids.discard(id(test))
+        if self.exc_info is not None:
+            exc_type, exc_value, exc_tb = self.exc_info
+            raise exc_type, exc_value, exc_tb
+        return self.runs, self.results.pop(id(test))
+
+
+class JsTestDriverExecutor(object):
+    """Run the clients of several L{JsTestDriverTestCase}s concurrently.
+
+    When a layer provides several servers, the first test case run in
+    the layer gathers all the other test cases selected for the layer,
+    and their clients are run in the background, each on the first
+    server that becomes free. Each test case still reports its results
+    when the test runner gets to it, so they are reported in the usual
+    order.
+    """
+
+    def __init__(self, tests, servers, patterns=None):
+        self.tests = tests
+        self.patterns = patterns
+        # Test cases compare equal to other instances of their class,
+        # so they are told apart by identity.
+        self.outcomes = dict((id(test), _Outcome()) for test in tests)
+        self.queue = Queue.Queue()
+        estimates = durationEstimates()
+        if estimates:
+            # Start the longest configurations first, so that the
+            # servers finish at about the same time. Nothing is known
+            # about the new ones, so they might take the longest.
+            tests = sorted(tests, key=lambda test: -test._estimate(estimates))
+        for test in tests:
+            self.queue.put(test)
+        self.servers = Queue.Queue()
+        self.threads = []
+        for server in servers:
+            self.servers.put(server)
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    @classmethod
+    def forTest(cls, test, result):
+        """Return the executor running C{test}, if there's one.
+
+        The executor for the layer of C{test} is created on the first
+        call, if the tests run under zope.testrunner and the layer
+        provides more than one server.
+        """
+        layer = test.layer
+        executor = getattr(layer, "executor", None)
+        if executor is None:
+            options = getattr(result, "options", None)
+            servers = serverURLs()
+            if options is None or len(servers) < 2:
+                return None
+            tests = selectedTests(layer, options)
+            if len(tests) < 2:
+                return None
+            executor = layer.executor = cls(tests, servers,
+                                            testPatterns(result))
+        if id(test) not in executor.outcomes:
+            return None
+        return executor
+
+    def _work(self):
+        while True:
+            try:
+                test = self.queue.get_nowait()
+            except Queue.Empty:
+                return
+            outcome = self.outcomes[id(test)]
+            server = self.servers.get()
+            try:
+                try:
+                    test.setUp()
+                except:
+                    outcome.set_exc_info(sys.exc_info(), set_up=False)
+                else:
+                    try:
+                        selection = test._selection(self.patterns)
+                        outcome.set_result(test._runClients(
+                            test._shards([server], selection)))
+                    except:
+                        outcome.set_exc_info(sys.exc_info())
+            finally:
+                self.servers.put(server)
 
-class JsTestDriverTestCase(MockerTestCase):
+    def wait(self, test):
+        """Wait for the clients of C{test} to finish.
+
+        Returns the client runs, or raises the error raised while
+        running them. Once this returns, L{test} needs to be torn down.
+        """
+        outcome = self.outcomes.pop(id(test))
+        outcome.event.wait()
+        if outcome.exc_info is not None:
+            exc_type, exc_value, exc_tb = outcome.exc_info
+            if outcome.set_up:
+                test.tearDown()
+            raise exc_type, exc_value, exc_tb
+        return outcome.result
+
+    def shutdown(self):
+        """Drop the tests that were not started, and wait for the others.
+        """
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                break
+        for thread in self.threads:
+            thread.join()
+        for test in self.tests:
+            outcome = self.outcomes.pop(id(test), None)
+            if outcome is not None and outcome.set_up:
+                test.tearDown()
+
+
+class _Outcome(object):
+    """The outcome of running a client in the background."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.set_up = False
+
+    def set_result(self, result):
+        self.result = result
+        self.set_up = True
+        self.event.set()
+
+    def set_exc_info(self, exc_info, set_up=True):
+        self.exc_info = exc_info
+        self.set_up = set_up
+        self.event.set()
+
+
+class JsTestDriverTestCase(TestCase):
     """Controls a I{JsTestDriver} client for a specific configuration.
 
     Test output from I{JsTestDriver} is captured and then parsed and
@@ -317,70 +1209,554 @@ class JsTestDriverTestCase(MockerTestCase):
 
     We require the L{config_filename} class variable to be set by
     subclasses, and that's the only configuration needed.
+
+    It offers the same helpers as C{mocker.MockerTestCase} did when it
+    was its base class, L{mocker}, L{makeFile} and L{makeDir}, but
+    C{mocker} is only imported if L{mocker} is used.
     """
     layer = JsTestDriverLayer
 
+    def __init__(self, methodName="runTest"):
+        super(JsTestDriverTestCase, self).__init__(methodName)
+        self._mocker = None
+        self._cleanup_paths = []
+        self._scratch_paths = []
+        _instances.append(self)
+
+    @property
+    def mocker(self):
+        """The C{mocker.Mocker} of the test, made on first use.
+
+        Its expectations are verified, and the objects it replaced are
+        restored, in L{tearDown}.
+        """
+        if self._mocker is None:
+            from mocker import Mocker
+            self._mocker = Mocker()
+        return self._mocker
+
     def setUp(self):
         super(JsTestDriverTestCase, self).setUp()
-        self.output_dir = self.makeDir()
-
-    def _runTest(self, result):
-        jstestdriver = os.environ["JSTESTDRIVER"]
-        server = os.environ["JSTESTDRIVER_SERVER"]
-        cmd = jstestdriver.split() + ["--config",
-                                      self.config_filename,
-                                      "--testOutput",
-                                      self.output_dir,
-                                      "--server",
-                                      server,
-                                      "--tests",
-                                      "all"]
-        proc = subprocess.Popen(cmd,
-                                stdin=subprocess.PIPE,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        stdout, stderr = proc.communicate()
-        # JsTestDriver 1.2.2 outputs this message to stdout when the
-        # actual tests failed. It also returns an error code. Only
-        # raise an error if the tests did not run at all, but not if
-        # they just failed.
-        if proc.returncode != 0 and not "Tests failed." in stdout:
-            raise ValueError(
-                "Failed to execute JsTestDriver tests for:\n"
-                "%s (%s)\nError: %s" %
-                (self.config_filename, server, stderr))
-        if stderr:
-            # JsTestDriver 1.2.2 outputs this message for a successful
-            # run with --runnerMode=INFO.
-            if not "Finished action run." in stderr:
-                test_result = GlobalJsTestDriverResult(str(self), self.id())
-                result.startTest(test_result)
-                result.addFailure(
-                    test_result, (RuntimeError, RuntimeError(stderr), None))
-
-    def _reportResults(self, result):
-        """Parse generated test results and report them to L{unittest}.
+        self.scratch_dirs = outputDirs()
+        self.output_dir = self._scratchDir()
+        self.reported_files = set()
+        self.reported_results = []
+        self.client_failed = False
+        self.timeouts = []
+        self.coverage_config = None
+        self.coverage = None
+
+    def tearDown(self):
+        try:
+            if self._mocker is not None:
+                try:
+                    self._mocker.verify()
+                finally:
+                    self._mocker.restore()
+                    self._mocker.reset()
+        finally:
+            for path in self._scratch_paths:
+                self.scratch_dirs.release(path)
+            self._scratch_paths = []
+            for path in self._cleanup_paths:
+                if os.path.isfile(path):
+                    os.unlink(path)
+                elif os.path.isdir(path):
+                    shutil.rmtree(path)
+            self._cleanup_paths = []
+            super(JsTestDriverTestCase, self).tearDown()
+
+    def _scratchDir(self):
+        """Return an empty temporary directory, emptied by L{tearDown}.
+
+        The directories are handed out by L{outputDirs}, so that they're
+        kept in memory when possible, and reused by the next test cases.
+        """
+        path = self.scratch_dirs.acquire()
+        self._scratch_paths.append(path)
+        return path
+
+    def makeFile(self, content=None, suffix="", prefix="tmp", basename=None,
+                 dirname=None, path=None):
+        """Create a temporary file and return the path to it.
+
+        As C{MockerTestCase.makeFile}, the file is written with
+        C{content}, if given, and removed by L{tearDown}.
         """
-        for fname in sorted(os.listdir(self.output_dir)):
-            output = open(os.path.join(self.output_dir, fname), "r")
+        if path is not None:
+            self._cleanup_paths.append(path)
+        elif basename is not None:
+            if dirname is None:
+                dirname = tempfile.mkdtemp()
+                self._cleanup_paths.append(dirname)
+            path = os.path.join(dirname, basename)
+        else:
+            fd, path = tempfile.mkstemp(suffix, prefix, dirname)
+            self._cleanup_paths.append(path)
+            os.close(fd)
+            if content is None:
+                os.unlink(path)
+        if content is not None:
+            new_file = open(path, "w")
             try:
-                body = output.read()
+                new_file.write(content)
             finally:
-                output.close()
+                new_file.close()
+        return path
 
-            expat = xml.parsers.expat.ParserCreate()
-            parser = JsTestDriverResultParser(expat, result)
-            expat.Parse(body, 1)
-            parser.add_results()
+    def makeDir(self, suffix="", prefix="tmp", dirname=None, path=None):
+        """Create a temporary directory and return the path to it.
+
+        As C{MockerTestCase.makeDir}, it's removed by L{tearDown}.
+        """
+        if path is not None:
+            os.makedirs(path)
+        else:
+            path = tempfile.mkdtemp(suffix, prefix, dirname)
+        self._cleanup_paths.append(path)
+        return path
+
+    def _clientConfig(self):
+        """Return the configuration the clients run.
+
+        If C{JSTESTDRIVER_COVERAGE} is set, that's the configuration
+        with the coverage plugin added, written in a temporary
+        directory.
+        """
+        jar = coverageJar()
+        if jar is None:
+            return self.config_filename
+        if self.coverage_config is None:
+            self.coverage_config = os.path.join(self._scratchDir(),
+                                                "coverage.conf")
+            mergeConfigs([JsTestDriverConfig(self.config_filename)],
+                         self.coverage_config, [coveragePlugin(jar)])
+        return self.coverage_config
+
+    def _selection(self, patterns):
+        """Return the tests selected by C{patterns}, as for L{selectTests}.
+        """
+        if not patterns:
+            return None
+        config = JsTestDriverConfig(self.config_filename)
+        return selectTests(config.testNames(), patterns)
+
+    def _estimate(self, estimates):
+        """Return the expected duration of the configuration, in seconds.
+
+        If none of its test cases is in C{estimates}, it's expected to
+        take forever.
+        """
+        names = JsTestDriverConfig(self.config_filename).testCaseNames()
+        known = [estimates[name] for name in names if name in estimates]
+        if not known:
+            return float("inf")
+        return sum(known)
+
+    def _shards(self, servers=None, selection=None):
+        """Split the test cases of the configuration across the servers.
+
+        If given, only the tests in C{selection} are run.
+
+        Returns a list of C{(server, tests)} pairs, where C{tests} is
+        the value for the C{--tests} option.
+        """
+        if servers is None:
+            servers = serverURLs()
+        if selection is not None:
+            return shardTests(selection, servers, selected=True)
+        names = []
+        if len(servers) > 1:
+            names = JsTestDriverConfig(self.config_filename).testCaseNames()
+        return shardTests(names, servers)
+
+    def _runClients(self, shards, watch=None):
+        """Run a client for each shard, concurrently.
+
+        Clients are killed once they ran for C{JSTESTDRIVER_TIMEOUT}
+        seconds, or after C{JSTESTDRIVER_TEST_TIMEOUT} seconds without
+        any new report. Their timeouts are recorded in L{timeouts} for
+        L{_checkClients}, and the reports they completed are kept. If
+        C{JSTESTDRIVER_TIMEOUT_CONTINUE} is set, the test cases after
+        the one that hung are run by another client.
+
+        The servers that lost their browser are restarted by the layer
+        before the clients run, and whenever they lose it while running
+        them, in which case the test cases without a report are run
+        again. That's done C{JSTESTDRIVER_RECAPTURE} times at most, once
+        by default.
+
+        Returns a list of C{(server, returncode, stdout, stderr)} for
+        the clients that were not killed.
+        """
+        config_filename = self._clientConfig()
+        lost = getattr(self.layer, "lostBrowser", None)
+        recaptures = int(os.environ.get("JSTESTDRIVER_RECAPTURE", "1"))
+        if lost is not None and recaptures > 0:
+            for server in set(server for server, tests in shards):
+                if lost(server):
+                    self.layer.recapture(server)
+        else:
+            lost = None
+        watchdog = makeWatchdog("JSTESTDRIVER")
+        if watchdog is None:
+            if lost is None or not getattr(self.layer, "procs", None):
+                return runClients(config_filename, self.output_dir, shards,
+                                  watch)
+            watchdog = Watchdog()
+        runs = []
+        output_dir = self.output_dir
+        attempt = 0
+        while True:
+            shard_runs = runClients(config_filename, output_dir, shards,
+                                    watch, watchdog, lost)
+            remaining = []
+            servers = []
+            reported = None
+            for index, run in enumerate(shard_runs):
+                server, tests = shards[index]
+                reason, seconds = watchdog.expired.get(index, (None, None))
+                if lost is not None and lost(server):
+                    # The client may also have exited on its own once
+                    # its browser was gone.
+                    reason = "lost"
+                if reason is None:
+                    runs.append(run)
+                    continue
+                if reported is None:
+                    reported = self._dropIncompleteReports()
+                # Clients run the test cases in the order they're loaded,
+                # so the first one without a report is the one that hung.
+                order = JsTestDriverConfig(
+                    self.config_filename).loadedTestCaseNames()
+                if tests == "all":
+                    names = order
+                else:
+                    positions = dict(
+                        (name, index) for index, name in enumerate(order))
+                    names = sorted(
+                        tests.split(","),
+                        key=lambda name: positions.get(
+                            name.split(".", 1)[0], len(order)))
+                # Tests may be selected one test function at a time.
+                pending = [name for name in names
+                           if name.split(".", 1)[0] not in reported]
+                if reason == "lost" and recaptures > 0:
+                    if self.layer.recapture(server):
+                        recaptures -= 1
+                        remaining.extend(pending)
+                        servers.append(server)
+                        continue
+                hung = None
+                if reason == "idle" and pending:
+                    hung = pending.pop(0)
+                    if os.environ.get("JSTESTDRIVER_TIMEOUT_CONTINUE"):
+                        remaining.extend(pending)
+                        servers.append(server)
+                self.timeouts.append((server, reason, seconds, hung))
+            if not remaining or (watch is not None and not watch()):
+                return runs
+            # Go on with the test cases that didn't run, on the servers
+            # whose clients were killed.
+            attempt += 1
+            output_dir = os.path.join(self.output_dir, "retry-%d" % attempt)
+            os.mkdir(output_dir)
+            shards = [(server, ",".join(shard)) for server, shard
+                      in zip(servers, splitTests(remaining, len(servers),
+                                                 durationEstimates()))]
+            watchdog = makeWatchdog("JSTESTDRIVER") or Watchdog()
+
+    def _dropIncompleteReports(self):
+        """Remove the reports killed clients didn't finish writing.
+
+        Returns the names of the test cases with complete reports.
+        """
+        names = set()
+        for path in self._outputFiles():
+            try:
+                test_results = parseResultFile(path)
+            except xml.parsers.expat.ExpatError:
+                os.remove(path)
+                continue
+            names.update(test_result.classname
+                         for test_result, outcome in test_results)
+        return names
+
+    def _checkClients(self, result, runs):
+        for server, reason, seconds, hung in self.timeouts:
+            self.client_failed = True
+            if reason == "timeout":
+                message = ("JsTestDriver client on %s killed after running"
+                           " for %s seconds" % (server, seconds))
+            elif reason == "lost":
+                message = ("JsTestDriver client on %s stopped after its"
+                           " browser was lost" % server)
+            else:
+                message = ("JsTestDriver client on %s killed after making"
+                           " no progress for %s seconds" % (server, seconds))
+                if hung is not None:
+                    message += ", running %s" % hung
+            test_result = GlobalJsTestDriverResult(str(self), self.id())
+            result.startTest(test_result)
+            result.addError(
+                test_result,
+                (JsTestDriverTimeout, JsTestDriverTimeout(message), None))
+            result.stopTest(test_result)
+        for server, returncode, stdout, stderr in runs:
+            # JsTestDriver 1.2.2 outputs this message to stdout when the
+            # actual tests failed. It also returns an error code. Only
+            # raise an error if the tests did not run at all, but not if
+            # they just failed.
+            if returncode != 0 and not "Tests failed." in stdout:
+                raise ValueError(
+                    "Failed to execute JsTestDriver tests for:\n"
+                    "%s (%s)\nError: %s" %
+                    (self.config_filename, server, stderr))
+            if stderr:
+                # JsTestDriver 1.2.2 outputs this message for a
+                # successful run with --runnerMode=INFO.
+                if not "Finished action run." in stderr:
+                    self.client_failed = True
+                    test_result = GlobalJsTestDriverResult(
+                        str(self), self.id())
+                    result.startTest(test_result)
+                    result.addFailure(
+                        test_result,
+                        (RuntimeError, RuntimeError(str(stderr)), None))
+
+    def _runTest(self, result, selection=None):
+        watch = None
+        if os.environ.get("JSTESTDRIVER_LIVE_RESULTS"):
+            watch = LiveReporter(self, result)
+        timer = PhaseTimer(test=self.id())
+        runs = self._runClients(self._shards(selection=selection), watch)
+        timer.mark("run")
+        # If the run was stopped, the clients were terminated.
+        if not result.shouldStop:
+            self._checkClients(result, runs)
+
+    def _outputFiles(self):
+        """Return the paths of the XML reports, in a stable order."""
+        return outputFiles(self.output_dir)
+
+    def _reportResults(self, result, test_results=None):
+        """Parse generated test results and report them to L{unittest}.
+
+        The results of all shards are merged into a single report.
+        Files already reported while the clients were running are
+        skipped. If given, the C{(test_result, outcome)} pairs in
+        C{test_results} are reported instead. Failed tests are run again
+        first, as done by L{_retryFailures}.
+        """
+        if result.shouldStop:
+            return
+        timer = PhaseTimer(test=self.id())
+        parser = JsTestDriverResultParser(None, result)
+        if test_results is not None:
+            parser.test_results.update(test_results)
+        else:
+            paths = [path for path in self._outputFiles()
+                     if path not in self.reported_files]
+            for test_results in parseResultFiles(paths):
+                parser.test_results.update(test_results)
+            timer.mark("parse")
+        if self._retryFailures(parser.test_results):
+            timer.mark("retry")
+        self.reported_results.extend(parser.test_results.items())
+        parser.add_results()
+        timer.mark("report")
+
+    def _retryFailures(self, test_results):
+        """Run the failed tests in C{test_results} again.
+
+        C{JSTESTDRIVER_RETRY} is the number of times they're run again,
+        on the first server, by a client running only them. A test
+        passing on a retry is reported instead of its failure, marked
+        as L{JsTestDriverResult.retried}.
+
+        Returns whether anything was run again.
+        """
+        retries = int(os.environ.get("JSTESTDRIVER_RETRY", "0"))
+        retried = False
+        for attempt in range(retries):
+            failed = {}
+            for test_result, outcome in test_results.items():
+                if outcome != "success":
+                    failed[(test_result.browser, test_result.classname,
+                            test_result.name)] = test_result
+            if not failed:
+                break
+            server = serverURLs()[0]
+            retried = True
+            names = sorted(set("%s.%s" % (classname, name)
+                               for browser, classname, name in failed))
+            output_dir = self._scratchDir()
+            runClients(self.config_filename, output_dir,
+                       [(server, ",".join(names))],
+                       watchdog=makeWatchdog("JSTESTDRIVER"))
+            for retried_results in parseResultFiles(outputFiles(output_dir)):
+                for test_result, outcome in retried_results:
+                    original = failed.get((test_result.browser,
+                                           test_result.classname,
+                                           test_result.name))
+                    if original is None:
+                        continue
+                    del test_results[original]
+                    test_result.retried = outcome == "success"
+                    test_results[test_result] = outcome
+        return retried
+
+    def _collectCoverage(self):
+        """Merge the coverage written by the clients into L{coverage}.
+
+        It's also added to the L{collectedCoverage}, written out when
+        the layer is torn down.
+        """
+        if self.coverage_config is None:
+            return
+        self.coverage = readCoverage(self.output_dir,
+                                     os.path.dirname(self.coverage_config))
+        collectCoverage(self.coverage)
+
+    def _recordDurations(self):
+        """Record the durations of the reported tests, for L{balance}.
+
+        They are kept in C{LAZR_TESTING_DURATIONS}, if set.
+        """
+        store = durationStore()
+        if store is None:
+            return
+        durations = {}
+        for test_result, outcome in self.reported_results:
+            durations.setdefault(test_result.browser, {})[
+                "%s.%s" % (test_result.classname, test_result.name)] = (
+                float(test_result.duration))
+        for browser, browser_durations in durations.items():
+            store.record(browser, browser_durations)
+        store.save()
+
+    def _cacheLookup(self):
+        """Return the digest of the configuration and its cached results.
+
+        Both are C{None} unless C{JSTESTDRIVER_CACHE} is set to the
+        cache directory. The results are also C{None} if none were
+        recorded for the current digest, or if C{JSTESTDRIVER_NO_CACHE}
+        is set to bypass the cache.
+        """
+        directory = os.environ.get("JSTESTDRIVER_CACHE")
+        if not directory:
+            return None, None
+        # Results from another version of JsTestDriver or from another
+        # browser can't be reused either, nor results without coverage
+        # when it's wanted.
+        extras = [os.environ["JSTESTDRIVER"],
+                  os.environ.get("JSTESTDRIVER_BROWSER", "default")]
+        jar = coverageJar()
+        if jar is not None:
+            extras.append(jar)
+        digest = configDigest(self.config_filename, extras)
+        if os.environ.get("JSTESTDRIVER_NO_CACHE"):
+            return digest, None
+        return digest, ResultCache(directory).get(self.config_filename,
+                                                  digest)
+
+    def _cacheResults(self, result, digest, selection=None):
+        """Record the results reported by a complete, clean run."""
+        if (digest is None or result.shouldStop or self.client_failed or
+            selection is not None):
+            return
+        coverage = None
+        if coverageJar() is not None:
+            if self.coverage is None:
+                # Run as part of a batch, the coverage of the test case
+                # is unknown.
+                return
+            coverage = self.coverage.toRecords()
+        records = []
+        for test_result, outcome in self.reported_results:
+            records.append({"browser": test_result.browser,
+                            "classname": test_result.classname,
+                            "name": test_result.name,
+                            "duration": test_result.duration,
+                            "message": test_result.message,
+                            "content": test_result.content,
+                            "retried": test_result.retried,
+                            "outcome": outcome})
+        cache = ResultCache(os.environ["JSTESTDRIVER_CACHE"])
+        cache.put(self.config_filename, digest, records, coverage)
+
+    def _replayResults(self, result, records, selection=None):
+        """Report results recorded by L{_cacheResults}.
+
+        If given, only the results of the tests in C{selection} are
+        reported.
+        """
+        parser = JsTestDriverResultParser(None, result)
+        if selection is not None:
+            selection = set(selection)
+        for record in records:
+            if selection is not None and not (
+                record["classname"] in selection or
+                "%s.%s" % (record["classname"], record["name"]) in selection):
+                continue
+            test_result = JsTestDriverResult(
+                record["classname"], record["name"], record["browser"],
+                record["duration"])
+            test_result.message = record["message"]
+            test_result.content = record["content"]
+            test_result.retried = record.get("retried", False)
+            parser.test_results[test_result] = record["outcome"]
+        parser.add_results()
 
     def run(self, result=None):
         if result is None:
             result = self.defaultTestResult()
+        # Only the tests selected by the test runner are run.
+        selection = self._selection(testPatterns(result))
+        digest, records = self._cacheLookup()
+        if records is not None:
+            # Nothing changed since the results were recorded.
+            self._replayResults(result, records, selection)
+            if coverageJar() is not None:
+                cache = ResultCache(os.environ["JSTESTDRIVER_CACHE"])
+                coverage = cache.getCoverage(self.config_filename, digest)
+                if coverage is not None:
+                    collectCoverage(CoverageData.fromRecords(coverage))
+            return
+        batch = JsTestDriverBatch.forTest(self, result)
+        if batch is not None:
+            # The client runs the configurations of the whole batch.
+            runs, test_results = batch.wait(self)
+            self.setUp()
+            try:
+                self._checkClients(result, runs)
+                self._reportResults(result, test_results)
+                self._recordDurations()
+                self._cacheResults(result, digest, selection)
+            finally:
+                self.tearDown()
+            return
+        executor = JsTestDriverExecutor.forTest(self, result)
+        if executor is not None:
+            # The client already ran, or is running, in the background.
+            runs = executor.wait(self)
+            try:
+                self._checkClients(result, runs)
+                self._reportResults(result)
+                self._collectCoverage()
+                self._recordDurations()
+                self._cacheResults(result, digest, selection)
+            finally:
+                self.tearDown()
+            return
         self.setUp()
 
         try:
-            self._runTest(result)
+            self._runTest(result, selection)
             self._reportResults(result)
+            self._collectCoverage()
+            self._recordDurations()
+            self._cacheResults(result, digest, selection)
         finally:
             self.tearDown()
 
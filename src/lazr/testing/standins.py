@@ -0,0 +1,433 @@
+"""Stand-ins for the I{JsTestDriver} and I{Yeti} servers and clients.
+
+There's also a stand-in headless browser, for
+C{LAZR_TESTING_HEADLESS_BROWSER}, which connects to the URL it's given
+and then stays idle until killed.
+
+They take the same command line options as the real ones, log the
+same lines, and write the same XML reports and subunit streams, but
+need neither Java nor a browser, so that the layers and test cases can
+be exercised, load-tested and profiled anywhere::
+
+  JSTESTDRIVER="`python -c 'from lazr.testing.standins import *
+  print jsTestDriverCommand()'`"
+
+The servers accept connections and answer anything with an empty
+page. The clients find the tests the way L{JsTestDriverConfig} does,
+and make them pass, unless told otherwise by these variables:
+
+  - C{LAZR_TESTING_STANDIN_START_DELAY}: seconds a server takes to
+    start.
+  - C{LAZR_TESTING_STANDIN_CAPTURE_DELAY}: seconds the I{JsTestDriver}
+    server takes to capture its browsers.
+  - C{LAZR_TESTING_STANDIN_BROWSERS}: the number of browsers running
+    the tests, one by default.
+  - C{LAZR_TESTING_STANDIN_TEST_DELAY}: seconds each test takes.
+  - C{LAZR_TESTING_STANDIN_FAIL} and C{LAZR_TESTING_STANDIN_ERROR}:
+    regular expressions; the tests whose name (C{TestCase.testName},
+    or C{file.testName} for Yeti) matches fail or error.
+  - C{LAZR_TESTING_STANDIN_FAILURE_RATE}: the probability that any
+    other test fails.
+  - C{LAZR_TESTING_STANDIN_CRASH}: C{start} to have the servers exit
+    instead of starting, C{capture} to have the I{JsTestDriver} server
+    never capture a browser, C{client} to have the clients exit with
+    an error before running anything, C{hang} to have them hang
+    after the first test case or file, and C{browser} to have the
+    browser of the I{JsTestDriver} server disconnect after the first
+    test case, leaving the client hanging.
+  - C{LAZR_TESTING_STANDIN_CRASH_ONCE}: a file created by the first
+    browser to disconnect; the others don't, once it exists.
+
+When its configuration has the coverage plugin, the I{JsTestDriver}
+client also writes the coverage of the sources, every line that's
+neither blank nor a comment being run once.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import socket
+
+
+def _script():
+    return os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+
+
+def jsTestDriverCommand():
+    """Return the command to use as C{JSTESTDRIVER}."""
+    return "%s %s jstestdriver" % (sys.executable, _script())
+
+
+def yetiCommand():
+    """Return the command to use as C{YETI}."""
+    return "%s %s yeti" % (sys.executable, _script())
+
+
+def headlessBrowserCommand():
+    """Return the command to use as C{LAZR_TESTING_HEADLESS_BROWSER}."""
+    return "%s %s browser" % (sys.executable, _script())
+
+
+def _setting(name, default=None):
+    return os.environ.get("LAZR_TESTING_STANDIN_%s" % name, default)
+
+
+def _option(args, name, default=None):
+    """Return the value of option C{name}, as C{--name value} or C{=value}.
+    """
+    for index, arg in enumerate(args):
+        if arg == name and index + 1 < len(args):
+            return args[index + 1]
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1:]
+    return default
+
+
+def _browsers():
+    count = int(_setting("BROWSERS", "1"))
+    return ["StandIn%d_1_0_Linux" % index for index in range(count)]
+
+
+def _log(stream, line):
+    stream.write(line + "\n")
+    stream.flush()
+
+
+def _hang():
+    while True:
+        time.sleep(60)
+
+
+def serve(port, lines, delayed_lines=(), delay=0, handle=None):
+    """Listen on C{port}, log C{lines} and answer connections forever.
+
+    C{delayed_lines} are logged C{delay} seconds after the others.
+    C{handle(request)}, if given, returns the HTTP status of the answer
+    to C{request}.
+    """
+    time.sleep(float(_setting("START_DELAY", "0")))
+    if _setting("CRASH") == "start":
+        _log(sys.stdout, "Error: the stand-in server failed to start")
+        return 1
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("localhost", int(port)))
+    listener.listen(50)
+    for line in lines:
+        _log(sys.stdout, line)
+    deadline = time.time() + delay
+    while True:
+        if delayed_lines is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                for line in delayed_lines:
+                    _log(sys.stdout, line)
+                delayed_lines = None
+                remaining = None
+            listener.settimeout(remaining)
+        try:
+            connection = listener.accept()[0]
+        except socket.timeout:
+            continue
+        try:
+            connection.settimeout(1)
+            try:
+                request = connection.recv(4096)
+                status = "200 OK"
+                if handle is not None:
+                    status = handle(request)
+                connection.sendall(
+                    "HTTP/1.0 %s\r\nContent-Length: 0\r\n\r\n" % status)
+            except socket.error:
+                pass
+        finally:
+            connection.close()
+
+
+def _connect(host, port):
+    """Return whether C{host:port} accepts connections."""
+    connection = socket.socket()
+    try:
+        try:
+            connection.connect((host, int(port)))
+        except socket.error:
+            return False
+        return True
+    finally:
+        connection.close()
+
+
+def _status(host, port, path):
+    """Return the HTTP status of C{path} on C{host:port}, or C{None}."""
+    connection = socket.socket()
+    try:
+        try:
+            connection.connect((host, int(port)))
+            connection.sendall("GET %s HTTP/1.0\r\n\r\n" % path)
+            answer = connection.recv(4096)
+        except socket.error:
+            return None
+    finally:
+        connection.close()
+    match = re.match(r"HTTP/\S+ (\d+)", answer)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def _crashOnce():
+    """Return whether this is the browser crash, if there's to be one."""
+    path = _setting("CRASH_ONCE")
+    if path is None:
+        return True
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except OSError:
+        return False
+    return True
+
+
+class Outcomes(object):
+    """Decide the outcome of each test, as configured."""
+
+    def __init__(self):
+        self.fail = _setting("FAIL")
+        self.error = _setting("ERROR")
+        self.failure_rate = float(_setting("FAILURE_RATE", "0"))
+        self.delay = float(_setting("TEST_DELAY", "0"))
+        self.random = random.Random()
+
+    def __call__(self, name):
+        """Run the test C{name}, returning its outcome."""
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error and re.search(self.error, name):
+            return "error"
+        if self.fail and re.search(self.fail, name):
+            return "failure"
+        if self.random.random() < self.failure_rate:
+            return "failure"
+        return "success"
+
+
+def selectTests(tests, selection, order):
+    """Return the C{(TestCase, [testName...])} pairs selected for C{--tests}.
+
+    They're returned in the C{order} of the names of the test cases, the
+    order in which they're loaded, as a real client runs them.
+    """
+    if selection == "all":
+        return [(name, tests[name]) for name in order if name in tests]
+    selected = {}
+    for item in selection.split(","):
+        name, dot, function = item.partition(".")
+        if name not in tests:
+            continue
+        functions = selected.setdefault(name, [])
+        for candidate in tests[name]:
+            if (not function or candidate == function) and (
+                candidate not in functions):
+                functions.append(candidate)
+    return [(name, selected[name]) for name in order if name in selected]
+
+
+def _writeCoverage(config, output_dir):
+    """Write the coverage of the sources of C{config}, as the plugin does.
+    """
+    from lazr.testing.jscoverage import COVERAGE_MODULE, COVERAGE_SUFFIX
+
+    if not [plugin for plugin in config.plugins
+            if plugin.get("module") == COVERAGE_MODULE]:
+        return
+    basepath = os.path.dirname(config.filename)
+    path = os.path.join(output_dir,
+                        os.path.basename(config.filename) + COVERAGE_SUFFIX)
+    coverage = open(path, "w")
+    try:
+        for source_path in config.sourceFiles():
+            coverage.write("SF:%s\n" % os.path.relpath(source_path, basepath))
+            source = open(source_path)
+            try:
+                for number, line in enumerate(source):
+                    line = line.strip()
+                    if line and not line.startswith(("//", "/*", "*")):
+                        coverage.write("DA:%d,1\n" % (number + 1))
+            finally:
+                source.close()
+            coverage.write("end_of_record\n")
+    finally:
+        coverage.close()
+
+
+def jsTestDriverClient(args):
+    from lazr.testing.jsconfig import JsTestDriverConfig
+
+    server = _option(args, "--server")
+    match = re.match(r"\w+://([^:/]+):(\d+)", server or "")
+    if match is None or not _connect(*match.groups()):
+        _log(sys.stderr, "Error: could not connect to %s" % server)
+        return 1
+    if _setting("CRASH") == "client":
+        _log(sys.stderr, "Error: the stand-in client crashed")
+        return 1
+    config = JsTestDriverConfig(_option(args, "--config"))
+    output_dir = _option(args, "--testOutput")
+    tests = selectTests(config.testNames(), _option(args, "--tests", "all"),
+                        config.loadedTestCaseNames())
+    run = Outcomes()
+    failed = False
+    for index, (name, functions) in enumerate(tests):
+        if index > 0 and _setting("CRASH") == "hang":
+            _hang()
+        if (index > 0 and _setting("CRASH") == "browser" and
+            _status(match.group(1), match.group(2),
+                    "/standin/browser") != 200):
+            # The client waits for a browser that never comes back.
+            _hang()
+        for browser in _browsers():
+            cases = []
+            for function in functions:
+                start = time.time()
+                outcome = run("%s.%s" % (name, function))
+                body = ""
+                if outcome == "failure":
+                    body = ('<failure type="failed" message="expected true'
+                            ' but was false">at %s (stand-in.js:1)</failure>'
+                            % function)
+                elif outcome == "error":
+                    body = ('<error type="error">ReferenceError: y is not'
+                            ' defined\n  at %s (stand-in.js:1)</error>'
+                            % function)
+                failed = failed or outcome != "success"
+                cases.append(
+                    '<testcase classname="%s.%s" name="%s" time="%.3f">%s'
+                    '</testcase>' % (browser, name, function,
+                                     time.time() - start, body))
+            path = os.path.join(output_dir, "TEST-%s.%s.xml" % (browser, name))
+            # Written in one go, as a report is only read once complete.
+            report = open(path + ".tmp", "w")
+            try:
+                report.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                             '<testsuite name="%s">%s</testsuite>\n' %
+                             (name, "".join(cases)))
+            finally:
+                report.close()
+            os.rename(path + ".tmp", path)
+    _writeCoverage(config, output_dir)
+    if failed:
+        _log(sys.stdout, "Tests failed.")
+    _log(sys.stderr, "INFO: Finished action run.")
+    return failed and 1 or 0
+
+
+def jsTestDriver(args):
+    """Act as the I{JsTestDriver} server or client, depending on C{args}.
+    """
+    if _option(args, "--config") is not None:
+        return jsTestDriverClient(args)
+    captured = ["INFO: Browser Captured: %s" % browser
+                for browser in _browsers()]
+    if _option(args, "--browser") is None or _setting("CRASH") == "capture":
+        captured = ()
+    browsers = list(_browsers())
+
+    def handle(request):
+        if not request.startswith("GET /standin/browser "):
+            return "200 OK"
+        if browsers and _setting("CRASH") == "browser" and _crashOnce():
+            _log(sys.stdout,
+                 "INFO: Browser Disconnected: %s" % browsers.pop())
+        if len(browsers) < len(_browsers()):
+            return "503 Service Unavailable"
+        return "200 OK"
+    return serve(_option(args, "--port", "4224"),
+                 ["INFO: Finished action run."], captured,
+                 float(_setting("CAPTURE_DELAY", "0")), handle)
+
+
+def yetiClient(args):
+    from lazr.testing.jsconfig import FUNCTION_PATTERN
+
+    port = _option(args, "--port", "4422")
+    if not _connect("localhost", port):
+        _log(sys.stdout, "Error: could not connect to port %s" % port)
+        return 1
+    if _setting("CRASH") == "client":
+        _log(sys.stdout, "Error: the stand-in client crashed")
+        return 1
+    run = Outcomes()
+    paths = [arg for arg in args if not arg.startswith("-")]
+    for index, path in enumerate(paths):
+        if index > 0 and _setting("CRASH") == "hang":
+            _hang()
+        source = open(path)
+        try:
+            functions = FUNCTION_PATTERN.findall(source.read())
+        finally:
+            source.close()
+        name = os.path.basename(path)
+        for browser in _browsers():
+            for function in functions or ["test"]:
+                test_id = "%s.%s.%s" % (browser, name, function)
+                _log(sys.stdout, "time: %s" % _timestamp())
+                _log(sys.stdout, "test: %s" % test_id)
+                outcome = run("%s.%s" % (name, function))
+                _log(sys.stdout, "time: %s" % _timestamp())
+                if outcome == "success":
+                    _log(sys.stdout, "success: %s" % test_id)
+                else:
+                    _log(sys.stdout, "%s: %s [\n%s failed\n]" %
+                         (outcome, test_id, function))
+    return 0
+
+
+def _timestamp():
+    now = time.time()
+    return "%s.%06dZ" % (time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now)),
+                         int(now % 1 * 1000000))
+
+
+def yeti(args):
+    """Act as the I{Yeti} server or client, depending on C{args}."""
+    if "--server" in args:
+        port = _option(args, "--port", "4422")
+        return serve(port, ["Visit http://localhost:%s, then run:" % port,
+                            "to run and report the results."])
+    return yetiClient(args)
+
+
+def browser(args):
+    """Act as a headless browser opening the URL last in C{args}.
+
+    The URL is written to C{standin-browser} in the profile directory.
+    """
+    url = args[-1]
+    profile = _option(args, "--user-data-dir") or _option(args, "-profile")
+    if profile is not None:
+        url_file = open(os.path.join(profile, "standin-browser"), "w")
+        try:
+            url_file.write(url)
+        finally:
+            url_file.close()
+    match = re.match(r"\w+://([^:/]+):(\d+)", url)
+    if match is not None:
+        _connect(*match.groups())
+    _hang()
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    name, args = args[0], args[1:]
+    return {"jstestdriver": jsTestDriver, "yeti": yeti,
+            "browser": browser}[name](args)
+
+
+if __name__ == "__main__":
+    # Run as a script from the JSTESTDRIVER and YETI commands, which
+    # only know about the interpreter and this file.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))))
+    sys.exit(main())
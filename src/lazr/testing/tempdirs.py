@@ -0,0 +1,128 @@
+"""Temporary directories kept in memory, reused and cleaned up reliably.
+
+The I{JsTestDriver} clients can only report results by writing XML
+files, which are read back as soon as they're written. Those files
+never need to reach the disk: the directories they're written to are
+created under C{/dev/shm} when it's there, or under
+C{JSTESTDRIVER_OUTPUT_DIR} if set, and reused from one test case to
+the next.
+"""
+
+import os
+import re
+import stat
+import errno
+import atexit
+import shutil
+import tempfile
+import threading
+
+from lazr.testing.daemon import isAlive
+
+
+def volatileDir():
+    """Return C{/dev/shm} if it can be used, or the temporary directory.
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def emptyDir(path):
+    """Remove everything in the directory at C{path}, but not itself."""
+    for name in os.listdir(path):
+        child = os.path.join(path, name)
+        if os.path.isdir(child) and not os.path.islink(child):
+            shutil.rmtree(child, ignore_errors=True)
+        else:
+            try:
+                os.remove(child)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+
+class ScratchDirs(object):
+    """Hand out temporary directories under C{root}, and reuse them.
+
+    All the directories of a process are kept in a directory of its
+    own, made by C{mkdtemp} with its pid in the name, which is removed
+    when the process exits. The ones left behind by processes that
+    died, for instance killed by a CI timeout, are removed when the
+    next process creates its own, if they belong to the same user. A directory given back with L{release} is emptied right away,
+    and handed out again by the next L{acquire}.
+    """
+
+    prefix = "lazr-scratch-"
+
+    def __init__(self, root):
+        self.root = root
+        self.path = None
+        self.free = []
+        self._lock = threading.Lock()
+
+    def _cleanStale(self):
+        pattern = re.compile(r"^%s(\d+)-" % re.escape(self.prefix))
+        for name in os.listdir(self.root):
+            match = pattern.match(name)
+            if match is None or isAlive(int(match.group(1))):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                info = os.lstat(path)
+            except OSError:
+                continue
+            # Anybody can make a directory, or a link, with such a name
+            # in a shared root, so only our own directories are removed.
+            if stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid():
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _base(self):
+        if self.path is None:
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root)
+            self._cleanStale()
+            self.path = tempfile.mkdtemp(
+                prefix="%s%d-" % (self.prefix, os.getpid()), dir=self.root)
+            atexit.register(self.close)
+        return self.path
+
+    def acquire(self):
+        """Return an empty directory."""
+        with self._lock:
+            if self.free:
+                return self.free.pop()
+            return tempfile.mkdtemp(dir=self._base())
+
+    def release(self, path):
+        """Empty the directory at C{path}, so that it can be reused."""
+        if not os.path.isdir(path):
+            return
+        emptyDir(path)
+        with self._lock:
+            if self.path is not None:
+                self.free.append(path)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def close(self):
+        """Remove all the directories."""
+        with self._lock:
+            if self.path is not None:
+                shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+            self.free = []
+
+
+_scratch_dirs = {}
+_scratch_lock = threading.Lock()
+
+
+def outputDirs():
+    """Return the L{ScratchDirs} for the reports of the clients."""
+    root = os.environ.get("JSTESTDRIVER_OUTPUT_DIR") or volatileDir()
+    with _scratch_lock:
+        dirs = _scratch_dirs.get(root)
+        if dirs is None:
+            dirs = _scratch_dirs[root] = ScratchDirs(root)
+        return dirs
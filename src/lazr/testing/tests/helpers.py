@@ -0,0 +1,71 @@
+"""Helpers shared by the tests."""
+
+import os
+import operator
+
+from mocker import MockerTestCase
+
+
+class EnvironmentTestCase(MockerTestCase):
+    """A test case changing environment variables, restored on cleanup.
+
+    The variables starting with one of the L{prefixes} are removed by
+    L{setUp}, so that the tests start from a known environment.
+    """
+
+    prefixes = ()
+
+    def setUp(self):
+        super(EnvironmentTestCase, self).setUp()
+        self._saved_keys = set()
+        for key in os.environ.keys():
+            if key.startswith(self.prefixes):
+                self.setEnv(key, None)
+
+    def setEnv(self, key, value):
+        """Set C{key} to C{value}, or remove it if C{value} is C{None}.
+
+        Its value before the test is put back when the test is cleaned
+        up, or it's removed if it wasn't set.
+        """
+        if key not in self._saved_keys:
+            self._saved_keys.add(key)
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+class FakeServerProcess(object):
+    """A stand-in for the L{subprocess.Popen} object of a server.
+
+    Lines passed to L{log} show up on the process output.
+    """
+
+    def __init__(self):
+        read_fd, self.write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd)
+        self.returncode = None
+        self.terminated = False
+
+    def log(self, line):
+        os.write(self.write_fd, line + "\n")
+
+    def exit(self, returncode):
+        self.returncode = returncode
+        os.close(self.write_fd)
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+        self.exit(-15)
@@ -0,0 +1,118 @@
+import os
+import sys
+import unittest
+
+from cStringIO import StringIO
+
+from mocker import MockerTestCase
+
+from subunit import ProtocolTestCase
+
+from lazr.testing.benchmarks import (
+    LAZY_MODULES, compare, importModules, main, makeJsTestDriverReports,
+    makeSubunitStream)
+from lazr.testing.jstestdriver import parseResultFiles
+
+
+class BenchmarkTests(MockerTestCase):
+
+    def runMain(self, argv):
+        """Run L{main}, returning its exit code and what it printed."""
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            code = main(argv)
+            return code, sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_reports(self):
+        """
+        Synthetic reports hold the requested tests, for every browser,
+        and are the same every time.
+        """
+        directory = self.makeDir()
+        paths = makeJsTestDriverReports(directory, tests=50, cases=5,
+                                        browsers=2, failure_rate=0.2,
+                                        error_rate=0.2, output_size=10)
+        self.assertEqual(10, len(paths))
+        outcomes = {}
+        for test_results in parseResultFiles(paths):
+            for test_result, outcome in test_results:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        self.assertEqual(100, sum(outcomes.values()))
+        self.assertEqual(set(["success", "failure", "error"]),
+                         set(outcomes))
+        first = open(paths[0]).read()
+        makeJsTestDriverReports(directory, tests=50, cases=5, browsers=2,
+                                failure_rate=0.2, error_rate=0.2,
+                                output_size=10)
+        self.assertEqual(first, open(paths[0]).read())
+
+    def test_subunit_stream(self):
+        """
+        Synthetic subunit streams report the requested tests.
+        """
+        result = unittest.TestResult()
+        ProtocolTestCase(StringIO(makeSubunitStream(20, 0.5))).run(result)
+        self.assertEqual(20, result.testsRun)
+        self.assertTrue(result.failures)
+
+    def test_compare(self):
+        """
+        Measures worse than saved by more than the tolerance are
+        regressions. Rates, where higher is better, are left out.
+        """
+        saved = {"parse": {"seconds": 1.0, "tests_per_second": 1000.0}}
+        self.assertEqual(
+            [], compare({"parse": {"seconds": 1.05,
+                                   "tests_per_second": 10.0}}, saved, 0.1))
+        self.assertEqual(
+            [("parse", "seconds", 1.0, 1.5)],
+            compare({"parse": {"seconds": 1.5}}, saved, 0.1))
+        self.assertEqual([], compare({"report": {"seconds": 1.5}}, saved,
+                                     0.1))
+
+    def test_main(self):
+        """
+        The results are saved, and compared with the saved ones.
+        """
+        saved = os.path.join(self.makeDir(), "benchmarks.json")
+        code, output = self.runMain(["--tests", "10", "--cases", "2",
+                                     "--repeat", "1", "--save", saved,
+                                     "parse"])
+        self.assertEqual(0, code)
+        self.assertTrue(output.startswith("parse "))
+        self.assertTrue(os.path.exists(saved))
+        code, output = self.runMain(["--tests", "10", "--cases", "2",
+                                     "--repeat", "1", "--compare", saved,
+                                     "--tolerance", "1000", "parse"])
+        self.assertEqual(0, code)
+        self.assertFalse("REGRESSION" in output)
+
+    def test_lazy_imports(self):
+        """
+        Importing the layer modules doesn't import the modules only
+        needed to run the tests.
+        """
+        seconds, modules = importModules()
+        for name in LAZY_MODULES:
+            self.assertEqual(
+                [], [module for module in modules
+                     if module == name or module.startswith(name + ".")])
+
+    def test_import_budget(self):
+        """
+        Importing the layer modules taking longer than the budget fails
+        the run.
+        """
+        code, output = self.runMain(["--repeat", "1", "--import-budget",
+                                     "0", "import"])
+        self.assertEqual(1, code)
+        self.assertTrue("OVER BUDGET import seconds" in output)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(BenchmarkTests))
+    return suite
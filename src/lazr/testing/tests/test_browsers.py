@@ -0,0 +1,194 @@
+import os
+import operator
+import subprocess
+import tempfile
+import time
+import unittest
+
+from mocker import MockerTestCase
+
+from lazr.testing import jstestdriver
+from lazr.testing.benchmarks import freePort
+from lazr.testing.browsers import (
+    BrowserPool, BrowserRegistry, headlessCommand)
+from lazr.testing.standins import headlessBrowserCommand, yetiCommand
+from lazr.testing.yeti import YetiLayer
+
+
+class BrowserPoolTests(MockerTestCase):
+
+    def setUp(self):
+        super(BrowserPoolTests, self).setUp()
+        for key in ["LAZR_TESTING_HEADLESS_BROWSER",
+                    "LAZR_TESTING_PROFILE_DIR"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+        os.environ["LAZR_TESTING_HEADLESS_BROWSER"] = headlessBrowserCommand()
+        self.profile_dir = self.makeDir()
+        os.environ["LAZR_TESTING_PROFILE_DIR"] = self.profile_dir
+        self.registry = BrowserRegistry(self.makeDir())
+
+    def makePool(self, count):
+        pool = BrowserPool("http://localhost:%d" % freePort(), count,
+                           registry=self.registry)
+        self.addCleanup(pool.stop)
+        return pool
+
+    def test_headless_command(self):
+        """
+        Firefox and Chromium are told to run headless with the profile
+        in their own ways.
+        """
+        self.assertEqual(
+            ["/usr/bin/firefox", "-headless", "-no-remote", "-profile",
+             "/tmp/profile", "http://localhost:4224"],
+            headlessCommand(["/usr/bin/firefox"], "/tmp/profile",
+                            "http://localhost:4224"))
+        command = headlessCommand(["chromium"], "/tmp/profile",
+                                  "http://localhost:4224")
+        self.assertTrue("--headless" in command)
+        self.assertTrue("--user-data-dir=/tmp/profile" in command)
+        self.assertEqual("http://localhost:4224", command[-1])
+
+    def test_start_and_stop(self):
+        """
+        Each browser gets its own profile, and is recorded until the
+        pool is stopped, which removes the profiles.
+        """
+        pool = self.makePool(2)
+        pool.start()
+        self.assertEqual(2, len(pool.browsers))
+        profiles = [browser.profile for browser in pool.browsers]
+        self.assertEqual(sorted(profiles), sorted(
+            os.path.join(self.profile_dir, name)
+            for name in os.listdir(self.profile_dir)))
+        self.assertEqual(
+            sorted(browser.pid for browser in pool.browsers),
+            sorted(record["pid"] for record in self.registry.read()))
+        procs = [browser.proc for browser in pool.browsers]
+        pool.stop()
+        self.assertEqual([False, False],
+                         [proc.poll() is None for proc in procs])
+        self.assertEqual([], os.listdir(self.profile_dir))
+        self.assertEqual([], self.registry.read())
+
+    def test_restart(self):
+        """Browsers that exited are replaced, with a new profile."""
+        pool = self.makePool(2)
+        pool.start()
+        dead = pool.browsers[0]
+        dead.proc.terminate()
+        dead.proc.wait()
+        self.assertEqual(1, pool.restart())
+        self.assertTrue(pool.browsers[0] is not dead)
+        self.assertTrue(pool.browsers[0].isRunning())
+        self.assertFalse(os.path.exists(dead.profile))
+        self.assertEqual(0, pool.restart())
+
+    def test_clean_stale(self):
+        """
+        Browsers started by processes that died are killed, and their
+        profiles removed, when a pool starts.
+        """
+        owner = subprocess.Popen(["true"])
+        owner.wait()
+        profile = tempfile.mkdtemp(prefix="lazr-browser-",
+                                   dir=self.profile_dir)
+        orphan = subprocess.Popen(
+            headlessCommand(headlessBrowserCommand().split(), profile,
+                            "http://localhost:%d" % freePort()))
+        self.registry._write(
+            [{"pid": orphan.pid, "profile": profile, "owner": owner.pid}])
+        self.makePool(1).start()
+        self.assertEqual(-9, orphan.wait())
+        self.assertFalse(os.path.exists(profile))
+        self.assertEqual(1, len(self.registry.read()))
+
+    def test_clean_stale_foreign_records(self):
+        """
+        Records of anything but a browser profile are dropped, without
+        removing the directory they name or killing their process.
+        """
+        owner = subprocess.Popen(["true"])
+        owner.wait()
+        directory = self.makeDir()
+        other = subprocess.Popen(["sleep", "60"])
+        self.addCleanup(other.kill)
+        self.addCleanup(other.wait)
+        self.registry._write(
+            [{"pid": other.pid, "profile": directory, "owner": owner.pid},
+             {"pid": other.pid, "profile": "", "owner": owner.pid}])
+        self.assertEqual(2, len(self.registry.cleanStale()))
+        self.assertEqual(None, other.poll())
+        self.assertTrue(os.path.isdir(directory))
+        self.assertEqual([], self.registry.read())
+
+    def test_unsafe_state_dir(self):
+        """The records aren't used from a directory others can write to."""
+        os.chmod(self.registry.state_dir, 0777)
+        self.assertRaises(ValueError, self.registry.cleanStale)
+
+
+class HeadlessLayerTests(MockerTestCase):
+
+    def setUp(self):
+        super(HeadlessLayerTests, self).setUp()
+        for key in ["JSTESTDRIVER", "JSTESTDRIVER_BROWSER", "YETI",
+                    "YETI_BROWSER", "YETI_PORT", "YETI_SERVER",
+                    "YETI_PARALLEL", "LAZR_TESTING_HEADLESS_BROWSER",
+                    "LAZR_TESTING_PROFILE_DIR"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+            os.environ.pop(key, None)
+        os.environ["LAZR_TESTING_HEADLESS_BROWSER"] = headlessBrowserCommand()
+        os.environ["LAZR_TESTING_PROFILE_DIR"] = self.makeDir()
+
+    def test_jstestdriver(self):
+        """
+        JsTestDriver servers are given the headless wrapper as their
+        browser.
+        """
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_BROWSER"] = "headless"
+        cmd, browser = jstestdriver.serverCommand("4224")
+        self.assertEqual("headless_wrapper.py", os.path.basename(browser))
+        self.assertEqual(browser, cmd[cmd.index("--browser") + 1])
+
+    def test_yeti(self):
+        """
+        The Yeti layer starts a headless browser per client, pointed at
+        the server, and stops them on tearDown.
+        """
+        os.environ["YETI"] = yetiCommand()
+        os.environ["YETI_BROWSER"] = "headless"
+        os.environ["YETI_PORT"] = str(freePort())
+        os.environ["YETI_PARALLEL"] = "2"
+        YetiLayer.setUp()
+        try:
+            browsers = YetiLayer.browsers.browsers
+            self.assertEqual(2, len(browsers))
+            for browser in browsers:
+                self.assertTrue(browser.isRunning())
+                url_path = os.path.join(browser.profile, "standin-browser")
+                deadline = time.time() + 10
+                while not os.path.exists(url_path) and time.time() < deadline:
+                    time.sleep(0.05)
+                self.assertEqual(os.environ["YETI_SERVER"],
+                                 open(url_path).read())
+        finally:
+            YetiLayer.tearDown()
+        self.assertEqual([False, False],
+                         [browser.isRunning() for browser in browsers])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(BrowserPoolTests))
+    suite.addTests(unittest.makeSuite(HeadlessLayerTests))
+    return suite
@@ -0,0 +1,151 @@
+import os
+import operator
+import unittest
+
+from cStringIO import StringIO
+
+from mocker import ARGS, KWARGS, MockerTestCase
+
+from lazr.testing.cache import ResultCache, configDigest
+from lazr.testing.jstestdriver import JsTestDriverTestCase
+
+
+class FailingClientProcess(object):
+    """A stand-in for a client whose single test fails."""
+
+    def __init__(self, cmd, **kwargs):
+        output_dir = cmd[cmd.index("--testOutput") + 1]
+        self.returncode = 1
+        report = open(os.path.join(output_dir, "TEST-all.xml"), "w")
+        report.write(
+            '<testsuite><testcase classname="Browser.FooTestCase"'
+            ' name="testFoo" time="0.001"><failure type="failed"'
+            ' message="expected 1">at foo.js:1\n  at foo.js:2</failure>'
+            '</testcase></testsuite>')
+        report.close()
+        self.stdout = StringIO("Tests failed.")
+        self.stderr = StringIO("INFO: Finished action run.\n")
+
+    def wait(self):
+        return self.returncode
+
+
+class ResultCacheTests(MockerTestCase):
+
+    def setUp(self):
+        super(ResultCacheTests, self).setUp()
+        self.directory = self.makeDir()
+        self.source = self.makeFile("var a = 1;\n", dirname=self.directory,
+                                    basename="a.js")
+        self.config_filename = self.makeFile(
+            "load:\n  - '*.js'\n", dirname=self.directory,
+            basename="tests.conf")
+
+    def test_digest_covers_files(self):
+        """
+        The digest changes when a loaded file changes, or when a new
+        file matches one of the patterns.
+        """
+        digest = configDigest(self.config_filename)
+        self.assertEqual(digest, configDigest(self.config_filename))
+        self.assertNotEqual(digest,
+                            configDigest(self.config_filename, ["java"]))
+        open(self.source, "w").write("var a = 2;\n")
+        changed_digest = configDigest(self.config_filename)
+        self.assertNotEqual(digest, changed_digest)
+        self.makeFile("", dirname=self.directory, basename="b.js")
+        self.assertNotEqual(changed_digest,
+                            configDigest(self.config_filename))
+
+    def test_get_put(self):
+        """
+        Results are only returned for the digest they were recorded for.
+        """
+        cache = ResultCache(os.path.join(self.makeDir(), "cache"))
+        self.assertEqual(None, cache.get(self.config_filename, "abc"))
+        cache.put(self.config_filename, "abc", [{"name": "testFoo"}])
+        self.assertEqual([{"name": "testFoo"}],
+                         cache.get(self.config_filename, "abc"))
+        self.assertEqual(None, cache.get(self.config_filename, "def"))
+
+    def test_coverage(self):
+        """The coverage of a run can be recorded along with its results."""
+        cache = ResultCache(os.path.join(self.makeDir(), "cache"))
+        cache.put(self.config_filename, "abc", [])
+        self.assertEqual(None, cache.getCoverage(self.config_filename, "abc"))
+        cache.put(self.config_filename, "abc", [], {"a.js": [[1, 2]]})
+        self.assertEqual({"a.js": [[1, 2]]},
+                         cache.getCoverage(self.config_filename, "abc"))
+        self.assertEqual(None, cache.getCoverage(self.config_filename, "def"))
+
+
+class JsTestDriverCacheTests(MockerTestCase):
+
+    def setUp(self):
+        super(JsTestDriverCacheTests, self).setUp()
+        for key in ["JSTESTDRIVER", "JSTESTDRIVER_SERVER",
+                    "JSTESTDRIVER_SERVERS", "JSTESTDRIVER_CACHE",
+                    "JSTESTDRIVER_NO_CACHE"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+        os.environ.pop("JSTESTDRIVER_SERVERS", None)
+        os.environ.pop("JSTESTDRIVER_NO_CACHE", None)
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ["JSTESTDRIVER_CACHE"] = self.makeDir()
+        directory = self.makeDir()
+        self.source = self.makeFile("", dirname=directory, basename="foo.js")
+
+        class CachedTest(JsTestDriverTestCase):
+            config_filename = self.makeFile(
+                "load:\n  - foo.js\n", dirname=directory,
+                basename="tests.conf")
+        self.test_class = CachedTest
+
+    def run_twice(self, clients):
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(FailingClientProcess)
+        self.mocker.count(clients)
+        self.mocker.replay()
+        results = []
+        for i in range(2):
+            result = unittest.TestResult()
+            self.test_class("runTest").run(result)
+            results.append(result)
+        return results
+
+    def test_results_are_replayed(self):
+        """
+        While nothing changed, the results of the last run are reported
+        again without running the client, failures included.
+        """
+        first, second = self.run_twice(1)
+        self.assertEqual(1, len(first.failures))
+        self.assertEqual(1, second.testsRun)
+        self.assertEqual([str(test) for test, error in first.failures],
+                         [str(test) for test, error in second.failures])
+        self.assertEqual([error for test, error in first.failures],
+                         [error for test, error in second.failures])
+
+    def test_bypass(self):
+        """
+        Setting C{JSTESTDRIVER_NO_CACHE} runs the client every time.
+        """
+        os.environ["JSTESTDRIVER_NO_CACHE"] = "1"
+        first, second = self.run_twice(2)
+        self.assertEqual(1, second.testsRun)
+
+    def tearDown(self):
+        super(JsTestDriverCacheTests, self).tearDown()
+        self.mocker.restore()
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(ResultCacheTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverCacheTests))
+    return suite
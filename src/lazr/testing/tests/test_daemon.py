@@ -0,0 +1,122 @@
+import os
+import stat
+import time
+import socket
+import unittest
+import subprocess
+
+from mocker import MockerTestCase
+
+from lazr.testing.daemon import ServerDaemon
+
+
+class ServerDaemonTests(MockerTestCase):
+
+    def setUp(self):
+        super(ServerDaemonTests, self).setUp()
+        self.server = socket.socket()
+        self.server.bind(("localhost", 0))
+        self.server.listen(5)
+        self.addCleanup(self.server.close)
+        self.port = self.server.getsockname()[1]
+        self.daemon = ServerDaemon(self.port, 60, ["java -jar x.jar", ""],
+                                   self.makeDir())
+
+    def deadPid(self):
+        proc = subprocess.Popen(["true"])
+        proc.wait()
+        return proc.pid
+
+    def writeState(self, **kwargs):
+        state = {"pid": os.getpid(),
+                 "url": "http://localhost:%s" % self.port,
+                 "config": ["java -jar x.jar", ""],
+                 "holders": [],
+                 "last_used": time.time()}
+        state.update(kwargs)
+        self.daemon.writeState(state)
+
+    def test_attach_to_running_server(self):
+        """
+        If a server is already running, it's used as is and the current
+        process is recorded as one of its holders.
+        """
+        self.writeState()
+        self.assertEqual("http://localhost:%s" % self.port,
+                         self.daemon.acquire())
+        self.assertEqual([os.getpid()], self.daemon.readState()["holders"])
+
+    def test_release(self):
+        """
+        Releasing the server leaves it running, and records when it was
+        last used.
+        """
+        self.writeState(holders=[os.getpid()], last_used=0)
+        self.daemon.release()
+        state = self.daemon.readState()
+        self.assertEqual([], state["holders"])
+        self.assertTrue(state["last_used"] > 0)
+
+    def test_dead_holders_are_forgotten(self):
+        """
+        Holders that died without releasing the server don't keep it
+        alive forever.
+        """
+        self.writeState(holders=[self.deadPid()])
+        self.daemon.acquire()
+        self.assertEqual([os.getpid()], self.daemon.readState()["holders"])
+
+    def test_different_configuration_in_use(self):
+        """
+        A server started with a different configuration can't be used,
+        and isn't stopped while other runs still use it.
+        """
+        self.writeState(config=["java -jar y.jar", ""],
+                        holders=[os.getppid()])
+        self.assertRaises(ValueError, self.daemon.acquire)
+
+    def test_keep_running_while_used(self):
+        """
+        The supervisor keeps the server running while it has holders, or
+        until it has been idle for too long.
+        """
+        proc = self.mocker.mock()
+        proc.poll()
+        self.mocker.result(None)
+        self.mocker.count(3)
+        self.mocker.replay()
+
+        self.writeState(holders=[os.getppid()], last_used=0)
+        self.assertTrue(self.daemon._keepRunning(proc))
+        self.writeState(holders=[], last_used=time.time())
+        self.assertTrue(self.daemon._keepRunning(proc))
+        self.writeState(holders=[], last_used=time.time() - 61)
+        self.assertFalse(self.daemon._keepRunning(proc))
+
+    def test_state_dir_is_created(self):
+        """The state directory is created, only accessible by its owner."""
+        state_dir = os.path.join(self.makeDir(), "state")
+        self.daemon = ServerDaemon(self.port, 60, ["java -jar x.jar", ""],
+                                   state_dir)
+        self.daemon.release()
+        self.assertEqual(0700, stat.S_IMODE(os.stat(state_dir).st_mode))
+
+    def test_unsafe_state_dir(self):
+        """
+        A state directory others can write to, or a link, isn't trusted:
+        the server it records isn't used, nor stopped.
+        """
+        self.writeState(config=["java -jar y.jar", ""])
+        os.chmod(self.daemon.state_dir, 0777)
+        self.assertRaises(ValueError, self.daemon.acquire)
+        os.chmod(self.daemon.state_dir, 0700)
+        link = os.path.join(self.makeDir(), "state")
+        os.symlink(self.daemon.state_dir, link)
+        self.daemon = ServerDaemon(self.port, 60, ["java -jar x.jar", ""],
+                                   link)
+        self.assertRaises(ValueError, self.daemon.acquire)
+        self.assertEqual([], self.daemon.readState()["holders"])
+
+
+def test_suite():
+    return unittest.makeSuite(ServerDaemonTests)
@@ -0,0 +1,110 @@
+import os
+import time
+import unittest
+
+from mocker import MockerTestCase
+
+from lazr.testing.discovery import DiscoveryIndex, indexPath
+
+
+class CountingIndex(DiscoveryIndex):
+    """A L{DiscoveryIndex} remembering the directories it listed."""
+
+    def _scan(self, relpath, path):
+        self.scanned.append(relpath)
+        return DiscoveryIndex._scan(self, relpath, path)
+
+    def find(self):
+        self.scanned = []
+        return DiscoveryIndex.find(self)
+
+
+class DiscoveryIndexTests(MockerTestCase):
+
+    def setUp(self):
+        super(DiscoveryIndexTests, self).setUp()
+        self.directory = self.makeDir()
+        for relpath in ["test_a.html", "helper.html", "sub/test_b.html",
+                        "sub/deep/test_c.html", "build/test_d.html",
+                        "sub/test_e.htm"]:
+            path = os.path.join(self.directory, relpath)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, "w").close()
+        self.age()
+        self.index_path = os.path.join(self.makeDir(), "index.json")
+
+    def age(self):
+        """Make the directories look like they changed an hour ago."""
+        old = time.time() - 3600
+        for base, dirs, files in os.walk(self.directory):
+            os.utime(base, (old, old))
+
+    def relpaths(self, paths):
+        return [os.path.relpath(path, self.directory) for path in paths]
+
+    def test_patterns(self):
+        """
+        Files matching the include patterns are found, but not the
+        excluded ones, nor anything in excluded directories.
+        """
+        index = DiscoveryIndex(self.directory, ["test_*.html", "*.htm"],
+                               ["build", "*/deep/*"])
+        self.assertEqual(["sub/test_b.html", "sub/test_e.htm",
+                          "test_a.html"],
+                         self.relpaths(index.find()))
+
+    def test_unchanged_directories_are_not_listed(self):
+        """
+        Once indexed, only directories that changed are listed again.
+        """
+        index = CountingIndex(self.directory, index_path=self.index_path)
+        found = index.find()
+        index.save()
+        self.assertEqual(["", "build", "sub", "sub/deep"],
+                         sorted(index.scanned))
+
+        index = CountingIndex(self.directory, index_path=self.index_path)
+        self.assertEqual(found, index.find())
+        self.assertEqual([], index.scanned)
+
+        open(os.path.join(self.directory, "sub", "test_f.html"), "w").close()
+        index = CountingIndex(self.directory, index_path=self.index_path)
+        self.assertEqual(
+            ["build/test_d.html", "sub/deep/test_c.html", "sub/test_b.html",
+             "sub/test_f.html", "test_a.html"],
+            self.relpaths(index.find()))
+        self.assertEqual(["sub"], index.scanned)
+
+    def test_patterns_change(self):
+        """
+        An index made with other patterns isn't used.
+        """
+        index = DiscoveryIndex(self.directory, index_path=self.index_path)
+        index.find()
+        index.save()
+        index = CountingIndex(self.directory, ["*.htm"],
+                              index_path=self.index_path)
+        self.assertEqual(["sub/test_e.htm"], self.relpaths(index.find()))
+        self.assertNotEqual([], index.scanned)
+        self.assertNotEqual(
+            indexPath("/tmp", self.directory, ["test_*.html"], []),
+            indexPath("/tmp", self.directory, ["*.htm"], []))
+
+    def test_directory_links_are_not_followed(self):
+        """
+        Links to directories aren't followed, so that a link to a
+        parent directory doesn't find the same files over and over.
+        """
+        os.symlink(self.directory, os.path.join(self.directory, "sub",
+                                                "loop"))
+        os.symlink(os.path.join(self.directory, "test_a.html"),
+                   os.path.join(self.directory, "test_link.html"))
+        index = DiscoveryIndex(self.directory, exclude=["build"])
+        self.assertEqual(["sub/deep/test_c.html", "sub/test_b.html",
+                          "test_a.html", "test_link.html"],
+                         self.relpaths(index.find()))
+
+
+def test_suite():
+    return unittest.makeSuite(DiscoveryIndexTests)
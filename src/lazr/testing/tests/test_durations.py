@@ -0,0 +1,81 @@
+import os
+import unittest
+
+from mocker import MockerTestCase
+
+from lazr.testing.durations import DurationStore, balance
+
+
+class DurationStoreTests(MockerTestCase):
+
+    def test_record_save(self):
+        """
+        Recorded durations are saved per browser, merged with the ones
+        saved by other runs in the meantime.
+        """
+        path = os.path.join(self.makeDir(), "durations", "durations.json")
+        store = DurationStore(path)
+        other = DurationStore(path)
+        store.record("Firefox", {"Alpha.testOne": 1.0})
+        store.save()
+        other.record("Firefox", {"Alpha.testTwo": 2.0})
+        other.record("Chrome", {"Alpha.testOne": 3.0})
+        other.save()
+        self.assertEqual(
+            {"Firefox": {"Alpha.testOne": 1.0, "Alpha.testTwo": 2.0},
+             "Chrome": {"Alpha.testOne": 3.0}},
+            DurationStore(path).durations)
+
+    def test_broken_file(self):
+        """
+        A file that can't be read is treated as empty.
+        """
+        store = DurationStore(self.makeFile("{"))
+        self.assertEqual({}, store.durations)
+
+    def test_estimates(self):
+        """
+        Tests and test cases are expected to take as long as on the
+        slowest browser.
+        """
+        store = DurationStore(self.makeFile())
+        store.record("Firefox", {"Alpha.testOne": 1.0,
+                                 "Alpha.testTwo": 2.0,
+                                 "Beta.testOne": 0.5})
+        store.record("Chrome", {"Alpha.testOne": 4.0})
+        self.assertEqual({"Alpha.testOne": 4.0, "Alpha.testTwo": 2.0,
+                          "Beta.testOne": 0.5, "Alpha": 4.0, "Beta": 0.5},
+                         store.estimates())
+
+
+class BalanceTests(unittest.TestCase):
+
+    def test_longest_first(self):
+        """
+        The longest names are spread first, and the others fill up the
+        shards expected to finish first.
+        """
+        self.assertEqual(
+            [["a"], ["b", "c", "d", "e"]],
+            balance(["a", "b", "c", "d", "e"], 2,
+                    {"a": 10, "b": 1, "c": 1, "d": 1, "e": 7}))
+        # Names without an estimate take the average time.
+        self.assertEqual(
+            [["a", "c"], ["b", "d"]],
+            balance(["a", "b", "c", "d"], 2, {"a": 3, "b": 2, "c": 2}))
+
+    def test_nothing_known(self):
+        """
+        Without estimates, names are dealt in turn, and no shard is left
+        empty.
+        """
+        self.assertEqual([["a", "c", "e"], ["b", "d"]],
+                         balance(["a", "b", "c", "d", "e"], 2, {}))
+        self.assertEqual([["a"], ["b"]], balance(["a", "b"], 4, {}))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(DurationStoreTests))
+    suite.addTests(unittest.makeSuite(BalanceTests))
+    return suite
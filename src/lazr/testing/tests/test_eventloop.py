@@ -0,0 +1,201 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from lazr.testing.benchmarks import freePort
+from lazr.testing.eventloop import (
+    EventLoop, Return, firstOf, runJsTestDriverClients, runYetiClients,
+    startJsTestDriverServer, startYetiServer)
+from lazr.testing.standins import jsTestDriverCommand, yetiCommand
+from lazr.testing.tests.helpers import EnvironmentTestCase
+
+
+CONFIG_FILENAME = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               "js", "tests.conf"))
+
+
+def collect(loop, stream):
+    """Return a task returning the outcomes of the results of C{stream}."""
+
+    def task():
+        outcomes = {}
+        while True:
+            item = yield stream.get()
+            if item is None:
+                raise Return(outcomes)
+            test, outcome, details = item
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return loop.spawn(task())
+
+
+class EventLoopTests(unittest.TestCase):
+
+    def test_tasks(self):
+        """
+        Tasks run concurrently, get the results of the futures they
+        yield, and return a value.
+        """
+        loop = EventLoop()
+        events = []
+
+        def task(name, delay):
+            yield loop.sleep(delay)
+            events.append(name)
+            raise Return(name)
+        slow = loop.spawn(task("slow", 0.2))
+        fast = loop.spawn(task("fast", 0.1))
+
+        def both():
+            results = []
+            results.append((yield slow))
+            results.append((yield fast))
+            raise Return(results)
+        start = time.time()
+        self.assertEqual(["slow", "fast"], loop.run(loop.spawn(both())))
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEqual(["fast", "slow"], events)
+
+    def test_errors(self):
+        """
+        Errors are raised where the failed task is waited for, and by
+        L{EventLoop.run}.
+        """
+        loop = EventLoop()
+
+        def failing():
+            yield loop.sleep(0)
+            raise ValueError("Broken")
+
+        def waiting():
+            try:
+                yield loop.spawn(failing())
+            except ValueError, e:
+                raise Return(str(e))
+        self.assertEqual("Broken", loop.run(loop.spawn(waiting())))
+        self.assertRaises(ValueError, loop.run, loop.spawn(failing()))
+
+    def test_first_of(self):
+        """
+        L{firstOf} returns the first future to be done, or C{None} once
+        the timeout expired.
+        """
+        loop = EventLoop()
+        fast = loop.sleep(0.01)
+        self.assertTrue(
+            loop.run(firstOf(loop, [loop.sleep(10), fast])) is fast)
+        self.assertEqual(
+            None, loop.run(firstOf(loop, [loop.sleep(10)], timeout=0.01)))
+
+
+class EventLoopServerTests(EnvironmentTestCase):
+    """Drive the stand-in servers and clients from an L{EventLoop}."""
+
+    prefixes = ("JSTESTDRIVER", "YETI", "LAZR_TESTING")
+
+    def setUp(self):
+        super(EventLoopServerTests, self).setUp()
+        self.setEnv("JSTESTDRIVER", jsTestDriverCommand())
+        self.setEnv("JSTESTDRIVER_BROWSER", "standin")
+        self.setEnv("YETI", yetiCommand())
+        self.setEnv("YETI_BROWSER", "standin")
+        self.setEnv("LAZR_TESTING_STANDIN_FAIL", "^Failure")
+        self.setEnv("LAZR_TESTING_STANDIN_ERROR", "^Error")
+        self.loop = EventLoop()
+
+    def makeYetiTests(self, count):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = []
+        for index in range(count):
+            paths.append(os.path.join(directory, "test_%d.html" % index))
+            test_file = open(paths[-1], "w")
+            try:
+                test_file.write("<script>\n"
+                                "var suite = {testOne: function() {}};\n"
+                                "</script>\n")
+            finally:
+                test_file.close()
+        return paths
+
+    def test_concurrent_runs(self):
+        """
+        A single loop starts several servers and runs their clients
+        concurrently, streaming the results.
+        """
+        loop = self.loop
+        paths = self.makeYetiTests(3)
+
+        def run():
+            ports = [str(freePort()) for index in range(3)]
+            servers = [startJsTestDriverServer(loop, ports[0]),
+                       startJsTestDriverServer(loop, ports[1]),
+                       startYetiServer(loop, ports[2])]
+            processes = []
+            for server in servers:
+                processes.append((yield server))
+            try:
+                runs = [
+                    collect(loop, runJsTestDriverClients(
+                        loop, CONFIG_FILENAME,
+                        ["http://localhost:%s" % ports[0]])),
+                    collect(loop, runJsTestDriverClients(
+                        loop, CONFIG_FILENAME,
+                        ["http://localhost:%s" % port
+                         for port in ports[:2]])),
+                    collect(loop, runYetiClients(loop, paths, ports[2],
+                                                 count=2))]
+                outcomes = []
+                for outcome in runs:
+                    outcomes.append((yield outcome))
+            finally:
+                for process in processes:
+                    yield process.terminate()
+            raise Return(outcomes)
+        expected = {"success": 4, "failure": 4, "error": 6}
+        self.assertEqual([expected, expected, {"success": 3}],
+                         loop.run(loop.spawn(run())))
+
+    def test_server_failure(self):
+        """A server failing to start raises a C{ValueError}."""
+        self.setEnv("LAZR_TESTING_STANDIN_CRASH", "start")
+        self.assertRaises(
+            ValueError, self.loop.run,
+            startJsTestDriverServer(self.loop, str(freePort())))
+
+    def test_capture_timeout(self):
+        """A server not capturing its browser in time is terminated."""
+        self.setEnv("LAZR_TESTING_STANDIN_CRASH", "capture")
+        self.setEnv("JSTESTDRIVER_CAPTURE_TIMEOUT", "1")
+        try:
+            self.loop.run(startJsTestDriverServer(self.loop,
+                                                  str(freePort())))
+        except ValueError, e:
+            self.assertTrue(str(e).startswith(
+                "Failed to capture a browser in 1 seconds"))
+        else:
+            self.fail("No ValueError raised")
+
+    def test_client_failure(self):
+        """
+        The results stream ends with a C{ValueError} if a client failed
+        to run the tests.
+        """
+        loop = self.loop
+        port = str(freePort())
+        server = loop.run(startJsTestDriverServer(loop, port))
+        try:
+            self.setEnv("LAZR_TESTING_STANDIN_CRASH", "client")
+            stream = runJsTestDriverClients(
+                loop, CONFIG_FILENAME, ["http://localhost:%s" % port])
+            self.assertRaises(ValueError, loop.run, collect(loop, stream))
+        finally:
+            loop.run(server.terminate())
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(EventLoopTests))
+    suite.addTests(unittest.makeSuite(EventLoopServerTests))
+    return suite
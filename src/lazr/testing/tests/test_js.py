@@ -1,9 +1,13 @@
 import doctest
 import operator
 import os
+import pickle
 import re
 import socket
+import subprocess
 import sys
+import time
+import threading
 import unittest
 import warnings
 
@@ -11,12 +15,24 @@ from cStringIO import StringIO
 
 from os.path import dirname
 
-from mocker import ANY, ARGS, KWARGS, MockerTestCase
+from mocker import ARGS, KWARGS, MockerTestCase
 
 from zope.testing import testrunner
+try:
+    from zope.testrunner.options import get_options
+except ImportError:
+    from zope.testing.testrunner.options import get_options
 
+from lazr.testing import jstestdriver
+from lazr.testing.durations import DurationStore
+from lazr.testing.jsconfig import JsTestDriverConfig
+from lazr.testing.tempdirs import outputDirs
+from lazr.testing.timing import addTimingHook, removeTimingHook
 from lazr.testing.jstestdriver import (
-    JsTestDriverTestCase, JsTestDriverLayer)
+    JsTestDriverFailure, JsTestDriverTestCase, JsTestDriverLayer,
+    matchesPatterns, parseResultFile, parseResultFiles, readOutput,
+    selectTests, splitTests)
+from lazr.testing.tests.helpers import FakeServerProcess
 
 
 class JsTestDriverSelfTest(JsTestDriverTestCase):
@@ -25,6 +41,974 @@ class JsTestDriverSelfTest(JsTestDriverTestCase):
                                                    "js", "tests.conf"))
 
 
+class FakeClient(object):
+    """Base for the stand-ins of the L{subprocess.Popen} object of clients.
+
+    L{run} is called in a thread as soon as the output is read, and the
+    C{(stdout, stderr)} it returns show up on the process output.
+    """
+
+    _thread = None
+
+    def _start(self):
+        if self._thread is None:
+            stdout_fd, stdout_write_fd = os.pipe()
+            stderr_fd, stderr_write_fd = os.pipe()
+            self._stdout = os.fdopen(stdout_fd)
+            self._stderr = os.fdopen(stderr_fd)
+            self._thread = threading.Thread(
+                target=self._run, args=(stdout_write_fd, stderr_write_fd))
+            self._thread.start()
+
+    def _run(self, stdout_write_fd, stderr_write_fd):
+        try:
+            stdout, stderr = self.run()
+            os.write(stdout_write_fd, stdout)
+            os.write(stderr_write_fd, stderr)
+        finally:
+            os.close(stdout_write_fd)
+            os.close(stderr_write_fd)
+
+    @property
+    def stdout(self):
+        self._start()
+        return self._stdout
+
+    @property
+    def stderr(self):
+        self._start()
+        return self._stderr
+
+    def wait(self):
+        self._start()
+        self._thread.join()
+        return self.returncode
+
+
+class FakeClientProcess(FakeClient):
+    """A stand-in for the L{subprocess.Popen} object of a client.
+
+    Running it writes a passing XML report for each requested test
+    case.
+    """
+
+    wait_for = None
+
+    def __init__(self, cmd, **kwargs):
+        self.cmd = cmd
+        self.output_dir = cmd[cmd.index("--testOutput") + 1]
+        self.tests = cmd[cmd.index("--tests") + 1].split(",")
+        self.returncode = 0
+
+    def run(self):
+        if self.wait_for is not None:
+            self.wait_for.wait(5)
+        for name in self.tests:
+            report = open(
+                os.path.join(self.output_dir, "TEST-%s.xml" % name), "w")
+            report.write(
+                '<testsuite><testcase classname="Browser.%s" name="testIt"'
+                ' time="0.001"></testcase></testsuite>' % name)
+            report.close()
+        return "", "INFO: Finished action run.\n"
+
+    def poll(self):
+        return self.returncode
+
+
+class SlowClientProcess(FakeClient):
+    """A stand-in for a client that writes its reports one at a time.
+
+    After writing each report, it waits for L{proceed} to be set, and
+    counts the times it waited in vain. The first test fails.
+    """
+
+    def __init__(self, cmd, **kwargs):
+        self.output_dir = cmd[cmd.index("--testOutput") + 1]
+        self.proceed = threading.Event()
+        self.waited_in_vain = 0
+        self.terminated = False
+        self.returncode = None
+
+    def run(self):
+        for index, name in enumerate(["First", "Second", "Third"]):
+            if self.terminated:
+                break
+            report = open(
+                os.path.join(self.output_dir, "TEST-%s.xml" % name), "w")
+            report.write(
+                '<testsuite><testcase classname="Browser.%s" name="testIt"'
+                ' time="0.001">%s</testcase></testsuite>' %
+                (name, index == 0 and '<failure type="failed"/>' or ""))
+            report.close()
+            self.proceed.wait(5)
+            if not self.proceed.isSet():
+                self.waited_in_vain += 1
+            self.proceed.clear()
+        self.returncode = self.terminated and -15 or 1
+        return "Tests failed.", "INFO: Finished action run.\n"
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+        self.proceed.set()
+
+
+class HangingClientProcess(FakeClient):
+    """A stand-in for a client hanging on its second test case.
+
+    It writes the report of the first test case, in the order they're
+    loaded, starts writing the one of the second, and then waits until
+    it's terminated.
+    """
+
+    def __init__(self, cmd, **kwargs):
+        self.output_dir = cmd[cmd.index("--testOutput") + 1]
+        self.tests = cmd[cmd.index("--tests") + 1]
+        config = JsTestDriverConfig(cmd[cmd.index("--config") + 1])
+        self.names = config.loadedTestCaseNames()
+        if self.tests != "all":
+            self.names = [name for name in self.names
+                          if name in self.tests.split(",")]
+        self.terminated = threading.Event()
+        self.returncode = None
+
+    def run(self):
+        report = open(
+            os.path.join(self.output_dir, "TEST-First.xml"), "w")
+        report.write(
+            '<testsuite><testcase classname="Browser.%s"'
+            ' name="testIt" time="0.001"></testcase></testsuite>'
+            % self.names[0])
+        report.close()
+        report = open(
+            os.path.join(self.output_dir, "TEST-Second.xml"), "w")
+        report.write('<testsuite><testcase classname="Browser.%s"'
+                     % self.names[1])
+        report.close()
+        self.terminated.wait(5)
+        return "", ""
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+        self.terminated.set()
+
+    def kill(self):
+        self.returncode = -9
+
+
+class JsTestDriverTimeoutTests(MockerTestCase):
+
+    def setUp(self):
+        super(JsTestDriverTimeoutTests, self).setUp()
+        for key in ["JSTESTDRIVER", "JSTESTDRIVER_SERVER",
+                    "JSTESTDRIVER_SERVERS", "JSTESTDRIVER_TIMEOUT",
+                    "JSTESTDRIVER_TEST_TIMEOUT",
+                    "JSTESTDRIVER_TIMEOUT_CONTINUE"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+            os.environ.pop(key, None)
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ["JSTESTDRIVER_TEST_TIMEOUT"] = "0.3"
+
+    def run_clients(self, *client_factories):
+        clients = []
+        factories = list(client_factories)
+
+        def popen(cmd, **kwargs):
+            clients.append(factories.pop(0)(cmd, **kwargs))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(len(client_factories))
+        self.mocker.replay()
+        result = unittest.TestResult()
+        JsTestDriverSelfTest("runTest").run(result)
+        return clients, result
+
+    def test_hung_client_is_killed(self):
+        """
+        A client making no progress is killed, the test case it hung on
+        is reported as an error, and the results already collected are
+        kept.
+        """
+        clients, result = self.run_clients(HangingClientProcess)
+        self.assertEqual(2, result.testsRun)
+        self.assertEqual(1, len(result.errors))
+        self.assertTrue(
+            "no progress for 0.3 seconds, running FailureInlineTestCase" in
+            result.errors[0][1])
+
+    def test_continue(self):
+        """
+        With C{JSTESTDRIVER_TIMEOUT_CONTINUE}, the test cases after the
+        one that hung are run by another client.
+        """
+        os.environ["JSTESTDRIVER_TIMEOUT_CONTINUE"] = "1"
+        clients, result = self.run_clients(HangingClientProcess,
+                                           FakeClientProcess)
+        self.assertEqual(
+            ["ErrorTestCase", "ErrorInlineTestCase", "SuccessTestCase",
+             "SuccessInlineTestCase"],
+            clients[1].tests)
+        self.assertEqual(6, result.testsRun)
+        self.assertEqual(1, len(result.errors))
+
+    def tearDown(self):
+        super(JsTestDriverTimeoutTests, self).tearDown()
+        self.mocker.restore()
+
+
+class FlakyClientProcess(FakeClient):
+    """A stand-in for a client running a flaky test and a broken one.
+
+    C{testFlaky} only passes when run on its own, and C{testBroken}
+    never does.
+    """
+
+    def __init__(self, cmd, **kwargs):
+        self.output_dir = cmd[cmd.index("--testOutput") + 1]
+        self.tests = cmd[cmd.index("--tests") + 1].split(",")
+        self.returncode = 1
+
+    def run(self):
+        if self.tests == ["all"]:
+            outcomes = [("testBroken", False), ("testFlaky", False),
+                        ("testSolid", True)]
+        else:
+            outcomes = [(test.split(".")[1], test.endswith("Flaky"))
+                        for test in self.tests]
+        report = open(os.path.join(self.output_dir, "TEST-Flaky.xml"), "w")
+        report.write("<testsuite>")
+        for name, passed in outcomes:
+            report.write(
+                '<testcase classname="Browser.FlakyTestCase" name="%s"'
+                ' time="0.001">%s</testcase>' %
+                (name, not passed and '<failure type="failed"/>' or ""))
+        report.write("</testsuite>")
+        report.close()
+        return "Tests failed.", "INFO: Finished action run.\n"
+
+    def poll(self):
+        return self.returncode
+
+
+class SuccessRecordingTestResult(unittest.TestResult):
+    """Keep the descriptions of the tests that passed."""
+
+    def __init__(self):
+        unittest.TestResult.__init__(self)
+        self.successes = []
+
+    def addSuccess(self, test):
+        unittest.TestResult.addSuccess(self, test)
+        self.successes.append(str(test))
+
+
+class JsTestDriverRetryTests(MockerTestCase):
+
+    def setUp(self):
+        super(JsTestDriverRetryTests, self).setUp()
+        for key in ["JSTESTDRIVER", "JSTESTDRIVER_SERVER",
+                    "JSTESTDRIVER_SERVERS", "JSTESTDRIVER_RETRY"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+            os.environ.pop(key, None)
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+
+    def run_clients(self, count):
+        clients = []
+
+        def popen(cmd, **kwargs):
+            clients.append(FlakyClientProcess(cmd, **kwargs))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(count)
+        self.mocker.replay()
+        result = SuccessRecordingTestResult()
+        JsTestDriverSelfTest("runTest").run(result)
+        return clients, result
+
+    def test_no_retry(self):
+        """
+        By default, failed tests are not run again.
+        """
+        clients, result = self.run_clients(1)
+        self.assertEqual(3, result.testsRun)
+        self.assertEqual(2, len(result.failures))
+
+    def test_retry(self):
+        """
+        With C{JSTESTDRIVER_RETRY}, only the failed tests are run again,
+        and the ones passing are reported as such.
+        """
+        os.environ["JSTESTDRIVER_RETRY"] = "2"
+        clients, result = self.run_clients(3)
+        self.assertEqual(
+            [["all"], ["FlakyTestCase.testBroken", "FlakyTestCase.testFlaky"],
+             ["FlakyTestCase.testBroken"]],
+            [client.tests for client in clients])
+        self.assertEqual(3, result.testsRun)
+        self.assertEqual(["testBroken:Browser (FlakyTestCase)"],
+                         [str(test) for test, error in result.failures])
+        self.assertEqual(
+            ["testFlaky:Browser (FlakyTestCase) [passed on retry]",
+             "testSolid:Browser (FlakyTestCase)"],
+            result.successes)
+
+    def tearDown(self):
+        super(JsTestDriverRetryTests, self).tearDown()
+        self.mocker.restore()
+
+
+class ProceedingTestResult(unittest.TestResult):
+    """Let the last client go on once a test result is reported."""
+
+    def __init__(self, clients, failfast=False):
+        unittest.TestResult.__init__(self)
+        self.clients = clients
+        self.failfast = failfast
+
+    def startTest(self, test):
+        unittest.TestResult.startTest(self, test)
+        self.clients[-1].proceed.set()
+
+    def addFailure(self, test, exc_info):
+        unittest.TestResult.addFailure(self, test, exc_info)
+        if self.failfast:
+            self.stop()
+
+
+class JsTestDriverLiveResultsTests(MockerTestCase):
+
+    def setUp(self):
+        super(JsTestDriverLiveResultsTests, self).setUp()
+        for key in ["JSTESTDRIVER", "JSTESTDRIVER_SERVER",
+                    "JSTESTDRIVER_SERVERS", "JSTESTDRIVER_LIVE_RESULTS"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ.pop("JSTESTDRIVER_SERVERS", None)
+        os.environ["JSTESTDRIVER_LIVE_RESULTS"] = "1"
+        self.clients = []
+
+        def popen(cmd, **kwargs):
+            self.clients.append(SlowClientProcess(cmd, **kwargs))
+            return self.clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.replay()
+
+    def test_results_are_reported_while_running(self):
+        """
+        Results are reported as soon as each report is written, while
+        the client is still running.
+        """
+        test = JsTestDriverSelfTest("runTest")
+        result = ProceedingTestResult(self.clients)
+        test.run(result)
+
+        self.assertEqual(0, self.clients[0].waited_in_vain)
+        self.assertEqual(3, result.testsRun)
+        self.assertEqual(1, len(result.failures))
+
+    def test_stop_on_failure(self):
+        """
+        If the test runner stops on the first failure, the client is
+        terminated and no further results are reported.
+        """
+        test = JsTestDriverSelfTest("runTest")
+        result = ProceedingTestResult(self.clients, failfast=True)
+        test.run(result)
+
+        self.assertTrue(self.clients[0].terminated)
+        self.assertEqual(1, result.testsRun)
+        self.assertEqual(1, len(result.failures))
+
+    def tearDown(self):
+        super(JsTestDriverLiveResultsTests, self).tearDown()
+        self.mocker.restore()
+
+
+class JsTestDriverShardingTests(MockerTestCase):
+
+    def setUp(self):
+        super(JsTestDriverShardingTests, self).setUp()
+        for key in ["JSTESTDRIVER", "JSTESTDRIVER_SERVER",
+                    "JSTESTDRIVER_SERVERS", "LAZR_TESTING_DURATIONS"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+        os.environ.pop("LAZR_TESTING_DURATIONS", None)
+
+    def test_split_tests(self):
+        """
+        Test cases are dealt to the shards in turn, and no shard is left
+        empty.
+        """
+        self.assertEqual([["a", "c", "e"], ["b", "d"]],
+                         splitTests(["a", "b", "c", "d", "e"], 2))
+        self.assertEqual([["a"], ["b"]], splitTests(["a", "b"], 4))
+
+    def test_shards_are_merged(self):
+        """
+        With several servers, the test cases are split across them, and
+        the results of every shard are reported together.
+        """
+        clients = []
+
+        def popen(cmd, **kwargs):
+            clients.append(FakeClientProcess(cmd, **kwargs))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(2)
+        self.mocker.replay()
+
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ["JSTESTDRIVER_SERVERS"] = (
+            "http://localhost:4225,http://localhost:4226")
+
+        result = unittest.TestResult()
+        JsTestDriverSelfTest("runTest").run(result)
+
+        self.assertEqual(
+            [["ErrorInlineTestCase", "FailureInlineTestCase",
+              "SuccessInlineTestCase"],
+             ["ErrorTestCase", "FailureTestCase", "SuccessTestCase"]],
+            [client.tests for client in clients])
+        self.assertEqual(
+            ["http://localhost:4225", "http://localhost:4226"],
+            [client.cmd[client.cmd.index("--server") + 1]
+             for client in clients])
+        self.assertEqual(6, result.testsRun)
+        self.assertTrue(result.wasSuccessful())
+
+    def test_selected_tests_only_are_run(self):
+        """
+        The tests selected by the test runner are passed on to the
+        client, rather than filtered once they all ran.
+        """
+        clients = []
+
+        def popen(cmd, **kwargs):
+            clients.append(FakeClientProcess(cmd, **kwargs))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.replay()
+
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ["JSTESTDRIVER_SERVERS"] = "http://localhost:4225"
+
+        result = FakeZopeTestResult()
+        result.options = FakeOptions()
+        result.options.test = ["JsTestDriverSelfTest", "SuccessTestCase",
+                               "ErrorInline.*Null"]
+        JsTestDriverSelfTest("runTest").run(result)
+
+        self.assertEqual(
+            [["ErrorInlineTestCase.testAssertNull", "SuccessTestCase"]],
+            [client.tests for client in clients])
+        self.assertEqual(2, result.testsRun)
+
+    def test_runner_options(self):
+        """
+        The selection patterns are taken as the test runner parsed them,
+        which some of its versions compile to functions.
+        """
+        clients = []
+
+        def popen(cmd, **kwargs):
+            clients.append(FakeClientProcess(cmd, **kwargs))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(2)
+        self.mocker.replay()
+
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ["JSTESTDRIVER_SERVERS"] = "http://localhost:4225"
+
+        result = FakeZopeTestResult()
+        result.options = get_options(
+            ["test", "--test-path", dirname(__file__),
+             "-t", "JsTestDriverSelfTest", "-t", "SuccessTestCase",
+             "-t", "ErrorInline.*Null"])
+        JsTestDriverSelfTest("runTest").run(result)
+        result.options = get_options(
+            ["test", "--test-path", dirname(__file__)])
+        JsTestDriverSelfTest("runTest").run(result)
+
+        self.assertEqual(
+            [["ErrorInlineTestCase.testAssertNull", "SuccessTestCase"],
+             ["all"]],
+            [client.tests for client in clients])
+
+    def test_shards_are_balanced(self):
+        """
+        With recorded durations, the shards are balanced to take about
+        as long, and the durations of the run are recorded in turn.
+        """
+        clients = []
+
+        def popen(cmd, **kwargs):
+            clients.append(FakeClientProcess(cmd, **kwargs))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(2)
+        self.mocker.replay()
+
+        path = os.path.join(self.makeDir(), "durations.json")
+        store = DurationStore(path)
+        store.record("Firefox", {"ErrorTestCase.testAssertEquals": 10.0,
+                                 "ErrorInlineTestCase.testAssertNull": 1.0,
+                                 "FailureTestCase.testAssertTrue": 1.0,
+                                 "FailureInlineTestCase.testAssertNull": 1.0,
+                                 "SuccessTestCase.testAssertTrue": 1.0,
+                                 "SuccessInlineTestCase.testAssertNull": 1.0})
+        store.save()
+        os.environ["LAZR_TESTING_DURATIONS"] = path
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ["JSTESTDRIVER_SERVERS"] = (
+            "http://localhost:4225,http://localhost:4226")
+
+        result = unittest.TestResult()
+        JsTestDriverSelfTest("runTest").run(result)
+
+        self.assertEqual(
+            [["ErrorTestCase"],
+             ["ErrorInlineTestCase", "FailureInlineTestCase",
+              "FailureTestCase", "SuccessInlineTestCase",
+              "SuccessTestCase"]],
+            [client.tests for client in clients])
+        durations = DurationStore(path).durations
+        self.assertEqual(6, len(durations["Browser"]))
+        self.assertEqual(0.001, durations["Browser"]["ErrorTestCase.testIt"])
+
+    def tearDown(self):
+        super(JsTestDriverShardingTests, self).tearDown()
+        self.mocker.restore()
+
+
+class JsTestDriverResultParserTests(MockerTestCase):
+
+    def makeReport(self, body):
+        return self.makeFile(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<testsuite>%s</testsuite>' % body)
+
+    def test_large_output_is_not_kept(self):
+        """
+        The output of passing tests is not kept in memory.
+        """
+        path = self.makeReport(
+            '<testcase classname="Browser.Case" name="testIt" time="0.1">'
+            '<system-out>%s</system-out></testcase>' % ("x" * 2000000))
+        [(test_result, outcome)] = parseResultFile(path)
+        self.assertEqual("success", outcome)
+        self.assertEqual("Browser.Case.testIt", test_result.id())
+        self.assertEqual((), test_result.content)
+
+    def test_failure_details(self):
+        """
+        Failures without a message are reported with the text of the
+        failure.
+        """
+        path = self.makeReport(
+            '<testcase classname="Browser.Case" name="testIt" time="0.1">'
+            '<failure type="failed">Something\n  went wrong</failure>'
+            '</testcase>')
+        [(test_result, outcome)] = parseResultFile(path)
+        self.assertEqual("failure", outcome)
+        self.assertEqual(
+            "Something\nwent wrong",
+            str(JsTestDriverFailure(test_result.content)))
+
+    def test_failure_output(self):
+        """
+        The output of the tests that didn't pass is reported along with
+        the text of their failure.
+        """
+        path = self.makeReport(
+            '<testcase classname="Browser.Case" name="testIt" time="0.1">'
+            '<error type="error">Oops</error>'
+            '<system-out>[LOG] Something happened</system-out></testcase>')
+        [(test_result, outcome)] = parseResultFile(path)
+        self.assertEqual("error", outcome)
+        self.assertEqual(["Oops", "[LOG] Something happened"],
+                         test_result.content)
+
+    def test_compact_results(self):
+        """
+        Results have no instance dictionary, share the browser and class
+        names, and survive being sent to another process.
+        """
+        path = self.makeReport(
+            '<testcase classname="Browser.Case" name="testOne" time="0.1">'
+            '</testcase>'
+            '<testcase classname="Browser.Case" name="testTwo" time="0.1">'
+            '<error type="error" message="Oops"/></testcase>')
+        first, second = sorted(
+            (test_result for test_result, outcome in parseResultFile(path)),
+            key=lambda test_result: test_result.name)
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertTrue(first.browser is second.browser)
+        self.assertTrue(first.classname is second.classname)
+        copy = pickle.loads(pickle.dumps(second, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(
+            ("Browser.Case.testTwo", "Oops", "error"),
+            (copy.id(), copy.message, copy.failure_type))
+
+    def test_failures_are_not_raised(self):
+        """
+        Failures and errors are reported with the exception they stand
+        for, without a traceback.
+        """
+        path = self.makeReport(
+            '<testcase classname="Browser.Case" name="testOne" time="0.1">'
+            '<failure type="failed" message="Not equal"/></testcase>'
+            '<testcase classname="Browser.Case" name="testTwo" time="0.1">'
+            '<error type="error">Oops</error></testcase>')
+        errors = []
+
+        class RecordingResult(unittest.TestResult):
+
+            def addFailure(self, test, err):
+                errors.append(err)
+                unittest.TestResult.addFailure(self, test, err)
+
+            def addError(self, test, err):
+                errors.append(err)
+                unittest.TestResult.addError(self, test, err)
+        result = RecordingResult()
+        parser = jstestdriver.JsTestDriverResultParser(None, result)
+        parser.test_results.update(parseResultFile(path))
+        parser.add_results()
+        self.assertEqual(
+            [(JsTestDriverFailure, "Not equal", None),
+             (jstestdriver.JsTestDriverError, "Oops", None)],
+            [(exc_type, str(exc_value), exc_tb)
+             for exc_type, exc_value, exc_tb in errors])
+        self.assertEqual(1, len(result.failures))
+        self.assertEqual(1, len(result.errors))
+
+    def test_parse_in_parallel(self):
+        """
+        Large outputs are parsed in several processes, with the same
+        results.
+        """
+        paths = [
+            self.makeReport(
+                '<testcase classname="Browser.%s" name="testIt" time="0.1">'
+                '</testcase>' % name)
+            for name in ["First", "Second", "Third"]]
+        self.addCleanup(setattr, jstestdriver, "PARALLEL_PARSE_SIZE",
+                        jstestdriver.PARALLEL_PARSE_SIZE)
+        jstestdriver.PARALLEL_PARSE_SIZE = 0
+        self.addCleanup(os.environ.pop, "JSTESTDRIVER_PARSE_WORKERS", None)
+        os.environ["JSTESTDRIVER_PARSE_WORKERS"] = "2"
+        self.assertEqual(
+            ["Browser.First.testIt", "Browser.Second.testIt",
+             "Browser.Third.testIt"],
+            [test_result.id()
+             for test_results in parseResultFiles(paths)
+             for test_result, outcome in test_results])
+
+
+class FakeLayer(object):
+    executor = None
+
+
+class FirstParallelTest(JsTestDriverSelfTest):
+    layer = FakeLayer
+
+
+class SecondParallelTest(JsTestDriverSelfTest):
+    layer = FakeLayer
+
+
+class ThirdParallelTest(JsTestDriverSelfTest):
+    layer = FakeLayer
+
+
+class FakeOptions(object):
+    test = ["ParallelTest"]
+    module = None
+
+
+class FakeZopeTestResult(unittest.TestResult):
+    options = FakeOptions()
+
+
+class JsTestDriverExecutorTests(MockerTestCase):
+
+    def setUp(self):
+        super(JsTestDriverExecutorTests, self).setUp()
+        for key in ["JSTESTDRIVER", "JSTESTDRIVER_SERVER",
+                    "JSTESTDRIVER_SERVERS"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ["JSTESTDRIVER_SERVERS"] = (
+            "http://localhost:4225,http://localhost:4226")
+        # Forget about the test cases created by other tests.
+        del jstestdriver._instances[:]
+
+    def test_configurations_run_concurrently(self):
+        """
+        The first test case run gathers the other selected test cases
+        of its layer, and runs each of them on its own server. Results
+        are still reported in order, as the test cases get run.
+        """
+        clients = []
+        both_started = threading.Event()
+
+        def popen(cmd, **kwargs):
+            clients.append(FakeClientProcess(cmd, **kwargs))
+            if len(clients) == 2:
+                both_started.set()
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(3)
+        self.mocker.replay()
+
+        # The first clients only finish once another one started.
+        self.addCleanup(setattr, FakeClientProcess, "wait_for", None)
+        FakeClientProcess.wait_for = both_started
+
+        tests = [FirstParallelTest(), SecondParallelTest(),
+                 ThirdParallelTest()]
+        # Not selected, so never run.
+        JsTestDriverSelfTest()
+        results = []
+        try:
+            for test in tests:
+                result = FakeZopeTestResult()
+                test.run(result)
+                results.append(result)
+        finally:
+            FakeLayer.executor.shutdown()
+            FakeLayer.executor = None
+
+        self.assertEqual([1, 1, 1],
+                         [result.testsRun for result in results])
+        self.assertEqual(["all", "all", "all"],
+                         [",".join(client.tests) for client in clients])
+        self.assertTrue(both_started.isSet())
+        self.assertEqual(
+            set(["http://localhost:4225", "http://localhost:4226"]),
+            set(client.cmd[client.cmd.index("--server") + 1]
+                for client in clients[:2]))
+
+    def test_errors_are_raised_in_order(self):
+        """
+        An error running a client in the background is raised when its
+        test case is run.
+        """
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.throw(OSError("No such file or directory"))
+        self.mocker.count(3)
+        self.mocker.replay()
+
+        tests = [FirstParallelTest(), SecondParallelTest(),
+                 ThirdParallelTest()]
+        try:
+            for test in tests:
+                self.assertRaises(OSError, test.run, FakeZopeTestResult())
+        finally:
+            FakeLayer.executor.shutdown()
+            FakeLayer.executor = None
+
+    def test_match_patterns(self):
+        """
+        Test cases are gathered using the zope.testrunner rules for
+        selection patterns.
+        """
+        self.assertTrue(matchesPatterns(None, "foo"))
+        self.assertTrue(matchesPatterns(["fo+", "bar"], "foo"))
+        self.assertFalse(matchesPatterns(["bar"], "foo"))
+        self.assertFalse(matchesPatterns(["!fo+"], "foo"))
+        self.assertTrue(matchesPatterns(["!bar"], "foo"))
+        self.assertFalse(matchesPatterns(["foo", "!o$"], "foo"))
+
+    def test_select_tests(self):
+        """
+        Selection patterns are translated into the test cases and test
+        functions to run, the test cases being run as a whole when all
+        their test functions are selected.
+        """
+        tests = {"Alpha": ["testOne", "testTwo"], "Beta": ["testOne"]}
+        self.assertEqual(None, selectTests(tests, None))
+        self.assertEqual(["Alpha"], selectTests(tests, ["Alpha"]))
+        self.assertEqual(["Alpha.testTwo", "Beta"],
+                         selectTests(tests, ["Beta", "testTwo"]))
+        self.assertEqual(["Alpha.testOne"],
+                         selectTests(tests, ["Alpha", "!testTwo"]))
+        # Patterns selecting the Python test case itself select all of
+        # its test functions, but the excluded ones.
+        self.assertEqual(None, selectTests(tests, ["JsTest"]))
+        self.assertEqual(["Beta"], selectTests(tests, ["JsTest", "!Alpha"]))
+        self.assertEqual([], selectTests(tests, ["!Alpha", "!Beta"]))
+
+    def test_select_tests_runner_options(self):
+        """
+        The patterns parsed by the test runner select the same tests,
+        whether it compiles them to functions or not.
+        """
+
+        def select(*args):
+            options = get_options(
+                ["test", "--test-path", dirname(__file__)] + list(args))
+            return selectTests(tests, options.test)
+        tests = {"Alpha": ["testOne", "testTwo"], "Beta": ["testOne"]}
+        self.assertEqual(None, select())
+        self.assertEqual(["Alpha"], select("-t", "Alpha"))
+        self.assertEqual(["Alpha.testTwo", "Beta"],
+                         select("-t", "Beta", "-t", "testTwo"))
+        self.assertEqual(["Beta"], select("-t", "!Alpha"))
+        self.assertEqual(None, select("-t", "JsTest"))
+
+    def tearDown(self):
+        super(JsTestDriverExecutorTests, self).tearDown()
+        self.mocker.restore()
+
+
+class BatchLayer(object):
+    executor = None
+    batch = None
+
+
+class JsTestDriverBatchTests(MockerTestCase):
+
+    def setUp(self):
+        super(JsTestDriverBatchTests, self).setUp()
+        for key in ["JSTESTDRIVER", "JSTESTDRIVER_SERVER",
+                    "JSTESTDRIVER_SERVERS", "JSTESTDRIVER_BATCH"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+        os.environ["JSTESTDRIVER"] = "java -jar JsTestDriver.jar"
+        os.environ["JSTESTDRIVER_SERVER"] = "http://localhost:4225"
+        os.environ["JSTESTDRIVER_SERVERS"] = (
+            "http://localhost:4225,http://localhost:4226")
+        os.environ["JSTESTDRIVER_BATCH"] = "1"
+        self.addCleanup(setattr, BatchLayer, "batch", None)
+        del jstestdriver._instances[:]
+
+    def makeTest(self, *names):
+        directory = self.makeDir()
+        for name in names:
+            self.makeFile('TestCase("%s", {});\n' % name,
+                          dirname=directory, basename="%s.js" % name)
+        config_filename = self.makeFile(
+            "load:\n  - '*.js'\n", dirname=directory, basename="tests.conf")
+
+        class BatchedTest(JsTestDriverTestCase):
+            layer = BatchLayer
+        BatchedTest.config_filename = config_filename
+        return BatchedTest()
+
+    def test_configurations_are_batched(self):
+        """
+        The configurations of the selected test cases are merged and
+        run by a single client per server, and each test case reports
+        the results of its own test cases.
+        """
+        clients = []
+
+        def popen(cmd, **kwargs):
+            clients.append(FakeClientProcess(cmd, **kwargs))
+            config = open(cmd[cmd.index("--config") + 1]).read()
+            self.assertEqual(
+                ["Alpha.js", "Beta.js", "Gamma.js", "Delta.js"],
+                re.findall(r"\w+\.js", config))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(2)
+        self.mocker.replay()
+
+        tests = [self.makeTest("Alpha"), self.makeTest("Beta", "Gamma"),
+                 self.makeTest("Delta")]
+        results = []
+        for test in tests:
+            result = FakeZopeTestResult()
+            result.options = FakeOptions()
+            result.options.test = None
+            test.run(result)
+            results.append(result)
+
+        self.assertEqual([1, 2, 1], [result.testsRun for result in results])
+        self.assertEqual([["Alpha", "Delta"], ["Beta", "Gamma"]],
+                         [client.tests for client in clients])
+        batch_dir = dirname(clients[0].cmd[clients[0].cmd.index("--config")
+                                           + 1])
+        self.assertEqual([], os.listdir(batch_dir))
+        self.assertIn(batch_dir, outputDirs().free)
+
+    def test_clashing_names_are_not_batched(self):
+        """
+        Configurations sharing test case names with another one are run
+        on their own.
+        """
+        first, second = self.makeTest("Alpha"), self.makeTest("Alpha")
+        others = [self.makeTest("Beta"), self.makeTest("Gamma")]
+        result = FakeZopeTestResult()
+        result.options = FakeOptions()
+        result.options.test = None
+        self.assertEqual(None,
+                         jstestdriver.JsTestDriverBatch.forTest(first, result))
+        self.assertEqual(others, BatchLayer.batch.tests)
+        self.assertFalse(BatchLayer.batch.includes(second))
+
+    def tearDown(self):
+        super(JsTestDriverBatchTests, self).tearDown()
+        self.mocker.restore()
+
+
 class JsTestDriverErrorTests(MockerTestCase):
 
     def setUp(self):
@@ -34,7 +1018,9 @@ class JsTestDriverErrorTests(MockerTestCase):
             "JSTESTDRIVER_SERVER",
             "JSTESTDRIVER_PORT",
             "JSTESTDRIVER_CAPTURE_TIMEOUT",
-            "JSTESTDRIVER_BROWSER"]
+            "JSTESTDRIVER_BROWSER",
+            "JSTESTDRIVER_BROWSER_COUNT",
+            "JSTESTDRIVER_SERVERS"]
 
         def cleanup_non_existing_key(some_key):
             try:
@@ -144,110 +1130,141 @@ class JsTestDriverErrorTests(MockerTestCase):
             JsTestDriverLayer.tearDown()
 
     def mock_popen(self):
-        """Replace subprocess.Popen and make it return a mock process.
+        """Replace subprocess.Popen and make it return a fake process.
 
-        The mock process is returned.
+        The fake process is returned.
         """
         mock_Popen = self.mocker.replace("subprocess.Popen")
-        self.mock_proc = self.mocker.mock()
+        self.fake_proc = FakeServerProcess()
         mock_Popen(ARGS, KWARGS)
-        self.mocker.result(self.mock_proc)
-        return self.mock_proc
+        self.mocker.result(self.fake_proc)
+        return self.fake_proc
 
-    def mock_builtin_open(self):
-        """Replace built-in open and make it return a mock file.
-
-        The mock file is returned.
-        """
-        mock_open = self.mocker.replace("__builtin__.open")
-        mock_open(ANY)
-        self.mock_file = self.mocker.mock()
-        self.mocker.result(self.mock_file)
-        return self.mock_file
+    def listen(self, port):
+        """Listen on the given port, as the real server would."""
+        s = socket.socket()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(("localhost", port))
+        s.listen(5)
+        self.addCleanup(s.close)
 
     def test_wait_for_server_startup(self):
         """
         Even if we don't wait for the browser to be captured, we wait
         for the server to start up.
         """
-        mock_proc = self.mock_popen()
-        mock_file = self.mock_builtin_open()
-
-        with self.mocker.order():
-            mock_time = self.mocker.replace("time.time")
-            # The first time is to initialize the start time.
-            mock_time()
-            start_time = 0
-            self.mocker.result(start_time)
-
-            # The second time is to check if the timeout is exceeded in
-            # the while loop.
-            mock_time()
-            self.mocker.result(start_time)
-            # Go one iteration of the while loop, reporting the server
-            # has started.
-            mock_proc.poll()
-            self.mocker.result(None)
-            mock_file.readline()
-            self.mocker.result("INFO: Finished action run.")
-
-            # The opened file is closed.
-            mock_file.close()
-            self.mocker.result(None)
-
-            # Last check to make sure the server is running ok.
-            mock_proc.poll()
-            self.mocker.result(None)
+        fake_proc = self.mock_popen()
+        self.mocker.replay()
+        self.listen(4225)
+        fake_proc.log("INFO: Finished action run.")
+
+        os.environ["JSTESTDRIVER_BROWSER"] = ""
+        if "JSTESTDRIVER_SERVER" in os.environ:
+            del os.environ["JSTESTDRIVER_SERVER"]
+        os.environ["JSTESTDRIVER_PORT"] = "4225"
+
+        JsTestDriverLayer.setUp()
+        try:
+            self.assertEqual(
+                "http://localhost:4225", os.environ["JSTESTDRIVER_SERVER"])
+        finally:
+            JsTestDriverLayer.tearDown()
+        self.assertTrue(fake_proc.terminated)
 
+    def test_wakes_up_on_startup(self):
+        """
+        The server startup is noticed as soon as it is logged, without
+        spinning while waiting for it.
+        """
+        fake_proc = self.mock_popen()
         self.mocker.replay()
+        self.listen(4225)
+        timer = threading.Timer(
+            0.5, fake_proc.log, ["INFO: Finished action run."])
+        timer.start()
+        self.addCleanup(timer.cancel)
 
         os.environ["JSTESTDRIVER_BROWSER"] = ""
         if "JSTESTDRIVER_SERVER" in os.environ:
             del os.environ["JSTESTDRIVER_SERVER"]
         os.environ["JSTESTDRIVER_PORT"] = "4225"
 
+        start = time.time()
+        cpu_start = sum(os.times()[:2])
         JsTestDriverLayer.setUp()
+        try:
+            self.assertTrue(time.time() - start < 5)
+            self.assertTrue(sum(os.times()[:2]) - cpu_start < 0.25)
+        finally:
+            JsTestDriverLayer.tearDown()
+
+    def test_startup_phases_are_timed(self):
+        """
+        The phases of the server startup are timed.
+        """
+        fake_proc = self.mock_popen()
+        self.mocker.replay()
+        self.listen(4225)
+        fake_proc.log("INFO: Finished action run.")
+        records = []
+        addTimingHook(records.append)
+        self.addCleanup(removeTimingHook, records.append)
+
+        os.environ["JSTESTDRIVER_BROWSER"] = ""
+        if "JSTESTDRIVER_SERVER" in os.environ:
+            del os.environ["JSTESTDRIVER_SERVER"]
+        os.environ["JSTESTDRIVER_PORT"] = "4225"
+
+        JsTestDriverLayer.setUp()
+        JsTestDriverLayer.tearDown()
         self.assertEqual(
-            "http://localhost:4225", os.environ["JSTESTDRIVER_SERVER"])
+            [("spawn", "4225"), ("start", "4225"), ("probe", "4225")],
+            [(record["phase"], record["port"]) for record in records])
 
-    def test_server_fail(self):
+    def test_browser_pool(self):
+        """
+        Several servers can be started, each on its own port, to capture
+        a pool of browsers. They are started concurrently.
         """
-        If we a poll of the process returns a non-None value while we
-        are waiting, we report that server couldn't be started.
-        """
-        mock_proc = self.mock_popen()
-        mock_file = self.mock_builtin_open()
-
-        with self.mocker.order():
-            mock_time = self.mocker.replace("time.time")
-            # The first time is to initialize the start time.
-            mock_time()
-            start_time = 0
-            self.mocker.result(start_time)
-
-            # The second time is to check if the timeout is exceeded in
-            # the while loop.
-            mock_time()
-            self.mocker.result(start_time)
-            # Go one iteration of the while loop, reporting the server
-            # is starting up.
-            mock_proc.poll()
-            self.mocker.result(None)
-            mock_file.readline()
-            self.mocker.result("INFO: still starting")
-
-            # Go another iteration of the while loop, reporting the
-            # server failed to start up.
-            mock_time()
-            self.mocker.result(start_time)
-            mock_proc.poll()
-            self.mocker.result(1)
-
-            # The opened file is closed.
-            mock_file.close()
-            self.mocker.result(None)
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        fake_procs = [FakeServerProcess(), FakeServerProcess()]
+        for fake_proc in fake_procs:
+            mock_Popen(ARGS, KWARGS)
+            self.mocker.result(fake_proc)
+        self.mocker.replay()
+        self.listen(4225)
+        self.listen(4226)
+        for fake_proc in fake_procs:
+            fake_proc.log("INFO: Finished action run.")
 
+        os.environ["JSTESTDRIVER_BROWSER"] = ""
+        os.environ["JSTESTDRIVER_BROWSER_COUNT"] = "2"
+        if "JSTESTDRIVER_SERVER" in os.environ:
+            del os.environ["JSTESTDRIVER_SERVER"]
+        os.environ["JSTESTDRIVER_PORT"] = "4225"
+
+        JsTestDriverLayer.setUp()
+        try:
+            self.assertEqual(
+                "http://localhost:4225", os.environ["JSTESTDRIVER_SERVER"])
+            self.assertEqual(
+                "http://localhost:4225,http://localhost:4226",
+                os.environ["JSTESTDRIVER_SERVERS"])
+        finally:
+            JsTestDriverLayer.tearDown()
+        self.assertTrue(fake_procs[0].terminated)
+        self.assertTrue(fake_procs[1].terminated)
+        self.assertFalse("JSTESTDRIVER_SERVERS" in os.environ)
+
+    def test_server_fail(self):
+        """
+        If the server process exits while we are waiting, we report
+        that server couldn't be started.
+        """
+        fake_proc = self.mock_popen()
         self.mocker.replay()
+        fake_proc.log("INFO: still starting")
+        fake_proc.exit(1)
 
         if "JSTESTDRIVER_SERVER" in os.environ:
             del os.environ["JSTESTDRIVER_SERVER"]
@@ -259,6 +1276,7 @@ class JsTestDriverErrorTests(MockerTestCase):
             msg = str(e)
             self.assertIn(
                 "Failed to execute JsTestDriver server on port 4225", msg)
+            self.assertIn("INFO: still starting", msg)
         else:
             self.fail("ValueError not raised")
 
@@ -266,6 +1284,7 @@ class JsTestDriverErrorTests(MockerTestCase):
         """
         If we don't see that the server is started before the timeout, a
         ValueError is raised, even if the process is still running.
+        The process gets terminated.
         """
         timeout = 1
         os.environ["JSTESTDRIVER_CAPTURE_TIMEOUT"] = "%s" % timeout
@@ -274,47 +1293,11 @@ class JsTestDriverErrorTests(MockerTestCase):
             del os.environ["JSTESTDRIVER_SERVER"]
         os.environ["JSTESTDRIVER_PORT"] = "4225"
 
-        mock_proc = self.mock_popen()
-        mock_file = self.mock_builtin_open()
-
-        with self.mocker.order():
-            mock_time = self.mocker.replace("time.time")
-            # The first time is to initialize the start time.
-            mock_time()
-            start_time = 0
-            self.mocker.result(start_time)
-
-            # The second time is to check if the timeout is exceeded in
-            # the while loop.
-            mock_time()
-            self.mocker.result(start_time)
-            # Go one iteration of the while loop, reporting the server
-            # is starting up.
-            mock_proc.poll()
-            self.mocker.result(None)
-            mock_file.readline()
-            self.mocker.result("INFO: still starting")
-
-            # Trigger a timeout.
-            mock_time()
-            self.mocker.result(start_time + timeout + 1)
-
-            # The opened file is closed.
-            mock_file.close()
-            self.mocker.result(None)
-
-            # Last check whether the server is still running.
-            mock_proc.poll()
-            self.mocker.result(None)
-
-            # Since the server is running, it gets terminated.
-            mock_proc.terminate()
-            self.mocker.result(None)
-            mock_proc.wait()
-            self.mocker.result(None)
-
+        fake_proc = self.mock_popen()
         self.mocker.replay()
+        fake_proc.log("INFO: still starting")
 
+        cpu_start = sum(os.times()[:2])
         try:
             JsTestDriverLayer.setUp()
         except ValueError, e:
@@ -324,14 +1307,87 @@ class JsTestDriverErrorTests(MockerTestCase):
                 " on port 4225", msg)
         else:
             self.fail("ValueError not raised")
+        self.assertTrue(fake_proc.terminated)
+        # Waiting for the timeout doesn't keep a CPU busy.
+        self.assertTrue(sum(os.times()[:2]) - cpu_start < 0.25)
 
     def tearDown(self):
         super(JsTestDriverErrorTests, self).tearDown()
         self.mocker.restore()
 
 
+class ClientOutputTests(unittest.TestCase):
+
+    def test_chatty_client(self):
+        """
+        Only the end of the output of a client is kept, however much it
+        prints, but the markers anywhere in it are found.
+        """
+        proc = subprocess.Popen(
+            [sys.executable, "-c",
+             "import sys\n"
+             "print 'Tests failed.'\n"
+             "for i in xrange(100000):\n"
+             "    print 'console.log %d' % i\n"
+             "for i in xrange(2000):\n"
+             "    sys.stderr.write('x' * 10000)\n"
+             "sys.stderr.write('\\nINFO: Finished action run.\\n')\n"],
+            bufsize=-1, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = readOutput(proc)
+        self.assertEqual(0, proc.returncode)
+        self.assertTrue("Tests failed." in stdout)
+        self.assertTrue("Finished action run." in stderr)
+        self.assertTrue(len(stdout.lines) <= stdout.lines.maxlen)
+        self.assertTrue(str(stdout).endswith("console.log 99999\n"))
+        self.assertTrue(len(str(stderr)) < 1000000)
+
+
+class JsTestDriverTestCaseHelperTests(MockerTestCase):
+
+    def makeTest(self):
+        test = JsTestDriverSelfTest("runTest")
+        self.addCleanup(jstestdriver._instances.remove, test)
+        test.setUp()
+        return test
+
+    def test_temporary_files(self):
+        """
+        Test cases can make temporary files and directories as with
+        C{MockerTestCase}, removed when they're torn down.
+        """
+        test = self.makeTest()
+        directory = test.makeDir(prefix="helper-")
+        path = test.makeFile("Hello", dirname=directory, basename="a.txt")
+        other = test.makeFile(suffix=".txt")
+        self.assertTrue(os.path.basename(directory).startswith("helper-"))
+        self.assertEqual("Hello", open(path).read())
+        self.assertFalse(os.path.exists(other))
+        test.tearDown()
+        self.assertFalse(os.path.exists(directory))
+
+    def test_mocker(self):
+        """
+        Test cases have a mocker, whose expectations are verified when
+        they're torn down.
+        """
+        test = self.makeTest()
+        mock = test.mocker.mock()
+        mock.run()
+        test.mocker.replay()
+        self.assertRaises(AssertionError, test.tearDown)
+
+
 def test_suite():
     suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(ClientOutputTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverTestCaseHelperTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverResultParserTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverShardingTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverLiveResultsTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverExecutorTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverBatchTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverTimeoutTests))
+    suite.addTests(unittest.makeSuite(JsTestDriverRetryTests))
 
     if not "JSTESTDRIVER" in os.environ:
         warnings.warn("Environment variable 'JSTESTDRIVER' not set. "
@@ -0,0 +1,133 @@
+import os
+import unittest
+
+from mocker import MockerTestCase
+
+from lazr.testing.jsconfig import JsTestDriverConfig, mergeConfigs
+
+
+class JsTestDriverConfigTests(MockerTestCase):
+
+    def test_load(self):
+        """
+        Loaded files are resolved relative to the configuration file.
+        """
+        config_filename = os.path.join(
+            os.path.dirname(__file__), "js", "tests.conf")
+        config = JsTestDriverConfig(config_filename)
+        self.assertEqual(
+            ["test_failure.js", "test_error.js", "test_success.js",
+             "test_load.js"],
+            [os.path.basename(path) for path in config.sourceFiles()])
+
+    def test_test_case_names(self):
+        """
+        Test cases are found in the loaded files, in both the prototype
+        and inline styles.
+        """
+        config_filename = os.path.join(
+            os.path.dirname(__file__), "js", "tests.conf")
+        config = JsTestDriverConfig(config_filename)
+        self.assertEqual(
+            ["ErrorInlineTestCase", "ErrorTestCase",
+             "FailureInlineTestCase", "FailureTestCase",
+             "SuccessInlineTestCase", "SuccessTestCase"],
+            config.testCaseNames())
+
+    def test_loaded_test_case_names(self):
+        """
+        The names of the test cases can also be had in the order they're
+        loaded, which is the order they're run in.
+        """
+        config_filename = os.path.join(
+            os.path.dirname(__file__), "js", "tests.conf")
+        config = JsTestDriverConfig(config_filename)
+        self.assertEqual(
+            ["FailureTestCase", "FailureInlineTestCase", "ErrorTestCase",
+             "ErrorInlineTestCase", "SuccessTestCase",
+             "SuccessInlineTestCase"],
+            config.loadedTestCaseNames())
+
+    def test_test_names(self):
+        """
+        Test functions are found both on the prototype of test cases
+        and in the object literals defining them inline.
+        """
+        config_filename = os.path.join(
+            os.path.dirname(__file__), "js", "tests.conf")
+        tests = JsTestDriverConfig(config_filename).testNames()
+        self.assertEqual(
+            ["ErrorInlineTestCase", "ErrorTestCase",
+             "FailureInlineTestCase", "FailureTestCase",
+             "SuccessInlineTestCase", "SuccessTestCase"],
+            sorted(tests))
+        self.assertEqual(["testAssertEquals", "testAssertTrue"],
+                         tests["ErrorTestCase"])
+        self.assertEqual(["testAssertFalse", "testAssertNull",
+                          "testThrowAFit", "testThrowAnError"],
+                         tests["ErrorInlineTestCase"])
+
+    def test_sections(self):
+        """
+        Patterns are expanded, excluded files are left out and plugins
+        are read as mappings.
+        """
+        directory = self.makeDir()
+        for name in ["a.js", "b.js", "c_test.js"]:
+            open(os.path.join(directory, name), "w").close()
+        config_filename = self.makeFile(dirname=directory, content=(
+            "# A comment.\n"
+            "server: http://localhost:4224\n"
+            "load:\n"
+            "  - \"*.js\"\n"
+            "exclude:\n"
+            "  - b.js\n"
+            "test:\n"
+            "  - '*_test.js'\n"
+            "plugin:\n"
+            "  - name: \"coverage\"\n"
+            "    jar: \"coverage.jar\"\n"))
+        config = JsTestDriverConfig(config_filename)
+        self.assertEqual("http://localhost:4224", config.sections["server"])
+        self.assertEqual(
+            ["a.js", "c_test.js"],
+            [os.path.basename(path) for path in config.files("load")])
+        self.assertEqual(
+            ["c_test.js"],
+            [os.path.basename(path) for path in config.files("test")])
+        self.assertEqual([{"name": "coverage", "jar": "coverage.jar"}],
+                         config.plugins)
+
+    def test_merge(self):
+        """
+        A merged configuration loads the files of each configuration in
+        turn, and keeps their served files and plugins.
+        """
+        first_dir = self.makeDir()
+        second_dir = self.makeDir()
+        for directory in [first_dir, second_dir]:
+            for basename in ["lib.js", "a.js", "b.js"]:
+                self.makeFile("", dirname=directory, basename=basename)
+        first = JsTestDriverConfig(self.makeFile(
+            "load:\n  - lib.js\n  - a.js\nserve:\n  - b.js\n"
+            "plugin:\n  - name: \"coverage\"\n    jar: \"coverage.jar\"\n",
+            dirname=first_dir, basename="tests.conf"))
+        second = JsTestDriverConfig(self.makeFile(
+            "load:\n  - ../%s/lib.js\n  - b.js\n" %
+            os.path.basename(first_dir),
+            dirname=second_dir, basename="tests.conf"))
+        merged = mergeConfigs(
+            [first, second],
+            os.path.join(self.makeDir(), "merged.conf"))
+        self.assertEqual(
+            [os.path.join(first_dir, "lib.js"),
+             os.path.join(first_dir, "a.js"),
+             os.path.join(second_dir, "b.js")],
+            merged.sourceFiles())
+        self.assertEqual([os.path.join(first_dir, "b.js")],
+                         merged.files("serve"))
+        self.assertEqual(first.plugins, merged.plugins)
+
+
+def test_suite():
+    return unittest.makeSuite(JsTestDriverConfigTests)
@@ -0,0 +1,129 @@
+import os
+import threading
+import unittest
+
+from cStringIO import StringIO
+from xml.dom import minidom
+
+from mocker import MockerTestCase
+
+from lazr.testing.jscoverage import (
+    CoverageData, clearCoverage, collectCoverage, collectedCoverage,
+    readCoverage, writeCoverage)
+
+
+class CoverageDataTests(MockerTestCase):
+
+    def test_read_lcov(self):
+        """
+        The hits of the same lines are added up, whichever run they come
+        from, and relative paths are taken from the base path.
+        """
+        data = CoverageData()
+        data.readLcov(StringIO("SF:src/a.js\nDA:1,1\nDA:2,0\nLF:2\n"
+                               "end_of_record\n"), "/base")
+        data.readLcov(StringIO("TN:\nSF:/base/src/a.js\nDA:2,3\nDA:x,1\n"
+                               "end_of_record\nDA:5,1\n"
+                               "SF:/other/b.js\nDA:7,1\nend_of_record\n"))
+        self.assertEqual({"/base/src/a.js": {1: 1, 2: 3},
+                          "/other/b.js": {7: 1}}, data.files)
+
+    def test_write_lcov(self):
+        """The LCOV written reads back as the same data."""
+        data = CoverageData()
+        data.add("/base/a.js", 3, 0)
+        data.add("/base/a.js", 1, 2)
+        output = StringIO()
+        data.writeLcov(output)
+        self.assertEqual("SF:/base/a.js\nDA:1,2\nDA:3,0\nLH:1\nLF:2\n"
+                         "end_of_record\n", output.getvalue())
+        copy = CoverageData()
+        copy.readLcov(StringIO(output.getvalue()))
+        self.assertEqual(data.files, copy.files)
+
+    def test_records(self):
+        """The data survives being saved as JSON records."""
+        data = CoverageData()
+        data.add("/base/a.js", 1, 2)
+        records = data.toRecords()
+        self.assertEqual({"/base/a.js": [(1, 2)]}, records)
+        self.assertEqual(data.files, CoverageData.fromRecords(
+            {"/base/a.js": [[1, 2]]}).files)
+
+    def test_write_cobertura(self):
+        """
+        Each directory is a package, and each file a class, named
+        relative to the source directory.
+        """
+        data = CoverageData()
+        data.add("/base/src/a.js", 1, 1)
+        data.add("/base/src/a.js", 2, 0)
+        data.add("/base/lib/b.js", 1, 4)
+        output = StringIO()
+        data.writeCobertura(output, "/base")
+        document = minidom.parseString(output.getvalue())
+        coverage = document.documentElement
+        self.assertEqual("0.6667", coverage.getAttribute("line-rate"))
+        self.assertEqual("2", coverage.getAttribute("lines-covered"))
+        self.assertEqual(
+            [("lib", "1.0000"), ("src", "0.5000")],
+            [(package.getAttribute("name"), package.getAttribute("line-rate"))
+             for package in document.getElementsByTagName("package")])
+        self.assertEqual(
+            ["lib/b.js", "src/a.js"],
+            [cls.getAttribute("filename")
+             for cls in document.getElementsByTagName("class")])
+
+    def test_read_coverage(self):
+        """The coverage files of all the shards are merged."""
+        output_dir = self.makeDir()
+        os.mkdir(os.path.join(output_dir, "shard-1"))
+        for name in ["tests.conf-coverage.dat",
+                     os.path.join("shard-1", "tests.conf-coverage.dat")]:
+            self.makeFile("SF:a.js\nDA:1,1\nend_of_record\n",
+                          path=os.path.join(output_dir, name))
+        self.makeFile("SF:a.js\nDA:1,1\n",
+                      path=os.path.join(output_dir, "TEST-a.xml"))
+        self.assertEqual({"/base/a.js": {1: 2}},
+                         readCoverage(output_dir, "/base").files)
+
+    def test_write_coverage(self):
+        """
+        The coverage collected is written in both formats, if there's
+        any.
+        """
+        directory = os.path.join(self.makeDir(), "coverage")
+        self.assertEqual(None, writeCoverage(directory))
+        self.addCleanup(clearCoverage)
+        data = CoverageData()
+        data.add("/base/a.js", 1, 1)
+        collectCoverage(data)
+        self.assertEqual([os.path.join(directory, "lcov.info"),
+                          os.path.join(directory, "cobertura.xml")],
+                         writeCoverage(directory))
+        self.assertEqual(["cobertura.xml", "lcov.info"],
+                         sorted(os.listdir(directory)))
+
+    def test_collect_coverage(self):
+        """The coverage merged from several threads is all kept."""
+        self.addCleanup(clearCoverage)
+        data = CoverageData()
+        for line in range(1, 101):
+            data.add("/base/a.js", line, 1)
+
+        def collect():
+            for i in range(50):
+                collectCoverage(data)
+        threads = [threading.Thread(target=collect) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(dict((line, 200) for line in range(1, 101)),
+                         collectedCoverage().files["/base/a.js"])
+        clearCoverage()
+        self.assertFalse(collectedCoverage())
+
+
+def test_suite():
+    return unittest.makeSuite(CoverageDataTests)
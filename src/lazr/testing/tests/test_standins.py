@@ -0,0 +1,236 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from lazr.testing import jstestdriver
+from lazr.testing.benchmarks import freePort
+from lazr.testing.jscoverage import CoverageData, clearCoverage
+from lazr.testing.jstestdriver import JsTestDriverLayer, JsTestDriverTestCase
+from lazr.testing.standins import (
+    headlessBrowserCommand, jsTestDriverCommand, yetiCommand)
+from lazr.testing.tests.helpers import EnvironmentTestCase
+from lazr.testing.yeti import YetiLayer, YetiTestCase
+
+
+class StandInSelfTest(JsTestDriverTestCase):
+
+    config_filename = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                   "js", "tests.conf"))
+
+
+class StandInTestCase(EnvironmentTestCase):
+    """Run the layers and test cases against the stand-in servers."""
+
+    prefixes = ("JSTESTDRIVER", "YETI", "LAZR_TESTING")
+
+    def setUp(self):
+        super(StandInTestCase, self).setUp()
+        self.setEnv("JSTESTDRIVER", jsTestDriverCommand())
+        self.setEnv("JSTESTDRIVER_BROWSER", "standin")
+        self.setEnv("JSTESTDRIVER_PORT", str(freePort()))
+        self.setEnv("YETI", yetiCommand())
+        self.setEnv("YETI_BROWSER", "standin")
+        self.setEnv("YETI_PORT", str(freePort()))
+        self.setEnv("YETI_INDEX_DIR", "")
+
+    def setStandIn(self, name, value):
+        self.setEnv("LAZR_TESTING_STANDIN_%s" % name, value)
+
+    def test_jstestdriver(self):
+        """
+        The stand-in server captures a browser, and the stand-in client
+        runs the tests of the configuration, failing as told.
+        """
+        self.setStandIn("FAIL", "^Failure")
+        self.setStandIn("ERROR", "^Error")
+        JsTestDriverLayer.setUp()
+        try:
+            result = unittest.TestResult()
+            StandInSelfTest("runTest").run(result)
+        finally:
+            JsTestDriverLayer.tearDown()
+        self.assertEqual(14, result.testsRun)
+        self.assertEqual(4, len(result.failures))
+        self.assertEqual(6, len(result.errors))
+        # The test cases of the layer are forgotten once it's torn down.
+        self.assertEqual([], [test for test in jstestdriver._instances
+                              if test.layer is JsTestDriverLayer])
+
+    def test_jstestdriver_client_crash(self):
+        """A client exiting without running anything is an error."""
+        JsTestDriverLayer.setUp()
+        try:
+            self.setStandIn("CRASH", "client")
+            self.assertRaises(ValueError, StandInSelfTest("runTest").run,
+                              unittest.TestResult())
+        finally:
+            JsTestDriverLayer.tearDown()
+
+    def test_jstestdriver_hang(self):
+        """
+        A client hanging is killed, and the test case it hung on is the
+        first one without a report, in the order they're loaded.
+        """
+        self.setStandIn("CRASH", "hang")
+        self.setEnv("JSTESTDRIVER_TEST_TIMEOUT", "1")
+        JsTestDriverLayer.setUp()
+        try:
+            result = unittest.TestResult()
+            StandInSelfTest("runTest").run(result)
+        finally:
+            JsTestDriverLayer.tearDown()
+        self.assertEqual(3, result.testsRun)
+        self.assertEqual(1, len(result.errors))
+        self.assertTrue("running FailureInlineTestCase"
+                        in str(result.errors[0][1]))
+
+    def test_jstestdriver_capture_timeout(self):
+        """A server never capturing its browser fails the layer setUp."""
+        self.setStandIn("CRASH", "capture")
+        self.setEnv("JSTESTDRIVER_CAPTURE_TIMEOUT", "1")
+        self.assertRaises(ValueError, JsTestDriverLayer.setUp)
+        self.assertEqual(None, os.environ.get("JSTESTDRIVER_SERVER"))
+
+    def test_jstestdriver_recapture(self):
+        """
+        A server losing its browser while the tests run is restarted on
+        the same port, and the test cases that didn't run are run again.
+        """
+        self.setStandIn("CRASH", "browser")
+        self.setStandIn("CRASH_ONCE", os.path.join(self.makeDir(), "crashed"))
+        JsTestDriverLayer.setUp()
+        try:
+            proc = JsTestDriverLayer.procs[0]
+            result = unittest.TestResult()
+            StandInSelfTest("runTest").run(result)
+            self.assertEqual(1, len(JsTestDriverLayer.procs))
+            self.assertTrue(JsTestDriverLayer.procs[0] is not proc)
+            self.assertEqual(proc.port, JsTestDriverLayer.procs[0].port)
+        finally:
+            JsTestDriverLayer.tearDown()
+        self.assertEqual(14, result.testsRun)
+        self.assertEqual([], result.errors)
+        self.assertEqual([], result.failures)
+
+    def test_jstestdriver_lost_browser(self):
+        """
+        Once the browser was recaptured C{JSTESTDRIVER_RECAPTURE} times,
+        losing it again is an error, and the reports completed before
+        are kept.
+        """
+        self.setStandIn("CRASH", "browser")
+        JsTestDriverLayer.setUp()
+        try:
+            result = unittest.TestResult()
+            StandInSelfTest("runTest").run(result)
+        finally:
+            JsTestDriverLayer.tearDown()
+        self.assertTrue(result.testsRun > 1)
+        self.assertEqual(1, len(result.errors))
+        self.assertTrue("browser was lost" in str(result.errors[0][1]))
+
+    def test_jstestdriver_coverage(self):
+        """
+        With C{JSTESTDRIVER_COVERAGE} set, the coverage of all the
+        shards is merged, and written when the layer is torn down.
+        """
+        directory = self.makeDir()
+        for key, value in [("JSTESTDRIVER_COVERAGE", "coverage.jar"),
+                           ("JSTESTDRIVER_COVERAGE_DIR", directory),
+                           ("JSTESTDRIVER_BROWSER_COUNT", "2")]:
+            self.setEnv(key, value)
+        self.addCleanup(clearCoverage)
+        JsTestDriverLayer.setUp()
+        try:
+            result = unittest.TestResult()
+            StandInSelfTest("runTest").run(result)
+        finally:
+            JsTestDriverLayer.tearDown()
+        self.assertEqual(14, result.testsRun)
+        self.assertEqual(["cobertura.xml", "lcov.info"],
+                         sorted(os.listdir(directory)))
+        coverage = CoverageData()
+        coverage.readLcov(open(os.path.join(directory, "lcov.info")))
+        source = os.path.join(os.path.dirname(
+            StandInSelfTest.config_filename), "test_success.js")
+        self.assertEqual(set([2]), set(coverage.files[source].values()))
+
+    def makeYetiTests(self, names):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in names:
+            test_file = open(os.path.join(directory, name), "w")
+            try:
+                test_file.write("<script>\n"
+                                "var suite = {testOne: function() {},\n"
+                                "             testTwo: function() {}};\n"
+                                "</script>\n")
+            finally:
+                test_file.close()
+        return directory
+
+    def test_yeti(self):
+        """
+        The stand-in Yeti client reports the tests of each file as a
+        subunit stream.
+        """
+        directory = self.makeYetiTests(["test_a.html", "test_b.html"])
+        self.setStandIn("FAIL", r"^test_b\.html\.testOne$")
+
+        class StandInYetiTest(YetiTestCase):
+            tests_directory = directory
+
+        YetiLayer.setUp()
+        try:
+            result = unittest.TestResult()
+            StandInYetiTest("runTest").run(result)
+        finally:
+            YetiLayer.tearDown()
+        self.assertEqual(4, result.testsRun)
+        self.assertEqual(1, len(result.failures))
+
+    def test_yeti_recapture(self):
+        """
+        A headless browser exiting while the tests run is started again,
+        and the files whose tests didn't start are run again.
+        """
+        directory = self.makeYetiTests(
+            ["test_a.html", "test_b.html", "test_c.html"])
+        self.setStandIn("TEST_DELAY", "0.2")
+        self.setEnv("LAZR_TESTING_HEADLESS_BROWSER", headlessBrowserCommand())
+        self.setEnv("LAZR_TESTING_PROFILE_DIR", self.makeDir())
+        self.setEnv("YETI_BROWSER", "headless")
+
+        class StandInYetiTest(YetiTestCase):
+            tests_directory = directory
+
+        YetiLayer.setUp()
+        try:
+            browser = YetiLayer.browsers.browsers[0]
+            crash = threading.Timer(0.5, browser.proc.terminate)
+            crash.start()
+            result = unittest.TestResult()
+            StandInYetiTest("runTest").run(result)
+            crash.join()
+            self.assertTrue(YetiLayer.browsers.browsers[0] is not browser)
+            self.assertTrue(YetiLayer.browsers.browsers[0].isRunning())
+        finally:
+            YetiLayer.tearDown()
+        # The test running when the browser exited is an error.
+        self.assertTrue(result.testsRun >= 5)
+        self.assertTrue(len(result.errors) <= 1)
+        self.assertEqual([], result.failures)
+
+    def test_yeti_start_failure(self):
+        """A server failing to start fails the layer setUp."""
+        self.setStandIn("CRASH", "start")
+        self.assertRaises(ValueError, YetiLayer.setUp)
+        self.assertEqual(None, os.environ.get("YETI_SERVER"))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(StandInTestCase))
+    return suite
@@ -0,0 +1,112 @@
+import os
+import stat
+import operator
+import subprocess
+import unittest
+
+from mocker import MockerTestCase
+
+from lazr.testing.jstestdriver import JsTestDriverTestCase
+from lazr.testing.tempdirs import ScratchDirs, outputDirs
+
+
+class ScratchDirsTests(MockerTestCase):
+
+    def setUp(self):
+        super(ScratchDirsTests, self).setUp()
+        key = "JSTESTDRIVER_OUTPUT_DIR"
+        if key in os.environ:
+            self.addCleanup(
+                operator.setitem, os.environ, key, os.environ[key])
+        else:
+            self.addCleanup(os.environ.pop, key, None)
+        self.root = self.makeDir()
+        os.environ[key] = self.root
+
+    def test_reuse(self):
+        """
+        Released directories are emptied, and handed out again. They're
+        all in a directory of the process.
+        """
+        dirs = ScratchDirs(self.root)
+        self.addCleanup(dirs.close)
+        path = dirs.acquire()
+        base = os.path.dirname(path)
+        self.assertEqual(self.root, os.path.dirname(base))
+        self.assertTrue(os.path.basename(base).startswith(
+            "lazr-scratch-%d-" % os.getpid()))
+        self.assertEqual(0700, stat.S_IMODE(os.stat(base).st_mode))
+        os.mkdir(os.path.join(path, "shard-0"))
+        open(os.path.join(path, "shard-0", "TEST-A.xml"), "w").close()
+        open(os.path.join(path, "TEST-B.xml"), "w").close()
+        other = dirs.acquire()
+        self.assertNotEqual(path, other)
+        dirs.release(path)
+        self.assertEqual([], os.listdir(path))
+        self.assertEqual(path, dirs.acquire())
+
+    def test_close(self):
+        """Closing removes the directory of the process."""
+        dirs = ScratchDirs(self.root)
+        dirs.acquire()
+        dirs.close()
+        self.assertEqual([], os.listdir(self.root))
+
+    def test_clean_stale(self):
+        """
+        The directories of the processes that died are removed when
+        another process creates its own.
+        """
+        dead = subprocess.Popen(["true"])
+        dead.wait()
+        stale = os.path.join(self.root, "lazr-scratch-%d-abc" % dead.pid)
+        os.makedirs(os.path.join(stale, "tmpabc"))
+        alive = os.path.join(self.root, "lazr-scratch-1-abc")
+        os.mkdir(alive)
+        dirs = ScratchDirs(self.root)
+        self.addCleanup(dirs.close)
+        dirs.acquire()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(alive))
+
+    def test_clean_stale_links(self):
+        """
+        Links named like the directory of a process that died are left
+        alone, and so is what they point to.
+        """
+        dead = subprocess.Popen(["true"])
+        dead.wait()
+        target = self.makeDir()
+        open(os.path.join(target, "precious"), "w").close()
+        link = os.path.join(self.root, "lazr-scratch-%d-abc" % dead.pid)
+        os.symlink(target, link)
+        dirs = ScratchDirs(self.root)
+        self.addCleanup(dirs.close)
+        dirs.acquire()
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(["precious"], os.listdir(target))
+
+    def test_test_case(self):
+        """
+        The test cases write their reports in the directories of
+        L{outputDirs}, which are reused once they're done.
+        """
+
+        class SomeTest(JsTestDriverTestCase):
+            config_filename = "tests.conf"
+
+        test = SomeTest()
+        test.setUp()
+        output_dir = test.output_dir
+        self.addCleanup(outputDirs().close)
+        self.assertTrue(output_dir.startswith(self.root + os.sep))
+        open(os.path.join(output_dir, "TEST-A.xml"), "w").close()
+        test.tearDown()
+        self.assertEqual([], os.listdir(output_dir))
+        test.setUp()
+        self.assertEqual(output_dir, test.output_dir)
+        test.tearDown()
+
+
+def test_suite():
+    return unittest.makeSuite(ScratchDirsTests)
@@ -0,0 +1,89 @@
+import os
+import sys
+import operator
+import unittest
+
+from cStringIO import StringIO
+
+from mocker import MockerTestCase
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from lazr.testing.timing import (
+    PhaseTimer, addTimingHook, monotonic, removeTimingHook,
+    showSetUpTimings)
+
+
+class PhaseTimerTests(MockerTestCase):
+
+    def setUp(self):
+        super(PhaseTimerTests, self).setUp()
+        for key in ["LAZR_TESTING_TIMINGS", "LAZR_TESTING_TIMINGS_FILE"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+            os.environ.pop(key, None)
+        self.records = []
+        addTimingHook(self.records.append)
+        self.addCleanup(removeTimingHook, self.records.append)
+
+    def test_monotonic(self):
+        """
+        The clock never goes backwards.
+        """
+        first = monotonic()
+        self.assertTrue(monotonic() >= first)
+
+    def test_phases_are_recorded(self):
+        """
+        Each phase is passed to the hooks, with the details of the
+        timer, and starts when the previous one ended.
+        """
+        timer = PhaseTimer(server="jstestdriver", port="4224")
+        timer.mark("spawn")
+        timer.mark("capture")
+        self.assertEqual(["spawn", "capture"],
+                         [record["phase"] for record in self.records])
+        self.assertEqual(["4224", "4224"],
+                         [record["port"] for record in self.records])
+        first, second = self.records
+        self.assertEqual(first["start"] + first["duration"],
+                         second["start"])
+
+    def test_timings_file(self):
+        """
+        Timings are appended to C{LAZR_TESTING_TIMINGS_FILE}, one JSON
+        object per line.
+        """
+        path = self.makeFile()
+        os.environ["LAZR_TESTING_TIMINGS_FILE"] = path
+        timer = PhaseTimer(test="test_foo")
+        timer.mark("run")
+        timer.mark("report")
+        records = [json.loads(line) for line in open(path)]
+        self.assertEqual(self.records, records)
+
+    def test_set_up_timings(self):
+        """
+        The phases of a layer setUp are shown if C{LAZR_TESTING_TIMINGS}
+        is set.
+        """
+        timer = PhaseTimer(port="4224")
+        timer.phases = [("spawn", 0.1), ("capture", 1.25)]
+        self.addCleanup(setattr, sys, "stdout", sys.stdout)
+        sys.stdout = StringIO()
+        showSetUpTimings([timer])
+        self.assertEqual("", sys.stdout.getvalue())
+        os.environ["LAZR_TESTING_TIMINGS"] = "1"
+        showSetUpTimings([timer])
+        self.assertEqual("(port 4224: spawn 0.100s, capture 1.250s) ",
+                         sys.stdout.getvalue())
+
+
+def test_suite():
+    return unittest.makeSuite(PhaseTimerTests)
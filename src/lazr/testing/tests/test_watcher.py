@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import operator
+import threading
+import subprocess
+import unittest
+
+from cStringIO import StringIO
+
+from mocker import MockerTestCase
+
+from lazr.testing.watcher import (
+    LogWatcher, OutputTail, Watchdog, makeWatchdog)
+
+
+class FakeProcess(object):
+    """A process that runs until it's terminated."""
+
+    def __init__(self):
+        self.returncode = None
+        self.terminated = threading.Event()
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+        self.terminated.set()
+
+    def kill(self):
+        self.returncode = -9
+
+
+class WatchdogTests(MockerTestCase):
+
+    def setUp(self):
+        super(WatchdogTests, self).setUp()
+        for key in ["FOO_TIMEOUT", "FOO_TEST_TIMEOUT"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+            os.environ.pop(key, None)
+
+    def test_timeout(self):
+        """
+        A process running for too long is terminated.
+        """
+        watchdog = Watchdog(timeout=0.1, interval=0.01)
+        proc = FakeProcess()
+        watchdog.watch("foo", proc)
+        self.assertTrue(proc.terminated.wait(5))
+        watchdog.stop()
+        self.assertEqual({"foo": ("timeout", 0.1)}, watchdog.expired)
+
+    def test_progress(self):
+        """
+        A process is only terminated once it makes no progress for too
+        long.
+        """
+        watchdog = Watchdog(idle_timeout=0.2, interval=0.01)
+        proc = FakeProcess()
+        other_proc = FakeProcess()
+        progress = []
+        watchdog.watch("foo", proc, lambda: len(progress))
+        watchdog.watch("bar", other_proc)
+        start = time.time()
+        for i in range(5):
+            time.sleep(0.05)
+            progress.append(i)
+        self.assertTrue(proc.terminated.wait(5))
+        self.assertTrue(time.time() - start >= 0.45)
+        watchdog.stop()
+        self.assertEqual({"foo": ("idle", 0.2), "bar": ("idle", 0.2)},
+                         watchdog.expired)
+
+    def test_lost(self):
+        """
+        A process is terminated as soon as its browser is lost, without
+        any timeout.
+        """
+        watchdog = Watchdog(interval=0.01)
+        proc = FakeProcess()
+        lost = []
+        watchdog.watch("foo", proc, lost=lambda: bool(lost))
+        time.sleep(0.05)
+        self.assertFalse(proc.terminated.isSet())
+        lost.append(True)
+        self.assertTrue(proc.terminated.wait(5))
+        watchdog.stop()
+        self.assertEqual({"foo": ("lost", None)}, watchdog.expired)
+
+    def test_make_watchdog(self):
+        """
+        Watchdogs are configured from the environment.
+        """
+        self.assertEqual(None, makeWatchdog("FOO"))
+        os.environ["FOO_TEST_TIMEOUT"] = "30"
+        watchdog = makeWatchdog("FOO")
+        self.assertEqual((None, 30.0),
+                         (watchdog.timeout, watchdog.idle_timeout))
+
+
+class LogWatcherTests(unittest.TestCase):
+
+    def test_chatty_process(self):
+        """
+        A process printing many more lines than the wakeup pipe holds
+        is followed to the end, with nobody waiting.
+        """
+        proc = subprocess.Popen(
+            [sys.executable, "-c",
+             "for i in xrange(200000): print 'INFO: line'\n"
+             "print 'Done'"],
+            stdout=subprocess.PIPE)
+        watcher = LogWatcher(proc.stdout, ["INFO:", "Done"], max_lines=10)
+        self.addCleanup(watcher.close)
+        deadline = time.time() + 30
+        while not watcher.closed and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(watcher.closed)
+        proc.wait()
+        self.assertEqual(200000, watcher.count("INFO:"))
+        self.assertEqual(1, watcher.count("Done"))
+        self.assertEqual(10, len(watcher.lines()))
+
+
+class OutputTailTests(unittest.TestCase):
+
+    def test_markers(self):
+        """
+        Markers are found in every line, even the ones that aren't kept
+        anymore.
+        """
+        tail = OutputTail(["Tests failed."], max_lines=2)
+        self.assertFalse(tail)
+        tail.feed("INFO: Tests failed. Sorry.\n")
+        for index in range(3):
+            tail.feed("line %d\n" % index)
+        self.assertTrue("Tests failed." in tail)
+        self.assertFalse("Finished action run." in tail)
+        self.assertEqual("[2 lines dropped]\nline 1\nline 2\n", str(tail))
+
+    def test_long_lines(self):
+        """Long lines are read and kept in bits."""
+        tail = OutputTail(["marker"], max_lines=2, max_length=10)
+        tail.consume(StringIO("x" * 95 + "marker\n"))
+        self.assertTrue("marker" in tail)
+        self.assertEqual(["xxxxxmarke", "r\n"], list(tail.lines))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(WatchdogTests))
+    suite.addTests(unittest.makeSuite(LogWatcherTests))
+    suite.addTests(unittest.makeSuite(OutputTailTests))
+    return suite
@@ -11,11 +11,254 @@ from cStringIO import StringIO
 
 from os.path import dirname
 
-from mocker import ANY, ARGS, KWARGS, MockerTestCase
+from mocker import ARGS, KWARGS, MockerTestCase
 
 from zope.testing import testrunner
 
-from lazr.testing.yeti import YetiLayer
+from lazr.testing.durations import DurationStore
+from lazr.testing.yeti import YetiLayer, YetiTestCase, testFiles
+from lazr.testing.tests.helpers import FakeServerProcess
+
+
+class FakeYetiClient(object):
+    """A stand-in for a Yeti client, reporting a subunit stream.
+
+    Tests in files whose name contains C{fail} fail. If L{timed} is
+    set, each test takes half a second.
+    """
+
+    timed = False
+
+    def __init__(self, cmd, **kwargs):
+        self.paths = [arg for arg in cmd if arg.endswith(".html")]
+        lines = []
+        for path in self.paths:
+            name = os.path.basename(path)
+            if self.timed:
+                lines.append("time: 2010-09-06 12:00:00.000000Z\n")
+            lines.append("test: %s\n" % name)
+            if self.timed:
+                lines.append("time: 2010-09-06 12:00:00.500000Z\n")
+            if "fail" in name:
+                lines.append("failure: %s [\nBroken\n]\n" % name)
+            else:
+                lines.append("success: %s\n" % name)
+        self.stdout = StringIO("".join(lines))
+        self.returncode = 0
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        return self.returncode
+
+
+class FlakyYetiClient(FakeYetiClient):
+    """A stand-in for a Yeti client whose C{test_b.html} fails once."""
+
+    failed = False
+
+    def __init__(self, cmd, **kwargs):
+        FakeYetiClient.__init__(self, cmd, **kwargs)
+        if not self.failed:
+            FlakyYetiClient.failed = True
+            self.stdout = StringIO(self.stdout.getvalue().replace(
+                "success: test_b.html\n",
+                "failure: test_b.html [\nFlaky\n]\n"))
+
+
+class SuccessRecordingTestResult(unittest.TestResult):
+    """Keep the descriptions of the tests that passed."""
+
+    def __init__(self):
+        unittest.TestResult.__init__(self)
+        self.successes = []
+
+    def addSuccess(self, test):
+        unittest.TestResult.addSuccess(self, test)
+        self.successes.append(str(test))
+
+
+class HangingYetiClient(object):
+    """A stand-in for a Yeti client hanging on its second test."""
+
+    def __init__(self, cmd, **kwargs):
+        read_fd, self.write_fd = os.pipe()
+        self.stdout = os.fdopen(read_fd)
+        os.write(self.write_fd,
+                 "test: test_a.html\nsuccess: test_a.html\n"
+                 "test: test_b.html\n")
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+        os.close(self.write_fd)
+
+    def kill(self):
+        self.returncode = -9
+
+
+class YetiParallelTests(MockerTestCase):
+
+    def setUp(self):
+        super(YetiParallelTests, self).setUp()
+        for key in ["YETI", "YETI_PARALLEL", "YETI_INDEX_DIR",
+                    "YETI_TEST_TIMEOUT", "YETI_BROWSER", "YETI_RETRY",
+                    "LAZR_TESTING_DURATIONS"]:
+            if key in os.environ:
+                self.addCleanup(
+                    operator.setitem, os.environ, key, os.environ[key])
+            else:
+                self.addCleanup(os.environ.pop, key, None)
+        os.environ.pop("YETI_BROWSER", None)
+        os.environ.pop("YETI_RETRY", None)
+        os.environ.pop("LAZR_TESTING_DURATIONS", None)
+        os.environ["YETI"] = "yeti"
+        os.environ["YETI_INDEX_DIR"] = self.makeDir()
+        directory = self.makeDir()
+        for name in ["test_a.html", "test_b.html", "test_fail.html",
+                     "test_d.html", "test_e.html"]:
+            self.makeFile("", dirname=directory, basename=name)
+
+        class ParallelYetiTest(YetiTestCase):
+            tests_directory = directory
+        self.test = ParallelYetiTest("runTest")
+
+    def run_clients(self, count):
+        clients = []
+
+        def popen(cmd, **kwargs):
+            clients.append(FakeYetiClient(cmd, **kwargs))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(count)
+        self.mocker.replay()
+        result = unittest.TestResult()
+        self.test.run(result)
+        return clients, result
+
+    def test_serial(self):
+        """
+        By default, a single client runs all the files.
+        """
+        clients, result = self.run_clients(1)
+        self.assertEqual(5, len(clients[0].paths))
+        self.assertEqual(5, result.testsRun)
+        self.assertEqual(1, len(result.failures))
+
+    def test_parallel(self):
+        """
+        With C{YETI_PARALLEL}, the files are spread across several
+        clients, and their results are all reported.
+        """
+        os.environ["YETI_PARALLEL"] = "2"
+        clients, result = self.run_clients(2)
+        self.assertEqual([3, 2], [len(client.paths) for client in clients])
+        self.assertEqual(5, result.testsRun)
+        self.assertEqual(["test_fail.html"],
+                         [test.id() for test, error in result.failures])
+
+    def test_balanced(self):
+        """
+        With recorded durations, the files are split across the clients
+        so that they take about as long, and the durations of the run
+        are recorded from the subunit time events.
+        """
+        path = os.path.join(self.makeDir(), "durations.json")
+        store = DurationStore(path)
+        store.record("default", {"test_a.html": 10.0, "test_b.html": 1.0,
+                                 "test_d.html": 1.0, "test_e.html": 1.0,
+                                 "test_fail.html": 1.0})
+        store.save()
+        os.environ["LAZR_TESTING_DURATIONS"] = path
+        os.environ["YETI_PARALLEL"] = "2"
+        self.addCleanup(setattr, FakeYetiClient, "timed", False)
+        FakeYetiClient.timed = True
+        clients, result = self.run_clients(2)
+        self.assertEqual(
+            [["test_a.html"],
+             ["test_b.html", "test_d.html", "test_e.html", "test_fail.html"]],
+            [sorted(os.path.basename(path) for path in client.paths)
+             for client in clients])
+        self.assertEqual(5, result.testsRun)
+        durations = DurationStore(path).durations["default"]
+        self.assertEqual(0.5, durations["test_a.html"])
+        self.assertEqual(0.5, durations["test_e.html"])
+
+    def test_test_files(self):
+        """
+        The tests of a file are the ones whose id contains its name, as
+        a whole, with or without its extension.
+        """
+        paths = ["/js/test_a.html", "/js/test_ab.html", "/js/test_a.b.html"]
+        self.assertEqual(
+            {"/js/test_a.html": ["test_a.html", "Firefox.test_a.testOne"],
+             "/js/test_ab.html": ["Firefox.test_ab.html.testOne"],
+             "/js/test_a.b.html": ["test_a.b.html"]},
+            testFiles(["test_a.html", "Firefox.test_a.testOne",
+                       "Firefox.test_ab.html.testOne", "test_a.b.html",
+                       "my_test_a.html"], paths))
+
+    def test_retry(self):
+        """
+        With C{YETI_RETRY}, the files of the failed tests are run again,
+        and the tests passing are reported as such.
+        """
+        os.environ["YETI_RETRY"] = "1"
+        self.addCleanup(setattr, FlakyYetiClient, "failed", False)
+        clients = []
+
+        def popen(cmd, **kwargs):
+            clients.append(FlakyYetiClient(cmd, **kwargs))
+            return clients[-1]
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(popen)
+        self.mocker.count(2)
+        self.mocker.replay()
+        result = SuccessRecordingTestResult()
+        self.test.run(result)
+        self.assertEqual(
+            ["test_b.html", "test_fail.html"],
+            sorted(os.path.basename(path) for path in clients[1].paths))
+        self.assertEqual(5, result.testsRun)
+        self.assertEqual(["test_fail.html"],
+                         [test.id() for test, error in result.failures])
+        retried = [success for success in result.successes
+                   if success.endswith(" [passed on retry]")]
+        self.assertEqual(1, len(retried))
+        self.assertTrue(retried[0].startswith("test_b.html"))
+
+    def test_hung_client_is_killed(self):
+        """
+        A client making no progress is killed, the test it hung on is
+        reported as an error, and the results already collected are
+        kept.
+        """
+        os.environ["YETI_TEST_TIMEOUT"] = "0.3"
+        mock_Popen = self.mocker.replace("subprocess.Popen")
+        mock_Popen(ARGS, KWARGS)
+        self.mocker.call(HangingYetiClient)
+        self.mocker.replay()
+        result = unittest.TestResult()
+        self.test.run(result)
+        self.assertEqual(1, result.testsRun - len(result.errors))
+        self.assertEqual(
+            ["test_b.html", self.test.id()],
+            [test.id() for test, error in result.errors])
+        self.assertTrue("no progress for 0.3 seconds" in result.errors[1][1])
+
+    def tearDown(self):
+        super(YetiParallelTests, self).tearDown()
+        self.mocker.restore()
 
 
 class YetiLayerErrorTests(MockerTestCase):
@@ -74,62 +317,33 @@ class YetiLayerErrorTests(MockerTestCase):
             s.close()
 
     def mock_popen(self):
-        """Replace subprocess.Popen and make it return a mock process.
+        """Replace subprocess.Popen and make it return a fake process.
 
-        The mock process is returned.
+        The fake process is returned.
         """
         mock_Popen = self.mocker.replace("subprocess.Popen")
-        self.mock_proc = self.mocker.mock()
+        self.fake_proc = FakeServerProcess()
         mock_Popen(ARGS, KWARGS)
-        self.mocker.result(self.mock_proc)
-        return self.mock_proc
-
-    def mock_builtin_open(self):
-        """Replace built-in open and make it return a mock file.
+        self.mocker.result(self.fake_proc)
+        return self.fake_proc
 
-        The mock file is returned.
-        """
-        mock_open = self.mocker.replace("__builtin__.open")
-        mock_open(ANY)
-        self.mock_file = self.mocker.mock()
-        self.mocker.result(self.mock_file)
-        return self.mock_file
+    def listen(self, port):
+        """Listen on the given port, as the real server would."""
+        s = socket.socket()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(("localhost", port))
+        s.listen(5)
+        self.addCleanup(s.close)
 
     def test_wait_for_server_startup(self):
         """
         Even if we don't wait for the browser to be captured, we wait
         for the server to start up.
         """
-        mock_proc = self.mock_popen()
-        mock_file = self.mock_builtin_open()
-
-        with self.mocker.order():
-            mock_time = self.mocker.replace("time.time")
-            # The first time is to initialize the start time.
-            mock_time()
-            start_time = 0
-            self.mocker.result(start_time)
-
-            # The second time is to check if the timeout is exceeded in
-            # the while loop.
-            mock_time()
-            self.mocker.result(start_time)
-            # Go one iteration of the while loop, reporting the server
-            # has started.
-            mock_proc.poll()
-            self.mocker.result(None)
-            mock_file.readline()
-            self.mocker.result("to run and report the results")
-
-            # The opened file is closed.
-            mock_file.close()
-            self.mocker.result(None)
-
-            # Last check to make sure the server is running ok.
-            mock_proc.poll()
-            self.mocker.result(None)
-
+        fake_proc = self.mock_popen()
         self.mocker.replay()
+        self.listen(4225)
+        fake_proc.log("to run and report the results")
 
         os.environ["YETI_BROWSER"] = ""
         if "YETI_SERVER" in os.environ:
@@ -137,47 +351,22 @@ class YetiLayerErrorTests(MockerTestCase):
         os.environ["YETI_PORT"] = "4225"
 
         YetiLayer.setUp()
-        self.assertEqual(
-            "http://localhost:4225", os.environ["YETI_SERVER"])
+        try:
+            self.assertEqual(
+                "http://localhost:4225", os.environ["YETI_SERVER"])
+        finally:
+            YetiLayer.tearDown()
+        self.assertTrue(fake_proc.terminated)
 
     def test_server_fail(self):
         """
-        If we a poll of the process returns a non-None value while we
-        are waiting, we report that server couldn't be started.
+        If the server process exits while we are waiting, we report
+        that server couldn't be started.
         """
-        mock_proc = self.mock_popen()
-        mock_file = self.mock_builtin_open()
-
-        with self.mocker.order():
-            mock_time = self.mocker.replace("time.time")
-            # The first time is to initialize the start time.
-            mock_time()
-            start_time = 0
-            self.mocker.result(start_time)
-
-            # The second time is to check if the timeout is exceeded in
-            # the while loop.
-            mock_time()
-            self.mocker.result(start_time)
-            # Go one iteration of the while loop, reporting the server
-            # is starting up.
-            mock_proc.poll()
-            self.mocker.result(None)
-            mock_file.readline()
-            self.mocker.result("not yeti?")
-
-            # Go another iteration of the while loop, reporting the
-            # server failed to start up.
-            mock_time()
-            self.mocker.result(start_time)
-            mock_proc.poll()
-            self.mocker.result(1)
-
-            # The opened file is closed.
-            mock_file.close()
-            self.mocker.result(None)
-
+        fake_proc = self.mock_popen()
         self.mocker.replay()
+        fake_proc.log("not yeti?")
+        fake_proc.exit(1)
 
         if "YETI_SERVER" in os.environ:
             del os.environ["YETI_SERVER"]
@@ -189,6 +378,7 @@ class YetiLayerErrorTests(MockerTestCase):
             msg = str(e)
             self.assertIn(
                 "Failed to execute Yeti server on port 4225", msg)
+            self.assertIn("not yeti?", msg)
         else:
             self.fail("ValueError not raised")
 
@@ -196,6 +386,7 @@ class YetiLayerErrorTests(MockerTestCase):
         """
         If we don't see that the server is started before the timeout, a
         ValueError is raised, even if the process is still running.
+        The process gets terminated.
         """
         timeout = 1
         os.environ["YETI_CAPTURE_TIMEOUT"] = "%s" % timeout
@@ -204,47 +395,11 @@ class YetiLayerErrorTests(MockerTestCase):
             del os.environ["YETI_SERVER"]
         os.environ["YETI_PORT"] = "4225"
 
-        mock_proc = self.mock_popen()
-        mock_file = self.mock_builtin_open()
-
-        with self.mocker.order():
-            mock_time = self.mocker.replace("time.time")
-            # The first time is to initialize the start time.
-            mock_time()
-            start_time = 0
-            self.mocker.result(start_time)
-
-            # The second time is to check if the timeout is exceeded in
-            # the while loop.
-            mock_time()
-            self.mocker.result(start_time)
-            # Go one iteration of the while loop, reporting the server
-            # is starting up.
-            mock_proc.poll()
-            self.mocker.result(None)
-            mock_file.readline()
-            self.mocker.result("not yeti?")
-
-            # Trigger a timeout.
-            mock_time()
-            self.mocker.result(start_time + timeout + 1)
-
-            # The opened file is closed.
-            mock_file.close()
-            self.mocker.result(None)
-
-            # Last check whether the server is still running.
-            mock_proc.poll()
-            self.mocker.result(None)
-
-            # Since the server is running, it gets terminated.
-            mock_proc.terminate()
-            self.mocker.result(None)
-            mock_proc.wait()
-            self.mocker.result(None)
-
+        fake_proc = self.mock_popen()
         self.mocker.replay()
+        fake_proc.log("not yeti?")
 
+        cpu_start = sum(os.times()[:2])
         try:
             YetiLayer.setUp()
         except ValueError, e:
@@ -254,6 +409,9 @@ class YetiLayerErrorTests(MockerTestCase):
                 " on port 4225", msg)
         else:
             self.fail("ValueError not raised")
+        self.assertTrue(fake_proc.terminated)
+        # Waiting for the timeout doesn't keep a CPU busy.
+        self.assertTrue(sum(os.times()[:2]) - cpu_start < 0.25)
 
     def tearDown(self):
         super(YetiLayerErrorTests, self).tearDown()
@@ -262,6 +420,7 @@ class YetiLayerErrorTests(MockerTestCase):
 
 def test_suite():
     suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(YetiParallelTests))
 
     if not "YETI" in os.environ:
         warnings.warn("Environment variable 'YETI' not set. "
@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+def _systemMonotonic():
+    """Return C{clock_gettime(CLOCK_MONOTONIC)}, or C{None} if unavailable.
+
+    The value of C{CLOCK_MONOTONIC} differs between systems, so the
+    clock is only used on Linux.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+    except ImportError:
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    try:
+        library = ctypes.CDLL(ctypes.util.find_library("rt") or
+                              ctypes.util.find_library("c"))
+        clock_gettime = library.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    # CLOCK_MONOTONIC on Linux.
+    CLOCK_MONOTONIC = 1
+
+    def monotonic():
+        # The timers run in several threads, so each call gets its own.
+        value = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(value)) != 0:
+            return time.time()
+        return value.tv_sec + value.tv_nsec * 1e-9
+    return monotonic
+
+
+# Seconds from an arbitrary point, never going backwards, unless the
+# system doesn't provide such a clock.
+monotonic = _systemMonotonic() or time.time
+
+
+_hooks = []
+_lock = threading.Lock()
+
+
+def addTimingHook(hook):
+    """Call C{hook} with each timing recorded from now on.
+
+    Timings are mappings with the C{phase} that was timed, its
+    C{start} on the L{monotonic} clock, its C{duration} in seconds,
+    and details identifying what was timed, like the C{server} and
+    C{port}, or the C{test}.
+    """
+    _hooks.append(hook)
+
+
+def removeTimingHook(hook):
+    _hooks.remove(hook)
+
+
+def recordTiming(phase, start, end, **details):
+    """Pass a timing to the hooks, and to C{LAZR_TESTING_TIMINGS_FILE}.
+
+    The file, if set, gets a JSON object per line.
+    """
+    record = dict(details)
+    record.update(phase=phase, start=start, duration=end - start)
+    for hook in list(_hooks):
+        hook(record)
+    path = os.environ.get("LAZR_TESTING_TIMINGS_FILE")
+    if path:
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with _lock:
+            timings = open(path, "a")
+            try:
+                timings.write(line)
+            finally:
+                timings.close()
+
+
+class PhaseTimer(object):
+    """Time the consecutive phases of an operation.
+
+    Each call to L{mark} ends the current phase, and records its
+    timing along with the C{details} given to the constructor.
+    """
+
+    def __init__(self, **details):
+        self.details = details
+        self.phases = []
+        self.last = monotonic()
+
+    def mark(self, phase):
+        now = monotonic()
+        recordTiming(phase, self.last, now, **self.details)
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def summary(self):
+        """Return the phases and their durations, for humans."""
+        return ", ".join("%s %.3fs" % (phase, duration)
+                         for phase, duration in self.phases)
+
+
+def showSetUpTimings(timers):
+    """Show the phases of a layer setUp, as part of the test runner output.
+
+    zope.testrunner reports the time spent setting up a layer on the
+    line that names the layer, so the phases are written in between,
+    if C{LAZR_TESTING_TIMINGS} is set.
+    """
+    if not os.environ.get("LAZR_TESTING_TIMINGS"):
+        return
+    summaries = []
+    for timer in timers:
+        summary = timer.summary()
+        port = timer.details.get("port")
+        if port is not None:
+            summary = "port %s: %s" % (port, summary)
+        summaries.append(summary)
+    if summaries:
+        sys.stdout.write("(%s) " % "; ".join(summaries))
+        sys.stdout.flush()
@@ -0,0 +1,297 @@
+import os
+import time
+import errno
+import fcntl
+import select
+import socket
+import threading
+
+from collections import deque
+
+
+class LogWatcher(object):
+    """Follow the log output of a server process in a background thread.
+
+    Each line read from C{stream} is kept (up to C{max_lines}) and
+    checked against a list of C{markers}, counting how many lines
+    started with each of them. Waiters blocked in L{wait} are woken up
+    through a pipe as soon as a line arrives or the stream is closed,
+    so waiting for a server to come up doesn't use any CPU.
+
+    The stream keeps being drained after the server started, so the
+    server never blocks on a full pipe. The wakeup pipe doesn't need to
+    be: it's non-blocking, and wakeups are dropped while it's full,
+    since a single pending one is enough to wake the waiters up.
+    """
+
+    def __init__(self, stream, markers=(), max_lines=1000):
+        self.stream = stream
+        self.markers = list(markers)
+        self.counts = dict((marker, 0) for marker in self.markers)
+        self.output = deque(maxlen=max_lines)
+        self.closed = False
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        flags = fcntl.fcntl(self._wakeup_w, fcntl.F_GETFL)
+        fcntl.fcntl(self._wakeup_w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._finished = False
+        self._released = False
+        self._thread = threading.Thread(target=self._follow)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _follow(self):
+        try:
+            for line in iter(self.stream.readline, ""):
+                with self._lock:
+                    self.output.append(line)
+                    for marker in self.markers:
+                        if line.startswith(marker):
+                            self.counts[marker] += 1
+                self._notify()
+        finally:
+            self.closed = True
+            self._notify()
+            with self._lock:
+                self._finished = True
+                if self._released:
+                    self._closePipe()
+
+    def _notify(self):
+        # Only called by the following thread, before it may close the
+        # pipe, so the pipe is still open.
+        try:
+            os.write(self._wakeup_w, "x")
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def count(self, marker):
+        """Return how many lines seen so far started with C{marker}."""
+        with self._lock:
+            return self.counts[marker]
+
+    def lines(self):
+        """Return the lines kept so far."""
+        with self._lock:
+            return list(self.output)
+
+    def wait(self, condition, timeout):
+        """Block until C{condition()} is true, or until C{timeout} expires.
+
+        Also returns early if the stream gets closed, which usually
+        means the process exited. Returns the last value of
+        C{condition()}.
+        """
+        deadline = time.time() + timeout
+        while not condition():
+            remaining = deadline - time.time()
+            if self.closed or remaining <= 0:
+                return condition()
+            try:
+                ready, _, _ = select.select(
+                    [self._wakeup_r], [], [], remaining)
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            if ready:
+                os.read(self._wakeup_r, 4096)
+        return True
+
+    def _closePipe(self):
+        if self._wakeup_w is not None:
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_r = self._wakeup_w = None
+
+    def close(self):
+        """Release the wakeup pipe. No one may be waiting anymore.
+
+        If the stream is still being followed, the pipe is released
+        once it's closed.
+        """
+        with self._lock:
+            self._released = True
+            if self._finished:
+                self._closePipe()
+
+
+class OutputTail(object):
+    """The output of a process, read as it comes, of which little is kept.
+
+    Every line is checked for the C{markers} as it's read, so whether
+    they showed up is known however much the process printed, but only
+    the last C{max_lines} lines, cut at C{max_length} characters, are
+    kept for error reports. C{marker in tail} tells whether C{marker}
+    showed up, and C{str(tail)} gives the lines kept.
+    """
+
+    def __init__(self, markers=(), max_lines=100, max_length=4096):
+        self.markers = list(markers)
+        self.max_length = max_length
+        self.seen = set()
+        self.lines = deque(maxlen=max_lines)
+        self.dropped = 0
+        # The end of a line read in bits, where a marker may start.
+        self._overlap = max([len(marker) for marker in self.markers] + [1]) - 1
+        self._partial = ""
+
+    def feed(self, line):
+        text = self._partial + line
+        for marker in self.markers:
+            if marker in text:
+                self.seen.add(marker)
+        self._partial = ""
+        if self._overlap and not line.endswith("\n"):
+            self._partial = text[-self._overlap:]
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line[:self.max_length])
+
+    def consume(self, stream):
+        """Feed the lines of C{stream} until it's closed, and close it."""
+        try:
+            for line in iter(lambda: stream.readline(self.max_length), ""):
+                self.feed(line)
+        finally:
+            stream.close()
+
+    def __contains__(self, marker):
+        return marker in self.seen
+
+    def __nonzero__(self):
+        return bool(self.lines)
+
+    def __str__(self):
+        output = "".join(self.lines)
+        if self.dropped:
+            output = "[%d lines dropped]\n%s" % (self.dropped, output)
+        return output
+
+
+def probePort(port, timeout, host="localhost"):
+    """Wait up to C{timeout} seconds for C{port} to accept connections.
+
+    The port is expected to be ready right away, since this is called
+    once the server reported it started, so retries back off quickly
+    from a few milliseconds.
+    """
+    deadline = time.time() + timeout
+    delay = 0.005
+    while True:
+        s = socket.socket()
+        try:
+            try:
+                s.connect((host, int(port)))
+            except socket.error:
+                pass
+            else:
+                return True
+        finally:
+            s.close()
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.1)
+
+
+class Watchdog(object):
+    """Kill client processes that take too long, from a background thread.
+
+    A process is killed once it ran for C{timeout} seconds, or once
+    C{idle_timeout} seconds passed without progress, as measured by
+    the C{progress} callable given to L{watch}: any change in the value
+    it returns counts as progress. Either timeout may be C{None}.
+
+    A process is also killed as soon as the C{lost} callable given to
+    L{watch} returns true, which tells that the browser running its
+    tests is gone and that it will never finish.
+
+    L{expired} maps the keys of the killed processes to C{(reason,
+    seconds)}, where C{reason} is C{"timeout"}, C{"idle"} or C{"lost"}.
+    Lost processes have no C{seconds}.
+    """
+
+    # Seconds to wait for a process to exit before killing it for good.
+    kill_delay = 5
+
+    def __init__(self, timeout=None, idle_timeout=None, interval=0.25):
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.expired = {}
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def watch(self, key, proc, progress=None, lost=None):
+        """Start watching C{proc}, known as C{key}."""
+        now = time.time()
+        value = None
+        if progress is not None:
+            value = progress()
+        with self._lock:
+            self._watched[key] = {
+                "proc": proc, "progress": progress, "value": value,
+                "lost": lost, "started": now, "active": now, "killed": None}
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.isSet():
+            self._stopped.wait(self.interval)
+            with self._lock:
+                for key, state in self._watched.items():
+                    self._check(key, state, time.time())
+
+    def _check(self, key, state, now):
+        proc = state["proc"]
+        if proc.poll() is not None:
+            return
+        if state["killed"] is not None:
+            if now - state["killed"] >= self.kill_delay:
+                proc.kill()
+            return
+        if state["progress"] is not None:
+            value = state["progress"]()
+            if value != state["value"]:
+                state["value"] = value
+                state["active"] = now
+        if state["lost"] is not None and state["lost"]():
+            self.expired[key] = ("lost", None)
+        elif (self.timeout is not None and
+              now - state["started"] >= self.timeout):
+            self.expired[key] = ("timeout", self.timeout)
+        elif (self.idle_timeout is not None and
+              now - state["active"] >= self.idle_timeout):
+            self.expired[key] = ("idle", self.idle_timeout)
+        else:
+            return
+        state["killed"] = now
+        proc.terminate()
+
+    def stop(self):
+        """Stop watching. The watched processes must have exited."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def makeWatchdog(prefix):
+    """Return a L{Watchdog} configured from the environment, or C{None}.
+
+    C{<prefix>_TIMEOUT} is the number of seconds a client may run, and
+    C{<prefix>_TEST_TIMEOUT} the number of seconds it may run without
+    making progress, that is, without finishing a test.
+    """
+    timeout = os.environ.get("%s_TIMEOUT" % prefix)
+    idle_timeout = os.environ.get("%s_TEST_TIMEOUT" % prefix)
+    if not timeout and not idle_timeout:
+        return None
+    return Watchdog(timeout and float(timeout) or None,
+                    idle_timeout and float(idle_timeout) or None)
@@ -1,68 +1,96 @@
 import os
+import re
 import time
-import fnmatch
+import Queue
 import signal
-import tempfile
+import threading
 import subprocess
 
 from unittest import TestCase
-from subunit import ProtocolTestCase
+
+from lazr.testing.daemon import defaultStateDir, makeStateDir
+from lazr.testing.discovery import DiscoveryIndex, indexPath
+from lazr.testing.durations import balance, durationStore
+from lazr.testing.timing import PhaseTimer, showSetUpTimings
+from lazr.testing.watcher import (
+    LogWatcher, Watchdog, makeWatchdog, probePort)
+
+
+# Lines logged by the server once it is ready to run tests.
+STARTED = ("Running tests locally with:",
+           "to run and report the results")
+
+
+def serverCommand(port):
+    """Return the command starting a I{Yeti} server on C{port}."""
+    cmd = os.environ["YETI"].split() + ["--port", port, "--server"]
+
+    browser = os.environ.get("YETI_BROWSER", "default")
+
+    # Headless browsers are started by the layer once the server is up.
+    if browser and browser != "headless":
+        cmd.extend(["--browsers", browser])
+    return cmd
+
+
+def clientCommand(port):
+    """Return the command running test files on the server on C{port}.
+
+    The test files are to be appended, and the results are written to
+    the standard output as a subunit stream.
+    """
+    return os.environ["YETI"].split() + ["--formatter=subunit",
+                                         "--quiet",
+                                         "--solo=1",
+                                         "--port=%s" % port]
 
 
 def startYeti():
-    yeti = os.environ["YETI"]
     port = os.environ.get("YETI_PORT", "4422")
 
     capture_timeout = int(os.environ.get(
         "YETI_CAPTURE_TIMEOUT", "30"))
 
-    cmd = yeti.split() + ["--port", port, "--server"]
+    cmd = serverCommand(port)
 
-    browser = os.environ.get("YETI_BROWSER", "default")
+    # Follow the server output from a background thread, which wakes
+    # us up as soon as the server reports it started, without polling.
+    # The thread keeps draining the output afterwards, so the server
+    # never blocks writing to it.
+    timer = PhaseTimer(server="yeti", port=port)
+    proc = subprocess.Popen(cmd,
+                            shell=False,
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            close_fds=True)
+    proc.watcher = LogWatcher(proc.stdout, STARTED)
+    proc.timer = timer
+    timer.mark("spawn")
 
-    if browser:
-        cmd.extend(["--browsers", browser])
+    def ready():
+        for marker in STARTED:
+            if proc.watcher.count(marker) > 0:
+                return True
+        return False
 
-    # Redirect stderr through a temporary file, so that it doesn't
-    # block and we don't get an IOError on readline(), apparently
-    # caused by an unhandled SIGINT (Google for it. :)
-    fd, name = tempfile.mkstemp()
-    stderr = open(name)
-    server_started = False
-    rc = None
+    start = time.time()
+    server_started = proc.watcher.wait(ready, capture_timeout)
+    timer.mark("start")
+    # Once the server says it started, make sure it is actually
+    # accepting connections before handing it out to the clients.
+    if server_started:
+        remaining = capture_timeout - (time.time() - start)
+        server_started = probePort(port, max(remaining, 0))
+        timer.mark("probe")
+    output = proc.watcher.lines()
 
-    try:
-        proc = subprocess.Popen(cmd,
-                                shell=False,
-                                stdin=subprocess.PIPE,
-                                stdout=subprocess.PIPE,
-                                stderr=fd,
-                                close_fds=True)
-
-        # Give the server process a few seconds to start, and
-        # capture the browser if needed.
-        output = []
-        start = time.time()
-        while time.time() - start < capture_timeout:
-            rc = proc.poll()
-            if rc is not None:
-                break
-            line = stderr.readline()
-            if not line:
-                continue
-            output.append(line)
-            if line.startswith("Running tests locally with:"):
-                server_started = True
-                break
-            if line.startswith("to run and report the results"):
-                server_started = True
-                break
-    finally:
-        stderr.close()
-
-    if rc is None:
-        rc = proc.poll()
+    rc = proc.poll()
+    if rc is None and proc.watcher.closed:
+        # The output was closed, so the server is on its way out.
+        rc = proc.wait()
     if rc is not None:
+        proc.watcher.close()
         raise ValueError(
             "Failed to execute Yeti server on port %s:"
             "\nError: (%s) %s" %
@@ -85,6 +113,9 @@ def terminateProcess(proc):
     except AttributeError:
         os.kill(proc.pid, signal.SIGTERM)
     proc.wait()
+    watcher = getattr(proc, "watcher", None)
+    if watcher is not None:
+        watcher.close()
 
 
 class YetiLayer(object):
@@ -94,17 +125,367 @@ class YetiLayer(object):
     @classmethod
     def setUp(cls):
         cls.proc = None
+        cls.browsers = None
         if os.environ.get("YETI_SERVER") is None:
             cls.proc = startYeti()
+            if os.environ.get("YETI_BROWSER") == "headless":
+                from lazr.testing.browsers import BrowserPool
+                cls.browsers = BrowserPool(os.environ["YETI_SERVER"],
+                                           yetiParallelism())
+                try:
+                    cls.browsers.start()
+                except:
+                    cls.tearDown()
+                    raise
+                cls.proc.timer.mark("browsers")
+            showSetUpTimings([cls.proc.timer])
 
     @classmethod
     def tearDown(cls):
+        if cls.browsers is not None:
+            cls.browsers.stop()
+            cls.browsers = None
         if cls.proc is not None:
             # If the process was created by us, then that means the
             # environment variable has been set by ourselves too, so
             # we must unset it.
             del os.environ["YETI_SERVER"]
             terminateProcess(cls.proc)
+            cls.proc = None
+
+    @classmethod
+    def lostBrowser(cls):
+        """Return whether a headless browser started by the layer exited.
+        """
+        browsers = getattr(cls, "browsers", None)
+        if browsers is None:
+            return False
+        return not all(browser.isRunning() for browser in browsers.browsers)
+
+    @classmethod
+    def recapture(cls):
+        """Start new headless browsers in place of the ones that exited.
+
+        Returns the number of browsers started.
+        """
+        if getattr(cls, "browsers", None) is None:
+            return 0
+        return cls.browsers.restart()
+
+
+class YetiTimeout(Exception):
+    """A client was killed for taking too long."""
+
+
+class GlobalYetiResult(object):
+    """Stands for a L{YetiTestCase} as a whole in the reported results."""
+
+    failureException = AssertionError
+
+    def __init__(self, name, test_id):
+        self.name = name
+        self.test_id = test_id
+
+    def countTestCases(self):
+        return 1
+
+    def shortDescription(self):
+        return None
+
+    def id(self):
+        return self.test_id
+
+    def __str__(self):
+        return self.name
+
+
+class ProgressStream(object):
+    """Count the lines read from a stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = 0
+
+    def readline(self, *args):
+        line = self.stream.readline(*args)
+        if line:
+            self.lines += 1
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, "")
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def yetiParallelism():
+    """Return how many Yeti clients should run the tests of a test case.
+
+    C{YETI_PARALLEL} is either a number, or C{auto} to run one client
+    per CPU core.
+    """
+    count = os.environ.get("YETI_PARALLEL", "1")
+    if count == "auto":
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    return max(int(count), 1)
+
+
+class StreamRecorder(object):
+    """Queue the results of a subunit stream read in a background thread.
+
+    The events of each test are queued together once the test stops,
+    so that L{multiplexStreams} can report them without mixing them up
+    with the events of tests from other streams. The recorder has the
+    same methods as the result it stands for, so the stream is parsed
+    exactly as if it was reported to that result directly.
+    """
+
+    def __init__(self, result, queue):
+        self._result = result
+        self._queue = queue
+        self._events = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        value = getattr(self._result, name)
+        if not callable(value):
+            return value
+
+        def record(*args, **kwargs):
+            event = (name, args, kwargs)
+            if name == "startTest":
+                self._events = [event]
+            elif self._events is None:
+                self._queue.put([event])
+            else:
+                self._events.append(event)
+                if name == "stopTest":
+                    self._queue.put(self._events)
+                    self._events = None
+        return record
+
+
+class StartedTests(object):
+    """Record the ids of the tests started, for L{ran}.
+
+    C{paths} are the test files being run.
+    """
+
+    def __init__(self, result, paths):
+        self.result = result
+        self.paths = paths
+        self.started = set()
+
+    def __getattr__(self, name):
+        return getattr(self.result, name)
+
+    def startTest(self, test):
+        self.started.add(test.id())
+        self.result.startTest(test)
+
+    def ran(self, path):
+        """Return whether a test of the file at C{path} was started.
+
+        The tests of a file are found by L{testFiles}.
+        """
+        return bool(testFiles(self.started, self.paths).get(path))
+
+
+class DurationRecorder(object):
+    """Record the duration of each test of a subunit stream.
+
+    The durations are taken from the C{time} events of the stream, and
+    put in the C{durations} mapping of test ids to seconds. Everything
+    is passed on to C{result}.
+    """
+
+    def __init__(self, result, durations):
+        self._result = result
+        self._durations = durations
+        self._now = None
+        self._started = {}
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+    def time(self, a_datetime):
+        self._now = a_datetime
+        return self._result.time(a_datetime)
+
+    def startTest(self, test):
+        self._started[test.id()] = self._now
+        return self._result.startTest(test)
+
+    def stopTest(self, test):
+        start = self._started.pop(test.id(), None)
+        if start is not None and self._now is not None:
+            delta = self._now - start
+            self._durations[test.id()] = (
+                delta.days * 86400 + delta.seconds +
+                delta.microseconds / 1000000.0)
+        return self._result.stopTest(test)
+
+
+def testFiles(test_ids, paths):
+    """Return the ids in C{test_ids} of the tests of each file of C{paths}.
+
+    Yeti test ids can't be mapped back to test files, so the tests of a
+    file are taken to be the ones whose id contains the name of the
+    file, with or without its extension, between delimiters. A test
+    whose id contains the names of several files belongs to the file
+    with the longest name.
+    """
+    patterns = []
+    for path in paths:
+        stem, extension = os.path.splitext(os.path.basename(path))
+        patterns.append((len(stem), path, re.compile(
+            r"(?:^|[^\w-])%s(?:%s)?(?:$|[^\w-])" %
+            (re.escape(stem), re.escape(extension)))))
+    files = dict((path, []) for path in paths)
+    for test_id in test_ids:
+        matches = [(length, path) for length, path, pattern in patterns
+                   if pattern.search(test_id)]
+        if matches:
+            longest = max(length for length, path in matches)
+            for length, path in matches:
+                if length == longest:
+                    files[path].append(test_id)
+    return files
+
+
+def fileEstimates(paths, store):
+    """Estimate how long each of the test files at C{paths} takes to run.
+
+    The tests of each file are found by L{testFiles}. As every browser
+    runs every test, the slowest browser is used.
+    """
+    estimates = {}
+    for durations in store.durations.values():
+        for path, test_ids in testFiles(durations, paths).items():
+            if test_ids:
+                seconds = sum(durations[test_id] for test_id in test_ids)
+                estimates[path] = max(estimates.get(path, 0), seconds)
+    return estimates
+
+
+class RetriedTest(object):
+    """Stands for a test that only passed when run again."""
+
+    def __init__(self, test):
+        self.test = test
+
+    def __getattr__(self, name):
+        return getattr(self.test, name)
+
+    def __str__(self):
+        return "%s [passed on retry]" % (self.test,)
+
+
+class FailureFilter(object):
+    """Hold back the tests that fail, so that they can be run again.
+
+    As with L{StreamRecorder}, the events of each test are gathered
+    until the test stops. The events of tests that failed or errored
+    are then kept in L{failed}, by test id, and the others are passed
+    on to C{result}.
+
+    If C{retried} is given, only the tests whose id it contains are
+    considered, and the ones passing are reported as L{RetriedTest}s
+    and listed in L{passed}.
+    """
+
+    def __init__(self, result, retried=None):
+        self.result = result
+        self.retried = retried
+        self.failed = {}
+        self.passed = set()
+        self._events = None
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        value = getattr(self.result, name)
+        if not callable(value):
+            return value
+
+        def record(*args, **kwargs):
+            event = (name, args, kwargs)
+            if name == "startTest":
+                self._events = [event]
+            elif self._events is None:
+                value(*args, **kwargs)
+            else:
+                self._events.append(event)
+                if name == "stopTest":
+                    self._stopTest(args[0].id(), self._events)
+                    self._events = None
+        return record
+
+    def _stopTest(self, test_id, events):
+        if self.retried is not None and test_id not in self.retried:
+            return
+        for name, args, kwargs in events:
+            if name in ("addFailure", "addError"):
+                self.failed[test_id] = events
+                return
+        if self.retried is not None:
+            self.passed.add(test_id)
+        self._report(events)
+
+    def _report(self, events):
+        for name, args, kwargs in events:
+            if (self.retried is not None and
+                (name.startswith("add") or name in ("startTest", "stopTest"))):
+                args = (RetriedTest(args[0]),) + args[1:]
+            getattr(self.result, name)(*args, **kwargs)
+
+    def reportFailures(self):
+        """Report the failures held back, in the order of their ids."""
+        for test_id in sorted(self.failed):
+            self._report(self.failed.pop(test_id))
+
+
+def multiplexStreams(streams, result, durations=None):
+    """Report the subunit C{streams} to C{result}, as they are read.
+
+    Each stream is parsed in its own thread, and the results are
+    reported from the calling thread, one test at a time. If given,
+    C{durations} gets the duration of each test, as recorded by
+    L{DurationRecorder}.
+    """
+    from subunit import ProtocolTestCase
+    from testtools import ExtendedToOriginalDecorator
+    queue = Queue.Queue()
+    # The streams are parsed as if reported to a result supporting
+    # the extended testtools API.
+    extended = ExtendedToOriginalDecorator(result)
+
+    def parse(stream):
+        recorder = StreamRecorder(extended, queue)
+        if durations is not None:
+            recorder = DurationRecorder(recorder, durations)
+        try:
+            ProtocolTestCase(stream).run(recorder)
+        finally:
+            queue.put(None)
+    threads = [threading.Thread(target=parse, args=(stream,))
+               for stream in streams]
+    for thread in threads:
+        thread.setDaemon(True)
+        thread.start()
+    running = len(threads)
+    while running:
+        events = queue.get()
+        if events is None:
+            running -= 1
+            continue
+        for name, args, kwargs in events:
+            getattr(extended, name)(*args, **kwargs)
+    for thread in threads:
+        thread.join()
 
 
 class YetiTestCase(TestCase):
@@ -114,27 +495,200 @@ class YetiTestCase(TestCase):
     reported to unittest through clever subunit usage.
 
     We require a L{tests_directory} class variable to be set by
-    subclasses, and that's the only configuration needed.
+    subclasses, and that's the only configuration needed. Test files
+    are the files in L{tests_directory} matching one of the
+    L{include_patterns}, unless their path relative to it or their name
+    matches one of the L{exclude_patterns}.
     """
     layer = YetiLayer
+    include_patterns = ["test_*.html"]
+    exclude_patterns = []
+
+    def _testFiles(self):
+        """Return the paths of the test files.
+
+        The files found are indexed in C{YETI_INDEX_DIR}, defaulting to
+        the daemon state directory, so that only the directories that
+        changed are listed again on the next run. Set it to an empty
+        value to not keep the index.
+        """
+        state_dir = os.environ.get("YETI_INDEX_DIR")
+        if state_dir is None:
+            state_dir = defaultStateDir()
+            makeStateDir(state_dir)
+        index_path = None
+        if state_dir:
+            index_path = indexPath(state_dir, self.tests_directory,
+                                   self.include_patterns,
+                                   self.exclude_patterns)
+        index = DiscoveryIndex(self.tests_directory, self.include_patterns,
+                               self.exclude_patterns, index_path)
+        paths = index.find()
+        index.save()
+        return paths
 
     def _runTest(self, result):
-        yeti = os.environ["YETI"]
-        port = os.environ.get("YETI_PORT", "4422")
-        cmd = yeti.split() + ["--formatter=subunit",
-                              "--quiet",
-                              "--solo=1",
-                              "--port=%s" % port]
-        for base, dirs, files in os.walk(self.tests_directory):
-            for filename in fnmatch.filter(files, "test_*.html"):
-                cmd.append(os.path.join(base, filename))
-        proc = subprocess.Popen(cmd,
-                                stdin=subprocess.PIPE,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        suite = ProtocolTestCase(proc.stdout)
-        suite.run(result)
-        proc.wait()
+        from testtools import ExtendedToOriginalDecorator
+        cmd = clientCommand(os.environ.get("YETI_PORT", "4422"))
+        timer = PhaseTimer(test=self.id())
+        paths = self._testFiles()
+        timer.mark("discover")
+        # The files are split across the clients so that they take about
+        # as long, according to the durations recorded in
+        # LAZR_TESTING_DURATIONS, or dealt to them in turn.
+        count = min(yetiParallelism(), len(paths)) or 1
+        store = durationStore()
+        estimates = {}
+        if store is not None and count > 1:
+            estimates = fileEstimates(paths, store)
+        shards = balance(paths, count, estimates) or [[]]
+        durations = None
+        if store is not None:
+            durations = {}
+        held = None
+        if int(os.environ.get("YETI_RETRY", "0")) > 0:
+            # Failures are only reported once their files ran again.
+            held = FailureFilter(ExtendedToOriginalDecorator(result))
+        # Headless browsers that exited are started again, before
+        # running the clients and whenever one exits while they run.
+        # Only the layers which started browsers have any to watch.
+        recaptures = int(os.environ.get("YETI_RECAPTURE", "1"))
+        lost = getattr(self.layer, "lostBrowser", None)
+        if recaptures <= 0 or getattr(self.layer, "browsers", None) is None:
+            lost = None
+        elif lost is not None and lost():
+            self.layer.recapture()
+        started = StartedTests(held or result, paths)
+        expired = [self._runClients(cmd, shards, started, durations, timer,
+                                    lost)]
+        while recaptures > 0 and lost is not None:
+            lost_shards = [index for index, (reason, seconds)
+                           in expired[-1].items() if reason == "lost"]
+            if not lost_shards:
+                break
+            self.layer.recapture()
+            recaptures -= 1
+            for index in lost_shards:
+                del expired[-1][index]
+            # The files of the killed clients whose tests didn't start
+            # are run again. The test running when they were killed is
+            # reported as an error, and retried as any other failure.
+            files = [path for index in lost_shards
+                     for path in shards[index] if not started.ran(path)]
+            if not files:
+                break
+            shards = [files]
+            expired.append(self._runClients(cmd, shards, started, durations,
+                                            lost=lost))
+        timer.mark("run")
+        if held is not None:
+            if held.failed:
+                expired.extend(
+                    self._retryFailures(cmd, paths, held, durations))
+                timer.mark("retry")
+            held.reportFailures()
+        if durations:
+            store.record(os.environ.get("YETI_BROWSER", "default"), durations)
+            store.save()
+        for client_expired in expired:
+            self._reportTimeouts(result, client_expired)
+
+    def _runClients(self, cmd, shards, result, durations=None, timer=None,
+                    lost=None):
+        """Run a client for each shard of test files.
+
+        The results are reported to C{result} as they are parsed from
+        the streams. If given, C{durations} gets the duration of each
+        test, and C{timer} marks the end of the C{spawn} phase.
+
+        Clients are killed once they ran for C{YETI_TIMEOUT} seconds, or
+        after C{YETI_TEST_TIMEOUT} seconds without any output, or as
+        soon as C{lost()}, if given, is true. Returns the timeouts of the
+        killed clients, by index.
+        """
+        from subunit import ProtocolTestCase
+        from testtools import ExtendedToOriginalDecorator
+        watchdog = makeWatchdog("YETI")
+        if watchdog is None and lost is not None:
+            watchdog = Watchdog()
+        procs = []
+        streams = []
+        for index, shard in enumerate(shards):
+            proc = subprocess.Popen(cmd + shard,
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            stream = proc.stdout
+            if watchdog is not None:
+                stream = ProgressStream(stream)
+                watchdog.watch(index, proc, lambda stream=stream: stream.lines,
+                               lost)
+            procs.append(proc)
+            streams.append(stream)
+        if timer is not None:
+            timer.mark("spawn")
+        # The test running when a client is killed is reported as an
+        # error when its stream ends.
+        try:
+            if len(streams) == 1:
+                suite = ProtocolTestCase(streams[0])
+                if durations is None:
+                    suite.run(result)
+                else:
+                    suite.run(DurationRecorder(
+                        ExtendedToOriginalDecorator(result), durations))
+            else:
+                multiplexStreams(streams, result, durations)
+        finally:
+            for proc in procs:
+                proc.wait()
+            if watchdog is not None:
+                watchdog.stop()
+        if watchdog is None:
+            return {}
+        return watchdog.expired
+
+    def _retryFailures(self, cmd, paths, held, durations=None):
+        """Run the test files of the tests held back by C{held} again.
+
+        C{YETI_RETRY} is the number of times they're run again, by a
+        single client. The files run again are the ones L{testFiles}
+        finds the failed tests in. Tests passing on a retry are reported
+        as L{RetriedTest}s, and the others are left in C{held} with
+        their last failure.
+
+        Returns the timeouts of the clients that were killed.
+        """
+        retries = int(os.environ.get("YETI_RETRY", "0"))
+        expired = []
+        for attempt in range(retries):
+            failed = testFiles(held.failed, paths)
+            files = [path for path in paths if failed[path]]
+            if not files:
+                break
+            retry = FailureFilter(held.result, retried=set(held.failed))
+            expired.append(self._runClients(cmd, [files], retry, durations))
+            for test_id in retry.passed:
+                del held.failed[test_id]
+            held.failed.update(retry.failed)
+        return expired
+
+    def _reportTimeouts(self, result, expired):
+        for index, (reason, seconds) in sorted(expired.items()):
+            if reason == "timeout":
+                message = ("Yeti client %d killed after running for %s"
+                           " seconds" % (index, seconds))
+            elif reason == "lost":
+                message = ("Yeti client %d stopped after its browser was"
+                           " lost" % index)
+            else:
+                message = ("Yeti client %d killed after making no"
+                           " progress for %s seconds" % (index, seconds))
+            test_result = GlobalYetiResult(str(self), self.id())
+            result.startTest(test_result)
+            result.addError(test_result,
+                            (YetiTimeout, YetiTimeout(message), None))
+            result.stopTest(test_result)
 
     def run(self, result=None):
         if result is None: